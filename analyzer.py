@@ -1,5 +1,6 @@
 import ast
 import collections
+import logging
 from collections import ChainMap
 import sys
 from types import FunctionType, ModuleType
@@ -7,18 +8,16 @@ from typing import Union, Iterator, get_origin, get_args, Optional, TypeVar
 # from pydoc import safeimport, locate
 from pprint import pprint
 
-import typed_ast
+import typed_ast._ast3
 import typing
 
 import typeshed_client.parser
 from typeshed_client import ImportedName
 
+import profiling
 from shared_state import builtin
-from models import Scope
-
-
-def _print(a):
-    print(ast.dump(a, indent=4))
+from models import Scope, load_builtins
+from tracing import INFERENCE, Dump
 
 
 def ast_to_type(c: ast.AST, state: Scope) -> type:  # | tuple[type]
@@ -30,7 +29,7 @@ def ast_to_type(c: ast.AST, state: Scope) -> type:  # | tuple[type]
         return tuple(ast_to_type(elt, state) for elt in c.elts)
     elif isinstance(c, typed_ast._ast3.BinOp):
         return ast_to_type(c.left, state) | ast_to_type(c.right, state)
-    print(c)
+    INFERENCE.debug("can't turn %s into a type", Dump(c))
 
 
 # def resolve_generic_attr(cls: type, attr: str) -> type: ...
@@ -65,9 +64,69 @@ def lookup_call_args(typ: type | ModuleType, _func_name: str, state: dict) -> li
     return [ast_to_type(arg.annotation, state) for arg in args]
 
 
+class CallResultCache:
+    """
+    (receiver type, method name, arg types, state) -> solved return type, least recently used out first.
+    comprehensions ask for `__iter__` of the same few types (`list[int]`, `str`, ...) over and over. the names in the stubs' annotations are looked
+    up in `state`, and a scope may shadow them, so answers aren't shared between scopes. the key holds the scope itself rather than its id, so an
+    id can't be reused by another scope while the answer is cached.
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self.maxsize = maxsize
+        self._data: collections.OrderedDict[tuple, type] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: tuple) -> type:
+        """:raise KeyError: if it isn't cached"""
+        value = self._data[key]
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: tuple, value: type) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+call_results = CallResultCache()
+
+
+@profiling.timed('inference')
 def resolve_generic_func(cls: type, func_name: str, args: tuple[type] | tuple[()], state: dict) -> type:
+    key = (cls, func_name, tuple(args), state)
+    try:
+        ret = call_results.get(key)
+    except KeyError:
+        pass
+    except TypeError:
+        # something unhashable in there. just work it out.
+        return _resolve_generic_func(cls, func_name, args, state)
+    else:
+        call_results.hits += 1
+        return ret
+
+    call_results.misses += 1
+    ret = _resolve_generic_func(cls, func_name, args, state)
+    call_results.put(key, ret)
+    return ret
+
+
+def _resolve_generic_func(cls: type, func_name: str, args: tuple[type] | tuple[()], state: dict) -> type:
     bases = [ast_to_type(base, state) for base in state[cls.__name__].ast.bases]
-    print(f"{bases=}")
+    INFERENCE.debug("bases of %s: %s", cls, bases)
 
     ret = lookup_call_result(cls, func_name, args, state)
 
@@ -132,6 +191,7 @@ def resolve_generic_func(cls: type, func_name: str, args: tuple[type] | tuple[()
         return fill_gen(ret)
 
 
+@profiling.timed('inference')
 def resolve_generic_init(construct_class: type, args: tuple[type], state: Scope) -> type:
     """
     todo: when @overload is supported, depecrate this. replace with:
@@ -152,13 +212,11 @@ def resolve_generic_init(construct_class: type, args: tuple[type], state: Scope)
             return construct_class
         return cls[get_args(resolve_generic_func(args[0], '__iter__', (args[0],), state))]
     elif issubclass(cls, dict):
-        print(1, args[0])
         if issubclass(args[0], dict):
             return args[0]
         else:
             a = []
             b = []
-            print(args[0])
             for i, c in enumerate(map(get_args, get_args(args[0]))):
                 if len(c) == 0:
                     a.append(typing.Any)
@@ -189,6 +247,7 @@ def _next(typ: collections.abc.Iterator | collections.abc.Generator) -> type:
         raise NotImplementedError("Didn't do generators yet")
 
 
+@profiling.timed('inference')
 def get_type(node: ast.expr | ast.stmt | ast.AST, state: Scope) -> Optional[type]:
     """
 
@@ -202,7 +261,8 @@ def get_type(node: ast.expr | ast.stmt | ast.AST, state: Scope) -> Optional[type
     #
     # state = global_state | _locals
 
-    _print(node)
+    if INFERENCE.isEnabledFor(logging.DEBUG):
+        INFERENCE.debug("get_type %s", Dump(node), extra={'fields': {'node': type(node).__name__, 'lineno': getattr(node, 'lineno', None)}})
     if isinstance(node, ast.Expr):
         return get_type(node.value, state)
     elif isinstance(node, ast.Constant):
@@ -211,7 +271,7 @@ def get_type(node: ast.expr | ast.stmt | ast.AST, state: Scope) -> Optional[type
     elif isinstance(node, ast.List):
         return list[Union[tuple(get_type(elt, state) for elt in node.elts)]]
     elif isinstance(node, ast.ListComp):
-        locco = Scope(node, state, is_comp_gen=True)
+        locco = state.child(node, is_comp_gen=True)
         for gen in node.generators:
             locco.store(gen.target.id, _next(resolve_generic_func(b := get_type(gen.iter, state), '__iter__', (b,), state)))
         return get_type(node.elt, locco)
@@ -231,12 +291,12 @@ def get_type(node: ast.expr | ast.stmt | ast.AST, state: Scope) -> Optional[type
     elif isinstance(node, ast.Dict):
         return dict
     elif isinstance(node, ast.DictComp):
-        # Scope(node, state, is_comp_gen=True)
+        # state.child(node, is_comp_gen=True)
         return dict
     elif isinstance(node, ast.Set):
         return set[Union[tuple(get_type(elt, state) for elt in node.elts)]]
     elif isinstance(node, ast.SetComp):
-        locco = Scope(node, state, is_comp_gen=True)
+        locco = state.child(node, is_comp_gen=True)
         for gen in node.generators:
             locco.store(gen.target.id, _next(resolve_generic_func(b := get_type(gen.iter, state), '__iter__', (b,), state)))
         return get_type(node.elt, locco)
@@ -301,10 +361,460 @@ constant, list, listcomp, starred?,
 tuple, dict, dictcomp, set, setcomp 
 """
 
-code = ast.parse("[b:=(a, 2) for a in '123']")
-_globals = Scope(meat=code, parent_scope=builtin)
-_globals._import('random')
-print(ast_to_type(_globals.load('random'), _globals))
+
+_COMPREHENSIONS = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+_SCOPE_NODES = (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef, *_COMPREHENSIONS)
+
+
+def _target_loads(comp: ast.ListComp | ast.SetComp | ast.DictComp | ast.GeneratorExp) -> set[int]:
+    """ids of the loads in `comp` of the names its own `for`s bind"""
+    targets = {name.id for gen in comp.generators for name in ast.walk(gen.target) if isinstance(name, ast.Name)}
+    return {id(load) for load in ast.walk(comp) if isinstance(load, ast.Name) and isinstance(load.ctx, ast.Load) and load.id in targets}
+
+
+class _Binding:
+    """one definition of a name. `value` is None when it can't be typed from an expression (imports, loop targets, parameters, `+=`, ...)."""
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name: str, value: Optional[ast.expr]) -> None:
+        self.name = name
+        self.value = value
+
+    def __repr__(self) -> str:
+        return f"_Binding({self.name!r}, {None if self.value is None else ast.unparse(self.value)!r})"
+
+
+UNBOUND = _Binding('<unbound>', None)  # reaches a load along a path where the name was never assigned (or was deleted)
+_MAYBE_UNBOUND = frozenset({UNBOUND})
+CALLED = _Binding('<called>', None)  # a call may have run one of the functions that assign the name through `global` or `nonlocal`
+_MAYBE_CALLED = frozenset({CALLED})
+
+Env = dict[str, frozenset[_Binding]]
+
+
+def _merge(a: Env, b: Env) -> Env:
+    """where two paths meet. a name only one of them assigned may be unbound."""
+    return {name: a.get(name, _MAYBE_UNBOUND) | b.get(name, _MAYBE_UNBOUND) for name in a.keys() | b.keys()}
+
+
+class _Definitions:
+    """
+    reaching definitions, worked out once per module.
+
+    each scope's statements are run through with an environment of name -> the bindings that may reach that point. branches are merged, loops
+    are run until their environment stops growing. every `Name` load records the environment of the scope it's in (comprehensions run on the spot,
+    so they see their enclosing scope's); function and class bodies start from an empty one with their parameters bound.
+
+    a load of a name owned by another scope (a global read from a function, which runs who knows when) takes every binding of that scope, from
+    `bindings`. names are bound under the scope that owns them, as `scope` (the symbol table of `tree`) tells, so `global` and `nonlocal` writes
+    land in the module or the enclosing function. a call there may run any of them: it adds `CALLED` to what reaches the names written that way.
+    """
+
+    def __init__(self, tree: ast.Module, scope: Scope) -> None:
+        self.enclosing: dict[int, ast.AST] = {}  # id(node) -> the scope node it's in
+        self._noted: dict[int, ast.AST] = {}  # the rewriter drops the nodes it replaces; these keep them, so their ids aren't reused
+        self._table = scope.table
+        nodes = {id(node): node for node in ast.walk(tree) if isinstance(node, _SCOPE_NODES)}
+        self.scope_nodes: dict[int, ast.AST] = {id(s): nodes[node_id] for node_id, s in self._table.items() if node_id in nodes}  # id(Scope) -> node
+        self.bindings: dict[tuple[int, str], list[_Binding]] = collections.defaultdict(list)  # (id(scope node), name) -> all its bindings
+        self.values: dict[int, list[_Binding]] = collections.defaultdict(list)  # id(node) -> the bindings whose value it's in
+        # id(scope node) -> its names some other scope assigns, through `global` or `nonlocal`
+        self.escaping: dict[int, set[str]] = collections.defaultdict(set)
+        for node_id, s in self._table.items():
+            for name in s.globals | s.nonlocals:
+                owner = s.owner(name)
+                if owner is not None and owner is not s and id(owner) in self.scope_nodes:
+                    self.escaping[id(self.scope_nodes[id(owner)])].add(name)
+        self.reaching: dict[int, tuple[ast.AST, frozenset[_Binding]]] = {}  # id(load) -> (flow scope node, what reaches it)
+        self._made: dict[tuple[int, str], _Binding] = {}
+        self._deferred: list[tuple[ast.AST, typing.Callable[[Env], Env]]] = []
+        self.current: ast.AST = tree
+        self.flow_scope: ast.AST = tree
+
+        self._note(tree)
+        self._block(tree.body, {})
+        while self._deferred:
+            # nested bodies run once, after their definition. running them inside a loop's fixed point would only repeat the work.
+            node, body = self._deferred.pop()
+            self.current = self.flow_scope = node
+            body({})
+
+    # bookkeeping
+
+    def _note(self, node: ast.AST) -> None:
+        self.enclosing[id(node)] = self.current
+        self._noted[id(node)] = node
+
+    def index(self, value: ast.AST, binding: _Binding) -> None:
+        """note that the nodes of `value` are part of `binding`'s value"""
+        for node in ast.walk(value):
+            self.values[id(node)].append(binding)
+
+    def _bind(self, env: Env, name: str, at: ast.AST, value: Optional[ast.expr], scope: Optional[ast.AST] = None) -> None:
+        scope = scope or self.current
+        declared = self._table.get(id(scope))
+        if declared is not None:
+            # `global` and `nonlocal` names belong further out
+            scope = self.scope_nodes.get(id(declared.owner(name)), scope)
+        key = (id(at), name)
+        binding = self._made.get(key)
+        if binding is None:
+            binding = self._made[key] = _Binding(name, value)
+            self.bindings[id(scope), name].append(binding)
+            if value is not None:
+                self.index(value, binding)
+        if scope is self.flow_scope:
+            env[name] = frozenset({binding})
+
+    def _bind_target(self, env: Env, target: ast.expr, at: ast.AST) -> None:
+        """a target that isn't a plain name (tuples, starred, subscripts); whatever names it binds get untyped bindings"""
+        self._note(target)
+        if isinstance(target, ast.Name):
+            self._bind(env, target.id, at, None)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            for elt in target.elts:
+                self._bind_target(env, elt, at)
+        elif isinstance(target, ast.Starred):
+            self._bind_target(env, target.value, at)
+        else:
+            self._expr(target, env)  # `a[i] = ...`, `a.b = ...` load `a` (and `i`)
+
+    # expressions
+
+    def _expr(self, node: ast.AST, env: Env) -> None:
+        self._note(node)
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                self.reaching[id(node)] = (self.flow_scope, env.get(node.id, _MAYBE_UNBOUND))
+            else:
+                self._bind(env, node.id, node, None)
+        elif isinstance(node, ast.NamedExpr):
+            self._expr(node.value, env)
+            self._note(node.target)
+            scope = self.current
+            while isinstance(scope, _COMPREHENSIONS):
+                scope = self.enclosing[id(scope)]
+            self._bind(env, node.target.id, node, node.value, scope)
+        elif isinstance(node, ast.Lambda):
+            self._function(node, env)
+        elif isinstance(node, _COMPREHENSIONS):
+            self._comprehension(node, env)
+        else:
+            for child in ast.iter_child_nodes(node):
+                self._expr(child, env)
+            if isinstance(node, ast.Call):
+                for name in self.escaping.get(id(self.flow_scope), ()):
+                    env[name] = env.get(name, _MAYBE_UNBOUND) | _MAYBE_CALLED
+
+    def _comprehension(self, node: ast.ListComp | ast.SetComp | ast.DictComp | ast.GeneratorExp, env: Env) -> None:
+        # the first iterable is evaluated outside. the targets are the comprehension's own; `get_type` binds those itself.
+        self._expr(node.generators[0].iter, env)
+        outer, self.current = self.current, node
+        for i, gen in enumerate(node.generators):
+            self._note(gen)
+            self._bind_target(env, gen.target, gen)
+            if i:
+                self._expr(gen.iter, env)
+            for cond in gen.ifs:
+                self._expr(cond, env)
+        for field in ('elt', 'key', 'value'):
+            if hasattr(node, field):
+                self._expr(getattr(node, field), env)
+        self.current = outer
+
+    def _function(self, node: ast.FunctionDef | ast.AsyncFunctionDef | ast.Lambda, env: Env) -> None:
+        args = node.args
+        for child in [*getattr(node, 'decorator_list', ()), *args.defaults, *(d for d in args.kw_defaults if d is not None)]:
+            self._expr(child, env)
+        if not isinstance(node, ast.Lambda):
+            self._bind(env, node.name, node, None)
+
+        def body(inner: Env) -> Env:
+            for arg in args.posonlyargs + args.args + args.kwonlyargs + [a for a in (args.vararg, args.kwarg) if a is not None]:
+                self._note(arg)
+                self._bind(inner, arg.arg, arg, None)
+            if isinstance(node, ast.Lambda):
+                self._expr(node.body, inner)
+                return inner
+            return self._block(node.body, inner)
+        self._deferred.append((node, body))
+
+    # statements
+
+    def _block(self, stmts: list[ast.stmt], env: Env) -> Env:
+        for stmt in stmts:
+            env = self._stmt(stmt, env)
+        return env
+
+    def _loop(self, env: Env, head: typing.Callable[[Env], Env], body: list[ast.stmt], orelse: list[ast.stmt]) -> Env:
+        """`head` evaluates the test (or binds the target) on every round. `break`s are taken as falling out of the bottom."""
+        entry = env
+        while True:
+            after = self._block(body, head(dict(entry)))
+            grown = _merge(env, after)
+            if grown == entry:
+                break
+            entry = grown
+        return self._block(orelse, entry)
+
+    def _stmt(self, stmt: ast.stmt, env: Env) -> Env:
+        self._note(stmt)
+        env = dict(env)
+
+        if isinstance(stmt, ast.Assign):
+            self._expr(stmt.value, env)
+            for target in stmt.targets:
+                if isinstance(target, ast.Name):
+                    self._note(target)
+                    self._bind(env, target.id, stmt, stmt.value)
+                else:
+                    self._bind_target(env, target, stmt)
+        elif isinstance(stmt, ast.AnnAssign):
+            self._expr(stmt.annotation, env)
+            if stmt.value is not None:
+                self._expr(stmt.value, env)
+                if isinstance(stmt.target, ast.Name):
+                    self._note(stmt.target)
+                    self._bind(env, stmt.target.id, stmt, stmt.value)
+                else:
+                    self._bind_target(env, stmt.target, stmt)
+            else:
+                self._note(stmt.target)
+        elif isinstance(stmt, ast.AugAssign):
+            self._expr(stmt.value, env)
+            if isinstance(stmt.target, ast.Name):
+                self._note(stmt.target)
+                self.reaching[id(stmt.target)] = (self.flow_scope, env.get(stmt.target.id, _MAYBE_UNBOUND))
+            self._bind_target(env, stmt.target, stmt)
+        elif isinstance(stmt, ast.Delete):
+            for target in stmt.targets:
+                self._note(target)
+                if isinstance(target, ast.Name):
+                    env[target.id] = _MAYBE_UNBOUND
+                else:
+                    self._expr(target, env)
+        elif isinstance(stmt, (ast.Import, ast.ImportFrom)):
+            for alias in stmt.names:
+                if alias.name != '*':
+                    self._bind(env, alias.asname or alias.name.split('.')[0], alias, None)
+        elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            self._function(stmt, env)
+        elif isinstance(stmt, ast.ClassDef):
+            for child in stmt.decorator_list + stmt.bases + stmt.keywords:
+                self._expr(child, env)
+            self._bind(env, stmt.name, stmt, None)
+            self._deferred.append((stmt, lambda inner: self._block(stmt.body, inner)))
+        elif isinstance(stmt, ast.If):
+            self._expr(stmt.test, env)
+            env = _merge(self._block(stmt.body, env), self._block(stmt.orelse, env))
+        elif isinstance(stmt, ast.While):
+            def test(e: Env) -> Env:
+                self._expr(stmt.test, e)
+                return e
+            env = self._loop(env, test, stmt.body, stmt.orelse)
+        elif isinstance(stmt, (ast.For, ast.AsyncFor)):
+            self._expr(stmt.iter, env)
+
+            def target(e: Env) -> Env:
+                self._bind_target(e, stmt.target, stmt)
+                return e
+            env = self._loop(env, target, stmt.body, stmt.orelse)
+        elif isinstance(stmt, (ast.With, ast.AsyncWith)):
+            for item in stmt.items:
+                self._expr(item.context_expr, env)
+                if item.optional_vars is not None:
+                    self._bind_target(env, item.optional_vars, stmt)
+            env = self._block(stmt.body, env)
+        elif isinstance(stmt, (ast.Try, getattr(ast, 'TryStar', ast.Try))):
+            # a handler can start from anywhere in the body
+            body = self._block(stmt.body, env)
+            start = _merge(env, body)
+            ends = [self._block(stmt.orelse, body)]
+            for handler in stmt.handlers:
+                self._note(handler)
+                inner = dict(start)
+                if handler.type is not None:
+                    self._expr(handler.type, inner)
+                if handler.name is not None:
+                    self._bind(inner, handler.name, handler, None)
+                inner = self._block(handler.body, inner)
+                if handler.name is not None:
+                    inner[handler.name] = _MAYBE_UNBOUND  # deleted at the end of the handler
+                ends.append(inner)
+            env = ends[0]
+            for end in ends[1:]:
+                env = _merge(env, end)
+            env = self._block(stmt.finalbody, env)
+        elif isinstance(stmt, ast.Match):
+            self._expr(stmt.subject, env)
+            ends = [env]  # no case matched
+            for case in stmt.cases:
+                inner = dict(env)
+                for node in ast.walk(case.pattern):
+                    self._note(node)
+                    name = getattr(node, 'name', None) or getattr(node, 'rest', None)
+                    if isinstance(name, str):
+                        self._bind(inner, name, node, None)
+                    if isinstance(node, ast.expr):
+                        self._expr(node, inner)
+                if case.guard is not None:
+                    self._expr(case.guard, inner)
+                ends.append(self._block(case.body, inner))
+            env = ends[0]
+            for end in ends[1:]:
+                env = _merge(env, end)
+        else:
+            # return, raise, assert, expression statements, ...
+            for child in ast.iter_child_nodes(stmt):
+                self._expr(child, env)
+        return env
+
+
+class DemandTyper:
+    """
+    `rewriter.Typer` that only works out what's asked. `type_of(node)` types the names `node` reads from the assignments that reach them (and those
+    from theirs, and so on), and memoizes every answer per node. nothing is inferred for code no constraint is checked against, and no statement is
+    bound eagerly, so imports are never loaded just in case.
+
+    `tree` is the one the rewriter walks. the reaching definitions of `_Definitions` are worked out before its first rewrite, so they only ever
+    look at the original module, and its nodes are known by identity. `replaced` tells about the rest: copies of bound nodes are typed as the
+    nodes they copy, and the nodes a template makes up are inferred on their own, in the scope of the node they replaced. a rewrite doesn't have
+    to keep the type (`map` -> a generator expression), so they never take it over from there. for the same reason an assignment whose value a
+    rewrite replaced binds `new` from then on.
+    """
+
+    def __init__(self, tree: ast.Module) -> None:
+        self.tree = tree
+        self._definitions: Optional[_Definitions] = None
+        self._scope: Optional[Scope] = None
+        self._scope_nodes: dict[int, ast.AST] = {}  # id(Scope) -> the node that introduced it
+        self._memo: dict[int, tuple[ast.AST, Optional[type]]] = {}  # keeps the node, so its id isn't reused
+        self._copies: dict[int, tuple[ast.AST, ast.AST]] = {}  # id(copy of a bound node) -> (the copy, the node of the tree it stands for)
+        self._made: dict[int, tuple[ast.AST, ast.AST]] = {}  # id(node a template made) -> (the node, the scope node it's in)
+
+    def _build(self) -> None:
+        # the first question pays for one walk and the symbol table. files no rule matched in never get here.
+        load_builtins()  # already, in a worker
+        self._scope = Scope(meat=self.tree, parent_scope=builtin)
+        self._definitions = _Definitions(self.tree, self._scope)
+        self._scope_nodes = self._definitions.scope_nodes
+
+    def _own(self, node: ast.AST) -> ast.AST:
+        """the node of the tree that `node` is a copy of, or `node` itself"""
+        copied = self._copies.get(id(node))
+        return node if copied is None else copied[1]
+
+    def _enclosing(self, node: ast.AST) -> ast.AST:
+        enclosing = self._definitions.enclosing.get(id(node))
+        if enclosing is None:
+            made = self._made.get(id(node))
+            enclosing = self.tree if made is None else made[1]
+        return enclosing
+
+    def _scope_at(self, node: ast.AST) -> Scope:
+        return self._scope.table.get(id(self._enclosing(node)), self._scope)
+
+    def replaced(self, old: ast.expr, new: ast.expr, copies: dict[int, ast.AST]) -> None:
+        if self._definitions is None:
+            self._build()  # before anything in the tree has changed
+        bindings = list(self._definitions.values.get(id(old), ()))
+        if bindings:
+            # an assignment's value was (or had in it) `old`. loads of the name now get what `new` makes, and anything typed from them is stale.
+            for binding in bindings:
+                if binding.value is old:
+                    binding.value = new
+                self._definitions.index(new, binding)
+            self._memo.clear()
+        old = self._own(old)
+        enclosing = self._enclosing(old)
+        todo = [new]
+        while todo:
+            node = todo.pop()
+            bound = copies.get(id(node))
+            if bound is None:
+                self._made[id(node)] = (node, enclosing)
+                todo.extend(ast.iter_child_nodes(node))
+                continue
+            for copy, original in zip(ast.walk(node), ast.walk(bound)):
+                self._copies[id(copy)] = (copy, self._own(original))
+
+    def __call__(self, node: ast.expr) -> Optional[type]:
+        return self.type_of(node)
+
+    def type_of(self, node: ast.expr) -> Optional[type]:
+        if self._definitions is None:
+            self._build()
+        own = self._own(node)
+        try:
+            return self._memo[id(own)][1]
+        except KeyError:
+            pass
+        self._memo[id(own)] = (own, None)  # unknown while it's being worked out, which also stops `x = [x]` from recursing forever
+        typ = self._infer(own)
+        self._memo[id(own)] = (own, typ)
+        return typ
+
+    def _reaching(self, node: ast.Name) -> Optional[type]:
+        """the type of what `node` reads: the union of the bindings that reach it"""
+        owner = self._scope_at(node).owner(node.id)
+        if owner is None or owner.parent_scope is None:
+            return None  # unbound or builtin
+        owner_node = self._scope_nodes.get(id(owner))
+        flow_scope, reaching = self._definitions.reaching.get(id(node), (None, None))
+        if flow_scope is owner_node:
+            if UNBOUND in reaching:
+                INFERENCE.debug("line %s: `%s` may be used before it's assigned", node.lineno, node.id)
+                return None
+            if CALLED in reaching:
+                reaching = (reaching - _MAYBE_CALLED) | frozenset(self._definitions.bindings.get((id(owner_node), node.id), ()))
+        else:
+            # read from a nested function (or a class body, or a node a rewrite made), whenever that runs
+            reaching = self._definitions.bindings.get((id(owner_node), node.id), [])
+        values = [binding.value for binding in reaching]
+        if not values or None in values:
+            return None
+        types = [self.type_of(value) for value in values]
+        if None in types:
+            return None
+        return types[0] if len(set(types)) == 1 else Union[tuple(types)]
+
+    def _infer(self, node: ast.expr) -> Optional[type]:
+        if isinstance(node, ast.Name):
+            return self._reaching(node)
+
+        # give `get_type` the names it's going to load. the ones bound by comprehensions inside `node` it binds itself.
+        inside = {id(child) for child in ast.walk(node)}
+        # a comprehension a template made isn't in the symbol table, so what it binds is found by name
+        made_targets = set()
+        for comp in ast.walk(node):
+            if isinstance(comp, _COMPREHENSIONS) and id(comp) in self._made:
+                made_targets |= _target_loads(comp)
+        for name in ast.walk(node):
+            if not (isinstance(name, ast.Name) and isinstance(name.ctx, ast.Load)):
+                continue
+            if id(name) in made_targets:
+                continue
+            owner = self._scope_at(name).owner(name.id)
+            if owner is not None and id(self._scope_nodes.get(id(owner))) in inside:
+                continue
+            typ = self.type_of(name)
+            if typ is None:
+                return None
+            owner.state[name.id] = typ
+        try:
+            return get_type(node, self._scope_at(node))
+        except Exception:
+            return None
+
+    def bind(self, stmt: ast.stmt) -> None:
+        pass  # nothing's bound up front; see `type_of`.
+
+
+if __name__ == '__main__':
+    code = ast.parse("[b:=(a, 2) for a in '123']")
+    _globals = Scope(meat=code, parent_scope=builtin)
+    _globals._import('random')
+    print(ast_to_type(_globals.load('random'), _globals))
 # print(9, code, globals)
 # print(globals.load('b'))
 
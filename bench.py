@@ -0,0 +1,309 @@
+"""
+benchmarks for the slow parts: reading the rules, loading stubs, type inference and whole rewrite runs.
+
+    python bench.py                                  # everything, results in bench_results.json
+    python bench.py --only rules,e2e --workers 4
+    python bench.py --out new.json --compare old.json
+
+the corpus is generated into `bench_corpus/` from a fixed seed: synthetic files full of sites that `rules.txt` matches (`random.*`, `map`/`filter`,
+comprehensions, `str(a) + '...'`) plus a few real stdlib modules, copied from the running interpreter, for realistic shapes.
+the json results carry the commit, python version and stub cache key, so runs can be compared across commits.
+"""
+import argparse
+import ast
+import collections
+import importlib
+import inspect
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+from pathlib import Path
+from typing import Callable
+
+import stub_cache
+from settings_shid import get_rule_packs
+
+if typing.TYPE_CHECKING:
+    import models  # imported where it's used
+
+
+CORPUS_DIR = Path(__file__).parent / 'bench_corpus'
+REAL_MODULES = ('random', 'statistics', 'textwrap', 'csv', 'fractions', 'string', 'shlex')
+
+# every template is a statement. `{n}` is a fresh number, `{name}` one of the names the file defines up top.
+_SITES = (
+    "random.randint(0, {n})",
+    "random.randint(0, len({name}))",
+    "{name}[random.randrange(0, len({name}), 2)]",
+    "[random.choice({name}) for _ in range({n})]",
+    "random.random() * {n}.5",
+    "random.uniform(0, {n}.0) + 1.5",
+    "int(random.uniform({n}, {n}0)) * 3",
+    "list(map(str, {name}))",
+    "set(map(abs, {name}))",
+    "list(filter(bool, {name}))",
+    "list(x * 2 for x in {name})",
+    "str({n}) + 'px'",
+    "print(str({name}))",
+    "v{n} = [y for y in {name} if y]",
+    "v{n} = {{y for y in {name}}}",
+)
+_PRELUDE = "import random\n\nfoo = [1, 2, 3, 4, 5, 6, 7]\nbar = [0.5, 1.5, 2.5]\nbaz = 'abcdef'\n\n"
+
+
+def make_corpus(directory: Path = CORPUS_DIR, files: int = 50, sites: int = 200, seed: int = 0) -> list[Path]:
+    """:return: the synthetic files, then the real modules"""
+    rng = random.Random(seed)
+    if directory.exists():
+        shutil.rmtree(directory)
+    directory.mkdir(parents=True)
+
+    paths = []
+    for i in range(files):
+        lines = []
+        for n in range(sites):
+            lines.append(rng.choice(_SITES).format(n=n + 1, name=rng.choice(('foo', 'bar', 'baz'))))
+        path = directory / f'synthetic_{i:03}.py'
+        path.write_text(_PRELUDE + '\n'.join(lines) + '\n', encoding='utf-8')
+        paths.append(path)
+
+    for name in REAL_MODULES:
+        source = inspect.getsourcefile(importlib.import_module(name))
+        path = directory / f'real_{name}.py'
+        shutil.copyfile(source, path)
+        paths.append(path)
+    return paths
+
+
+def _timings(func: Callable[[], object], repeat: int, setup: Callable[[], object] | None = None) -> dict:
+    """:param setup: run before each sample, outside the timed part"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'repeat': repeat, 'min': min(times), 'median': statistics.median(times), 'max': max(times)}
+
+
+def bench_rules(args: argparse.Namespace, corpus: list[Path]) -> dict:
+    import rule_cache
+    from matcher import compile_packs
+
+    setting = args.rules.split(',')
+    packs = get_rule_packs(setting)
+
+    def cached():
+        stub_cache._memory.clear()
+        rule_cache.load(setting)
+
+    rule_cache.load(setting)
+    return {'get_rules': _timings(lambda: get_rule_packs(args.rules.split(',')), args.repeat),
+            'compile_rules': _timings(lambda: compile_packs(packs), args.repeat),
+            'compile_and_validate': _timings(lambda: rule_cache._build(packs), args.repeat),
+            'load_cached': _timings(cached, args.repeat),
+            'rules': sum(len(pack.rules) for pack in packs), 'compiled': len(compile_packs(packs))}
+
+
+def bench_stubs(args: argparse.Namespace, corpus: list[Path]) -> dict:
+    """cold: nothing cached. warm: pickles on disk, nothing in memory (a fresh process). hot: all in memory."""
+    import models
+
+    cache_dir = stub_cache.CACHE_DIR
+    try:
+        stub_cache.CACHE_DIR = Path(tempfile.mkdtemp(prefix='opty-bench-'))
+
+        def load():
+            models.takein_module('builtins')
+
+        result = {'cold': _timings(load, args.repeat, setup=stub_cache.clear)}
+        result['warm'] = _timings(load, args.repeat, setup=stub_cache._memory.clear)
+        result['hot'] = _timings(lambda: models.takein_module('builtins'), args.repeat)
+        shutil.rmtree(stub_cache.CACHE_DIR, ignore_errors=True)
+    finally:
+        stub_cache.CACHE_DIR = cache_dir
+        stub_cache._memory.clear()
+    return result
+
+
+def bench_inference(args: argparse.Namespace, corpus: list[Path]) -> dict:
+    """
+    `DemandTyper` on every expression of the synthetic files, by node type, one typer per file as the rewriter has it. nodes it can't type yet
+    are counted, not timed.
+    """
+    from analyzer import DemandTyper, call_results
+
+    times = collections.defaultdict(list)
+    failures = collections.Counter()
+    for path in corpus:
+        if not path.name.startswith('synthetic_'):
+            continue
+        tree = ast.parse(path.read_text(encoding='utf-8'))
+        call_results.clear()
+        typer = DemandTyper(tree)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.expr):
+                continue
+            start = time.perf_counter()
+            try:
+                typ = typer(node)
+            except Exception:
+                typ = None
+            elapsed = time.perf_counter() - start
+            if typ is None:
+                failures[type(node).__name__] += 1
+            else:
+                times[type(node).__name__].append(elapsed)
+
+    return {'per_node': {name: {'count': len(ts), 'total': sum(ts), 'mean': sum(ts) / len(ts)} for name, ts in sorted(times.items())},
+            'failures': dict(failures)}
+
+
+def _overloads() -> tuple['models.Function', list[tuple[tuple, 'models.TypeObject']]]:
+    """an `@overload`ed function shaped like `pow`, and calls that pick each of its candidates, with what they should return"""
+    from models import Function, TypeObject, argument, arguments, load_builtins
+
+    load_builtins()  # so the real builtins are registered under their names, not these
+    obj = TypeObject('object', set())
+    int_, float_, str_ = (TypeObject(name, {'object'}) for name in ('int', 'float', 'str'))
+    bool_ = TypeObject('bool', {'int'})
+
+    def signature(*params: TypeObject) -> arguments:
+        return arguments([argument(f'arg{i}', typ) for i, typ in enumerate(params)], None, (), (), None, ())
+
+    func = Function(['overload'], [(signature(int_, int_), int_), (signature(float_, int_), float_), (signature(float_, float_), float_),
+                                   (signature(str_, str_), str_), (signature(obj), obj)])
+    calls = [((int_, int_), int_), ((bool_, int_), int_), ((float_, int_), float_), ((float_, float_), float_), ((str_, str_), str_),
+             ((bool_,), obj)]
+    return func, calls
+
+
+def bench_generics(args: argparse.Namespace, corpus: list[Path]) -> dict:
+    """
+    `Function.returns` picking an overload, and `resolve_generic_func` for the `__iter__` calls comprehensions make, without and with the memo.
+    only calls that resolve are timed: a call that raises would time the exception instead. the ones that don't are listed under `unresolved`.
+    """
+    from analyzer import call_results, resolve_generic_func
+    from models import Scope
+    from shared_state import builtin
+
+    func, overload_calls = _overloads()
+    for call_args, expected in overload_calls:
+        ret = func.returns(call_args)
+        assert ret is expected, f"{call_args} resolved to {ret}, not {expected}"
+
+    def dispatch_all():
+        for call_args, _ in overload_calls:
+            func.returns(call_args)
+
+    result = {'overloads': _timings(dispatch_all, args.repeat) | {'calls': len(overload_calls)}}
+
+    scope = Scope(meat=ast.parse(''), parent_scope=builtin)
+    calls, unresolved = [], {}
+    for typ in (list[int], list[str], set[float], tuple[int], str, dict[str, int]):
+        call_results.clear()
+        try:
+            ret = resolve_generic_func(typ, '__iter__', (typ,), scope)
+        except Exception as e:
+            unresolved[str(typ)] = type(e).__name__
+            continue
+        if ret is None:
+            unresolved[str(typ)] = 'None'
+        else:
+            calls.append((typ, '__iter__', (typ,)))
+
+    for label, clear in (('uncached', True), ('memoized', False)):
+        def resolve_all():
+            for cls, name, call_args in calls:
+                if clear:
+                    call_results.clear()
+                resolve_generic_func(cls, name, call_args, scope)
+
+        result[label] = (_timings(resolve_all, args.repeat) if calls else {}) | {'calls': len(calls)}
+    result['unresolved'] = unresolved
+    return result
+
+
+def bench_e2e(args: argparse.Namespace, corpus: list[Path]) -> dict:
+    from runner import run
+
+    nodes = sum(sum(1 for _ in ast.walk(ast.parse(path.read_text(encoding='utf-8')))) for path in corpus)
+    rewrites = diagnostics = 0
+    start = time.perf_counter()
+    for result in run(corpus, args.rules.split(','), workers=args.workers):
+        rewrites += len(result.rewrites)
+        diagnostics += len(result.diagnostics)
+    elapsed = time.perf_counter() - start
+    return {'workers': args.workers, 'files': len(corpus), 'nodes': nodes, 'seconds': elapsed, 'files_per_s': len(corpus) / elapsed,
+            'nodes_per_s': nodes / elapsed, 'rewrites': rewrites, 'diagnostics': diagnostics}
+
+
+BENCHMARKS = {'rules': bench_rules, 'stubs': bench_stubs, 'inference': bench_inference, 'generics': bench_generics, 'e2e': bench_e2e}
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(d: dict, prefix: str = '') -> dict[str, float]:
+    flat = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            flat |= _flatten(v, f'{prefix}{k}.')
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            flat[f'{prefix}{k}'] = v
+    return flat
+
+
+def compare(old: dict, new: dict) -> None:
+    """prints every number that's in both, with new/old. for times lower is better; for the `_per_s` rates higher is."""
+    old_flat, new_flat = _flatten(old['results']), _flatten(new['results'])
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']}")
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        if old_flat[key]:
+            print(f"{key:60} {old_flat[key]:12.6g} {new_flat[key]:12.6g} {new_flat[key] / old_flat[key]:8.3f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help=f"comma separated, of {', '.join(BENCHMARKS)}")
+    parser.add_argument('--rules', default='rules.txt', help='comma separated rule packs, highest priority first')
+    parser.add_argument('--files', type=int, default=50, help='synthetic files in the corpus')
+    parser.add_argument('--sites', type=int, default=200, help='rule sites per synthetic file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--out', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results to compare against')
+    args = parser.parse_args()
+
+    corpus = make_corpus(files=args.files, sites=args.sites, seed=args.seed)
+    results = {}
+    for name in args.only.split(','):
+        print(f"running {name}", file=sys.stderr)
+        results[name] = BENCHMARKS[name](args, corpus)
+
+    report = {'meta': {'commit': _commit(), 'python': platform.python_version(), 'platform': sys.platform, 'stub_cache_key': stub_cache.cache_key(),
+                       'corpus': {'files': args.files, 'sites': args.sites, 'seed': args.seed, 'real_modules': REAL_MODULES}, 'time': time.time()},
+              'results': results}
+    with open(args.out, mode='w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, mode='r', encoding='utf-8') as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
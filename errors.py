@@ -9,5 +9,14 @@ class StaticException(Exception):
 class ErrorDuringImport(StaticException):
     pass
 
+class CircularImport(ErrorDuringImport):
+    pass
+
 class TypeVarImmutabilityViolation(StaticException):
     pass
+
+class NoMatchingOverload(StaticException):
+    pass
+
+class RuleError(StaticException):
+    pass
@@ -1,4 +1,4 @@
-import typeshed_client
+import stub_cache
 
 from shared_state import modules, global_state
 
@@ -21,9 +21,9 @@ def stub_from_import(_from: str, _import: str) -> dict:
     from email import encoders
     email.charset == module
     """
-    return typeshed_client.parser.get_stub_names(f"{_from}.{_import}")
+    return stub_cache.get_stub_names(f"{_from}.{_import}")
 
 
 def stub_import(_import: str) -> dict:
-    return typeshed_client.parser.get_stub_names(_import)
+    return stub_cache.get_stub_names(_import)
 
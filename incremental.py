@@ -0,0 +1,159 @@
+"""
+incremental runs: a target is only analyzed again when something its result depends on has changed.
+
+per target, the state file records the content hash of the file, the hash of the rule set, and the stub cache key (typeshed_client version, python
+version, platform), along with the rewrites, edits and diagnostics it produced. `(mtime_ns, size)` is kept too, so an untouched file isn't even
+read unless it has edits: the new source isn't stored, it's made again from the file and its edits.
+
+the whole state is dropped when `STATE_VERSION` or the code that works out results (`code_version`) changes, so a fix to the analyzer or the
+rewriter doesn't keep handing out what the old one did.
+"""
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import typing
+from pathlib import Path
+from typing import Iterator, Optional
+
+import runner
+import stub_cache
+from rule_cache import rules_hash
+from output import Edit, apply_edits
+from rewriter import Diagnostic
+from runner import TargetResult
+
+
+STATE_VERSION = 3
+# the modules whose code decides what a target's result is. the runner, the caches and this module only decide how it's got.
+_CODE_MODULES = ('analyzer', 'errors', 'matcher', 'models', 'output', 'rewriter', 'settings_shid', 'shared_state')
+
+
+@functools.cache
+def code_version() -> str:
+    """a hash of the source of `_CODE_MODULES`"""
+    digest = hashlib.sha256()
+    for name in _CODE_MODULES:
+        digest.update((Path(__file__).parent / f'{name}.py').read_bytes())
+    return digest.hexdigest()
+
+
+def content_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclasses.dataclass
+class Entry:
+    content_hash: str
+    mtime_ns: int
+    size: int
+    rules_hash: str
+    stub_key: str
+    rewrites: list[tuple[int, str, str, int, int, int, int]]
+    diagnostics: list[tuple[int, str]]  # (lineno, message)
+    edits: list[tuple[int, int, int, int, str]]
+
+    def to_result(self, path: Path) -> TargetResult:
+        """:raise OSError: if it has edits and `path` can't be read"""
+        edits = [Edit(*edit) for edit in self.edits]
+        new_source = None
+        if edits:
+            with open(path, mode='r', encoding='utf-8', newline='') as f:  # as `rewriter.rewrite_file` reads it
+                new_source = apply_edits(f.read(), edits)
+        return TargetResult(path, new_source, [tuple(r) for r in self.rewrites], [Diagnostic(path, lineno, msg) for lineno, msg in self.diagnostics],
+                            edits)
+
+
+class IncrementalState:
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.entries: dict[str, Entry] = {}
+        self.reused = 0
+        self.analyzed = 0
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, mode='r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            return
+        if raw.get('version') != STATE_VERSION or raw.get('code') != code_version():
+            return
+        self.entries = {target: Entry(**entry) for target, entry in raw['entries'].items()}
+
+    def save(self) -> None:
+        raw = {'version': STATE_VERSION, 'code': code_version(), 'entries': {target: dataclasses.asdict(entry) for target, entry in self.entries.items()}}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+        with os.fdopen(fd, mode='w', encoding='utf-8') as f:
+            json.dump(raw, f)
+        os.replace(tmp, self.path)
+
+    def lookup(self, path: Path, r_hash: str, stub_key: str) -> Optional[Entry]:
+        """the recorded entry for `path`, if it's still valid"""
+        entry = self.entries.get(str(path))
+        if entry is None or entry.rules_hash != r_hash or entry.stub_key != stub_key:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (stat.st_mtime_ns, stat.st_size) == (entry.mtime_ns, entry.size):
+            return entry
+        if stat.st_size == entry.size and content_hash(path) == entry.content_hash:
+            # touched but not changed (a checkout, a formatter that had nothing to do). remember the new mtime.
+            entry.mtime_ns = stat.st_mtime_ns
+            return entry
+        return None
+
+    def record(self, result: TargetResult, r_hash: str, stub_key: str) -> None:
+        try:
+            stat = os.stat(result.path)
+            c_hash = content_hash(result.path)
+        except OSError:
+            self.entries.pop(str(result.path), None)
+            return
+        self.entries[str(result.path)] = Entry(c_hash, stat.st_mtime_ns, stat.st_size, r_hash, stub_key, list(result.rewrites),
+                                               [(d.lineno, d.message) for d in result.diagnostics], [dataclasses.astuple(e) for e in result.edits])
+
+
+def run(targets: typing.Iterable[Path], rules: str | list[str | dict], state_path: Path, workers: Optional[int] = None, prefetch_stubs: bool = False) \
+        -> Iterator[TargetResult]:
+    """
+    `runner.run`, but targets whose content, rules and stubs haven't changed since the last run come straight from `state_path`.
+    the state is saved once every target has been yielded.
+    """
+    state = IncrementalState(state_path)
+    r_hash = rules_hash(rules)
+    stub_key = stub_cache.cache_key()
+
+    stale = []
+    seen = set()
+    for path in targets:
+        seen.add(str(path))
+        entry = state.lookup(path, r_hash, stub_key)
+        try:
+            result = None if entry is None else entry.to_result(path)
+        except OSError:
+            result = None
+        if result is None:
+            stale.append(path)
+        else:
+            state.reused += 1
+            yield result
+
+    for result in runner.run(stale, rules, workers=workers, prefetch_stubs=prefetch_stubs):
+        state.analyzed += 1
+        state.record(result, r_hash, stub_key)
+        yield result
+
+    # targets that left the hitlist would otherwise stay in the state forever
+    state.entries = {target: entry for target, entry in state.entries.items() if target in seen}
+    state.save()
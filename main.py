@@ -1,9 +1,39 @@
-from settings_shid import get_targets, get_rules, get_settings
+import json
 
-settings = get_settings('settings.json')
-rules = get_rules(settings['rules'])
-targets = get_targets(settings['targets'])
-version = settings['version']
+from settings_shid import get_targets, get_settings
+import profiling
+import tracing
+import rule_cache
+import incremental
+from output import emit
+from runner import run
 
-# lazy = get_targets(settings['lazy?'])
+# the process pool re-imports this module in every worker on spawn platforms (windows), so everything runs under the guard.
+if __name__ == '__main__':
+    settings = get_settings('settings.json')
+    tracing.configure(settings.get('log_level', 'WARNING'), settings.get('trace'))
+    profile_settings = settings.get('profile')
+    if profile_settings:
+        profiling.enable(profile_settings.get('cprofile'), profile_settings.get('cprofile_dir', '.'))
+    run_report = profiling.RunReport()
+    rules = settings['rules']
+    with profiling.stage('rules'):
+        rule_cache.load(rules)  # a bad rule should fail here, not once per worker. also leaves the compiled rules cached for them.
+    targets = get_targets(settings['targets'])
+    version = settings['version']
 
+    # lazy = get_targets(settings['lazy?'])
+
+    if settings.get('incremental'):
+        results = incremental.run(targets, rules, settings['incremental'], workers=settings.get('workers'),
+                                  prefetch_stubs=settings.get('prefetch_stubs', False))
+    else:
+        results = run(targets, rules, workers=settings.get('workers'), prefetch_stubs=settings.get('prefetch_stubs', False))
+
+    for result in results:
+        run_report.add(result.path, result.profile)
+        emit(result, settings.get('output', 'summary'))
+
+    if profile_settings:
+        with open(profile_settings.get('report', 'profile.json'), mode='w', encoding='utf-8') as f:
+            json.dump(run_report.report(profile_settings.get('top', 10)), f, indent=2)
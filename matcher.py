@@ -0,0 +1,464 @@
+"""
+compiles the left-hand sides of rules.txt into one discrimination tree so that each ast node is matched against every rule in one walk.
+
+a pattern is flattened (preorder) into keys. a key is the node type plus its scalar fields and list lengths, e.g. `('BinOp',)` then `('Mult',)`.
+calls whose callee is a plain dotted name are folded into a single key `('Call', 'random.randint', 2, 0)` (name, arity, #keywords).
+metavariables (the names on the right of `=>`) become wildcards that skip a whole subtree.
+rules with the same left-hand side, from one pack or several, share a leaf and are unified with a node only once.
+
+before any of that, `RuleIndex.may_match` looks for the identifiers every rule needs (`random` and `randint` for `random.randint(0, a)`) in the raw
+source, so files that can't match anything aren't even parsed, let alone typed.
+"""
+import ast
+import builtins
+import dataclasses
+import importlib.util
+import re
+import typing
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from settings_shid import RulePack
+
+
+WILDCARD = '*'
+_SKIPPED_FIELDS = frozenset({'ctx', 'type_comment', 'kind'})
+_ANY_STR = ('<str>',)  # loose slot for string constants and attribute names that contain metavariables
+FSTRING_ANCHOR = '<f-string>'
+_FSTRING = re.compile(r'(?i)(?:fr?|rf)[\'"]')  # also matches `if"` and the like. the scan only has to never miss.
+
+
+class _NoneNode:
+    """stands in for a `None` field (e.g. `Slice.lower`) so that it still takes up a slot in the flattened pattern"""
+    _fields = ()
+
+    def __repr__(self) -> str:
+        return '_NONE'
+
+
+_NONE = _NoneNode()
+
+
+def parse_constraints(constraints: str) -> dict[str, str]:
+    """
+    :param constraints: `a:Sequence,b:int,c:Iterable[a]`
+    :return: {'a': 'Sequence', 'b': 'int', 'c': 'Iterable[a]'}. commas inside brackets don't split.
+    """
+    result = {}
+    depth = 0
+    part = []
+    for c in constraints + ',':
+        if c in '[(':
+            depth += 1
+        elif c in '])':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            item = ''.join(part).strip()
+            part = []
+            if not item or item == '...':
+                continue
+            name, _, typ = item.partition(':')
+            result[name.strip()] = typ.strip() or 'Any'
+            continue
+        part.append(c)
+    return result
+
+
+def dotted_name(node: ast.AST, metavars: typing.Container[str] = ()) -> Optional[str]:
+    """`random.randint` -> 'random.randint'. None if it isn't a plain chain of names (or if any part is a metavariable)."""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        if node.attr in metavars:
+            return None
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name) or node.id in metavars:
+        return None
+    parts.append(node.id)
+    return '.'.join(reversed(parts))
+
+
+def _fields(node: ast.AST) -> tuple[list, list]:
+    """the exact key (as a list) and the children of `node`"""
+    key = [type(node).__name__]
+    children = []
+    for field, value in ast.iter_fields(node):
+        if field in _SKIPPED_FIELDS:
+            continue
+        if isinstance(value, ast.AST):
+            children.append(value)
+        elif value is None:
+            children.append(_NONE)
+        elif isinstance(value, list):
+            if value and not isinstance(value[0], (ast.AST, type(None))):
+                key.append(tuple(value))  # Global.names and the like
+            else:
+                key.append(len(value))
+                children.extend(_NONE if v is None else v for v in value)
+        else:
+            key.append(value)
+    return key, children
+
+
+def node_keys(node: ast.AST) -> list[tuple[tuple, list]]:
+    """every key a target node can be found under in the tree, each with the children that are still left to be matched"""
+    if node is _NONE:
+        return [(('None',), [])]
+
+    key, children = _fields(node)
+    result = [(tuple(key), children)]
+
+    if isinstance(node, ast.Call):
+        callee = dotted_name(node.func)
+        generic = ('Call', None, len(node.args), len(node.keywords))
+        result = [(generic, children)]
+        if callee is not None:
+            result.append((('Call', callee, len(node.args), len(node.keywords)), children[1:]))
+    elif isinstance(node, ast.Attribute):
+        result.append((('Attribute', _ANY_STR), children))
+    elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+        result.append((('Constant', _ANY_STR), children))
+    return result
+
+
+def _template_regex(text: str, metavars: typing.Collection[str]) -> Optional[re.Pattern]:
+    """'a=' -> re.compile('(?P<a>.+?)='). None if `text` doesn't mention any metavariable."""
+    names = [name for name in metavars if re.search(rf'\b{re.escape(name)}\b', text)]
+    if not names:
+        return None
+    alternation = '|'.join(map(re.escape, sorted(names, key=len, reverse=True)))
+    pieces = []
+    seen = set()
+    for chunk in re.split(rf'\b({alternation})\b', text):
+        if chunk in names:
+            pieces.append(f'(?P={chunk})' if chunk in seen else f'(?P<{chunk}>.+?)')
+            seen.add(chunk)
+        else:
+            pieces.append(re.escape(chunk))
+    return re.compile(''.join(pieces), re.DOTALL)
+
+
+def as_text(bound: ast.AST | str) -> str:
+    if isinstance(bound, str):
+        return bound
+    if isinstance(bound, ast.Constant) and isinstance(bound.value, str):
+        return bound.value
+    if isinstance(bound, ast.Attribute):
+        return bound.attr
+    return ast.unparse(bound)
+
+
+def _same(a: ast.AST | str, b: ast.AST | str) -> bool:
+    if isinstance(a, ast.Name) and isinstance(b, ast.Name):
+        return a.id == b.id  # a comprehension target (Store) and its uses (Load) are the same name
+    if isinstance(a, ast.AST) and isinstance(b, ast.AST) and type(a) is type(b):
+        return ast.dump(a) == ast.dump(b)
+    return as_text(a) == as_text(b)
+
+
+def anchors(tree: ast.AST, metavars: typing.Container[str]) -> frozenset[str]:
+    """the identifiers (and `FSTRING_ANCHOR`) a source has to contain for `tree` to match anything in it"""
+    result = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in metavars:
+            result.add(node.id)
+        elif isinstance(node, ast.Attribute) and node.attr not in metavars:
+            result.add(node.attr)
+        elif isinstance(node, ast.JoinedStr):
+            result.add(FSTRING_ANCHOR)
+    return frozenset(result)
+
+
+def _contains(source: str, anchor: str) -> bool:
+    # a substring test, not a tokenizer: `random` is also found in `randomize` and in comments, which only costs a wasted parse.
+    if anchor == FSTRING_ANCHOR:
+        return _FSTRING.search(source) is not None
+    return anchor in source
+
+
+def required_imports(template: ast.expr, pattern: ast.expr, metavars: typing.Container[str]) -> frozenset[str]:
+    """
+    modules the replacement uses but the pattern doesn't, like `operator` in `sum([c * d for c, d in zip(a, b)]) -> sum(map(operator.mul, a, b))`.
+    the rewriter imports them in the files they're used in.
+    """
+    in_pattern = {node.id for node in ast.walk(pattern) if isinstance(node, ast.Name)}
+    stored = {node.id for node in ast.walk(template) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store)}
+    result = set()
+    for node in ast.walk(template):
+        if not (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name)):
+            continue
+        name = node.value.id
+        if name in metavars or name in in_pattern or name in stored or hasattr(builtins, name):
+            continue
+        if importlib.util.find_spec(name) is not None:
+            result.add(name)
+    return frozenset(result)
+
+
+class Pattern:
+    """the left side of one rule, parsed. `metavars` are the names that may bind to any subtree."""
+
+    def __init__(self, source: str, metavars: typing.Collection[str]) -> None:
+        self.source = source
+        self.metavars = frozenset(metavars)
+        self.root: ast.expr = ast.parse(source, mode='eval').body
+        self._templates: dict[int, Optional[re.Pattern]] = {}
+
+    def __getstate__(self) -> dict:
+        # `_templates` is keyed by id, which means nothing once unpickled
+        return self.__dict__ | {'_templates': {}}
+
+    def template(self, node: ast.Constant) -> Optional[re.Pattern]:
+        if id(node) not in self._templates:
+            self._templates[id(node)] = _template_regex(node.value, self.metavars)
+        return self._templates[id(node)]
+
+    def keys(self) -> list[tuple | str]:
+        """the flattened (preorder) key sequence of the pattern. metavariables are `WILDCARD`."""
+        result = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node is _NONE:
+                result.append(('None',))
+                continue
+            if isinstance(node, ast.Name) and node.id in self.metavars:
+                result.append(WILDCARD)
+                continue
+
+            key, children = _fields(node)
+            if isinstance(node, ast.Call):
+                callee = dotted_name(node.func, self.metavars)
+                if callee is None:
+                    key = ['Call', None, len(node.args), len(node.keywords)]
+                else:
+                    key = ['Call', callee, len(node.args), len(node.keywords)]
+                    children = children[1:]
+            elif isinstance(node, ast.Attribute) and node.attr in self.metavars:
+                key = ['Attribute', _ANY_STR]
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str) and self.template(node) is not None:
+                key = ['Constant', _ANY_STR]
+
+            result.append(tuple(key))
+            stack.extend(reversed(children))
+        return result
+
+    def match(self, node: ast.AST) -> Optional[dict[str, ast.AST | str]]:
+        """
+        :return: metavariable -> the subtree it bound to (or the text, for metavariables inside string constants). None if no match.
+        """
+        bindings = {}
+        if self._unify(self.root, node, bindings):
+            return bindings
+        return None
+
+    def _bind(self, name: str, value: ast.AST | str, bindings: dict) -> bool:
+        if name not in bindings:
+            bindings[name] = value
+            return True
+        if not _same(bindings[name], value):
+            return False
+        if isinstance(bindings[name], str) and isinstance(value, ast.AST):
+            bindings[name] = value  # rather keep the node; it can be type-checked.
+        return True
+
+    def _unify(self, pat: ast.AST, node: ast.AST, bindings: dict) -> bool:
+        if isinstance(pat, ast.Name) and pat.id in self.metavars:
+            return self._bind(pat.id, node, bindings)
+        if type(pat) is not type(node):
+            return False
+
+        if isinstance(pat, ast.Constant):
+            if isinstance(pat.value, str) and isinstance(node.value, str) and (regex := self.template(pat)) is not None:
+                if pat.value in self.metavars:
+                    return self._bind(pat.value, node, bindings)
+                found = regex.fullmatch(node.value)
+                return found is not None and all(self._bind(k, v, bindings) for k, v in found.groupdict().items())
+            return type(pat.value) is type(node.value) and pat.value == node.value
+
+        if isinstance(pat, ast.Attribute) and pat.attr in self.metavars:
+            if not self._bind(pat.attr, node, bindings):
+                return False
+            return self._unify(pat.value, node.value, bindings)
+
+        for field, p_value in ast.iter_fields(pat):
+            if field in _SKIPPED_FIELDS:
+                continue
+            n_value = getattr(node, field, None)
+            if isinstance(p_value, ast.AST):
+                if not isinstance(n_value, ast.AST) or not self._unify(p_value, n_value, bindings):
+                    return False
+            elif isinstance(p_value, list):
+                if not isinstance(n_value, list) or len(p_value) != len(n_value):
+                    return False
+                for p, n in zip(p_value, n_value):
+                    if isinstance(p, ast.AST):
+                        if not isinstance(n, ast.AST) or not self._unify(p, n, bindings):
+                            return False
+                    elif p != n:
+                        return False
+            elif p_value != n_value:
+                return False
+        return True
+
+
+@dataclasses.dataclass
+class Rule:
+    index: int  # position in the rules files, one after the other in settings order. see `RuleIndex` for which rule wins.
+    pattern: Pattern
+    replacement: str
+    constraints: dict[str, str]
+    template: Optional[ast.expr] = None  # the replacement, parsed
+    anchors: frozenset[str] = frozenset()  # see `anchors`
+    imports: frozenset[str] = frozenset()  # see `required_imports`
+    pack: int = 0  # position of its `RulePack` in `RuleIndex.packs`
+
+
+def make_rule(index: int, parsed: tuple[str, ...], pack: int = 0) -> Rule:
+    """:param parsed: `(pattern, replacement, constraints)` as returned by `settings_shid.parse_rule`"""
+    pattern, replacement, *rest = parsed
+    constraints = parse_constraints(rest[0]) if rest else {}
+    pattern = Pattern(pattern, constraints)
+    template = ast.parse(replacement, mode='eval').body
+    return Rule(index, pattern, replacement, constraints, template, anchors(pattern.root, constraints),
+                required_imports(template, pattern.root, constraints), pack)
+
+
+def _lhs_key(rule: Rule) -> tuple:
+    return ast.dump(rule.pattern.root), rule.pattern.metavars
+
+
+class _TrieNode:
+    __slots__ = ('edges', 'rules')
+
+    def __init__(self) -> None:
+        self.edges: dict[tuple | str, _TrieNode] = {}
+        self.rules: list[int] = []  # groups, see `RuleIndex._groups`
+
+
+class RuleIndex:
+    """
+    every rule's pattern merged into one discrimination tree. `rules` is in the order they're tried in: higher pack priority first, then settings
+    order, then file order.
+
+    >>> index = compile_rules([('random.randint(0, a)', 'random.randrange(a + 1)', 'a:int')])
+    >>> [rule.replacement for rule, _ in index.match(ast.parse('random.randint(0, n)', mode='eval').body)]
+    ['random.randrange(a + 1)']
+    """
+
+    def __init__(self, rules: typing.Iterable[Rule] = (), packs: typing.Sequence[RulePack] = ()) -> None:
+        self.rules: list[Rule] = []
+        self.packs = list(packs) or [RulePack('', {}, ())]
+        self.root = _TrieNode()
+        self._groups: list[list[int]] = []  # positions in `rules` of the rules that share a left-hand side
+        self._group_of: dict[tuple, int] = {}
+        self._anchors: dict[frozenset[str], set[int]] = {}  # anchors -> the packs that have rules needing them
+        # per pack, constraint text -> resolved type. filled in by `rule_cache`.
+        self.constraint_types: list[dict[str, Any]] = [{} for _ in self.packs]
+        for rule in rules:
+            self.add(rule)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def add(self, rule: Rule) -> None:
+        key = _lhs_key(rule)
+        if key in self._group_of:
+            self._groups[self._group_of[key]].append(len(self.rules))
+        else:
+            node = self.root
+            for edge in rule.pattern.keys():
+                node = node.edges.setdefault(edge, _TrieNode())
+            self._group_of[key] = len(self._groups)
+            node.rules.append(len(self._groups))
+            self._groups.append([len(self.rules)])
+        self.rules.append(rule)
+        self._anchors.setdefault(rule.anchors, set()).add(rule.pack)
+
+    def enabled(self, path: Optional[Path]) -> Optional[frozenset[int]]:
+        """the packs that apply to the target `path`. None means all of them."""
+        if path is None:
+            return None
+        return frozenset(i for i, pack in enumerate(self.packs) if pack.applies_to(path))
+
+    def may_match(self, source: str, packs: Optional[frozenset[int]] = None) -> bool:
+        """
+        False if no rule (of `packs`) can match anywhere in `source`. a rewrite can only make later rules match if it fired itself, so the rules' own
+        anchors are enough; what replacements introduce doesn't matter here.
+        """
+        return any((packs is None or not packs.isdisjoint(users)) and all(_contains(source, anchor) for anchor in needed)
+                   for needed, users in self._anchors.items())
+
+    def candidates(self, node: ast.AST) -> list[Rule]:
+        """rules whose flattened pattern fits `node`. a superset of the real matches (constants, repeated metavariables aren't checked here)"""
+        found: list[int] = []
+        self._walk(self.root, (node, None), found)
+        return [self.rules[i] for i in sorted(i for group in set(found) for i in self._groups[group])]
+
+    def match(self, node: ast.AST, packs: Optional[frozenset[int]] = None) -> Iterator[tuple[Rule, dict[str, ast.AST | str]]]:
+        """every rule (of `packs`) that matches `node`, with its bindings, in the order of `rules`"""
+        found: list[int] = []
+        self._walk(self.root, (node, None), found)
+        matched = []
+        for group in set(found):
+            positions = [i for i in self._groups[group] if packs is None or self.rules[i].pack in packs]
+            if not positions:
+                continue
+            bindings = self.rules[positions[0]].pattern.match(node)  # the same for every rule of the group
+            if bindings is not None:
+                matched.extend((i, bindings) for i in positions)
+        for i, bindings in sorted(matched, key=lambda pair: pair[0]):
+            yield self.rules[i], bindings
+
+    def _walk(self, trie: _TrieNode, pending: Optional[tuple], found: list[int]) -> None:
+        # `pending` is a cons list (node, rest) of the target nodes that still have to be consumed.
+        if pending is None:
+            found.extend(trie.rules)
+            return
+        node, rest = pending
+        if WILDCARD in trie.edges:
+            self._walk(trie.edges[WILDCARD], rest, found)
+        for key, children in node_keys(node):
+            nxt = trie.edges.get(key)
+            if nxt is None:
+                continue
+            for child in reversed(children):
+                rest = (child, rest)
+            self._walk(nxt, rest, found)
+            rest = pending[1]
+
+
+def compile_rules(rules: typing.Iterable[tuple[str, ...]], type_shorts: Optional[dict[str, str]] = None) -> RuleIndex:
+    """:param rules: the second item of `settings_shid.get_rules`. blank lines come through as `('',)` and are skipped."""
+    return compile_packs([RulePack('', type_shorts or {}, tuple(rules))])
+
+
+def _duplicate_key(rule: Rule, pack: RulePack) -> tuple:
+    # the same rule from two packs is only the same if the type_shorts its constraints use mean the same thing in both, and if both packs apply to
+    # the same targets
+    names = {name for text in rule.constraints.values() for name in re.findall(r'[A-Za-z_]\w*', text)}
+    return (_lhs_key(rule), ast.dump(rule.template), tuple(sorted(rule.constraints.items())),
+            tuple(sorted((n, pack.type_shorts.get(n)) for n in names)), pack.enable, pack.disable)
+
+
+def compile_packs(packs: typing.Sequence[RulePack]) -> RuleIndex:
+    """
+    all the packs in one index. a rule that's already in a pack of higher (or equal, earlier) priority, with the same globs, is dropped, and so are blank lines.
+    a rule's `index` is its position in all the packs' rules one after the other, whether or not it was dropped, so it doesn't depend on priorities.
+    """
+    offsets = [0]
+    for pack in packs:
+        offsets.append(offsets[-1] + len(pack.rules))
+
+    rules = []
+    seen = set()
+    for p in sorted(range(len(packs)), key=lambda p: -packs[p].priority):  # sorted is stable, so equal priorities keep settings order
+        for i, parsed in enumerate(packs[p].rules):
+            if not parsed[0]:
+                continue
+            rule = make_rule(offsets[p] + i, parsed, p)
+            key = _duplicate_key(rule, packs[p])
+            if key not in seen:
+                seen.add(key)
+                rules.append(rule)
+    return RuleIndex(rules, packs)
@@ -1,9 +1,13 @@
 # Like a Linked List Stack.
 import ast
 import dataclasses
+import functools
 import importlib
 import inspect
-import os
+import logging
+import operator
+import time
+import weakref
 from collections import deque, defaultdict
 from copy import deepcopy
 from types import FunctionType
@@ -14,194 +18,252 @@ from ast import Assign, AnnAssign, AugAssign, NamedExpr, NodeVisitor, AST, parse
 from pathlib import Path
 
 import setuptools.errors
-import typed_ast
+import typed_ast._ast3
 import typeshed_client
 import typing
 from typeshed_client import NameInfo, ImportedName
 
-from errors import ErrorDuringImport, TypeVarImmutabilityViolation
+import profiling
+import stub_cache
+import type_db
+from tracing import STUBS, Dump
+from errors import CircularImport, ErrorDuringImport, NoMatchingOverload, TypeVarImmutabilityViolation
 
-types = {}
+class TypeRegistry(dict):
+    """name -> the `TypeObject` called that. with a `type_db` attached, the parent's types are unpickled from it on first use."""
 
+    def __missing__(self, name: str) -> 'TypeObject':
+        db = type_db.attached()
+        typ = None if db is None else db.load_type(name)
+        if typ is None:
+            raise KeyError(name)
+        return self.setdefault(name, typ)
 
+    def __contains__(self, name: object) -> bool:
+        if super().__contains__(name):
+            return True
+        db = type_db.attached()
+        return db is not None and isinstance(name, str) and db.has_type(name)
+
+    def bases(self, name: str) -> typing.Collection[str]:
+        """the bases of the type called `name`, without unpickling it if it's still only in the `type_db`"""
+        typ = self.get(name)
+        if typ is not None:
+            return typ.bases
+        db = type_db.attached()
+        return () if db is None else db.bases(name)
+
+
+types = TypeRegistry()
 
-class AssignSniffer(NodeVisitor):
-    """
-    visit should receive the body of a function, class, generatorexp/comprehension, etc.
 
-    FunctionDef.body, comprehension
 
-    for modules? doesn't matter.
+_COMPREHENSIONS = (ListComp, SetComp, GeneratorExp, DictComp)
+
+
+class ScopeBuilder(NodeVisitor):
     """
+    walks a tree once and creates every `Scope` in it: one per function, lambda, class and comprehension, each with its locals, globals and
+    nonlocals filled in and linked to its parent. `scopes` maps `id(node)` of each scope-introducing node to its scope.
 
-    def __init__(self, locals: set, is_comp_gen: bool = False):
-        super(AssignSniffer, self).__init__()
-        self.locals = locals
-        self.is_comp_gen = is_comp_gen
+    replaces sniffing the subtree again for every scope, which walked nested functions and comprehensions once per enclosing scope.
+    """
 
-    def generic_visit(self, node: AST) -> typing.Any:
-        NodeVisitor.generic_visit(self, node)
-
-    def visit_Assign(self, node: Assign) -> typing.Any:
-        if self.is_comp_gen:
-            return None
-        for target in node.targets:
-            if isinstance(target, Name):
-                self.locals.add(target.id)
-            elif isinstance(target, Tuple):
-                queue = deque(target.elts)
-                while queue:
-                    elt = queue.popleft()
-                    if isinstance(elt, Name):
-                        self.locals.add(elt.id)
-                    elif isinstance(elt, Starred):
-                        self.locals.add(elt.value.id)
-                    elif isinstance(elt, Tuple):
-                        queue.extend(elt.elts)
-        self.visit(node.value)
+    def __init__(self, root: 'Scope', meat: AST) -> None:
+        super(ScopeBuilder, self).__init__()
+        self.current = root
+        self.scopes: dict[int, Scope] = {id(meat): root}
+        root.table = self.scopes
+
+        if isinstance(meat, _COMPREHENSIONS):
+            self._comprehension_body(meat)
+        elif isinstance(meat, (FunctionDef, AsyncFunctionDef, ast.Lambda)):
+            self._function_body(meat)
+        elif isinstance(meat, ClassDef):
+            for stmt in meat.body:
+                self.visit(stmt)
+        else:
+            self.generic_visit(meat)
 
-    def visit_AnnAssign(self, node: AnnAssign) -> typing.Any:
-        if self.is_comp_gen:
-            return None
-        self.locals.add(node.target.id)
-        self.visit(node.value)
+    def _enter(self, node: AST, is_comp_gen: bool = False, is_class: bool = False) -> 'Scope':
+        scope = Scope._nested(self.current, is_comp_gen, is_class)
+        scope.table = self.scopes
+        self.scopes[id(node)] = scope
+        return scope
 
-    def visit_AugAssign(self, node: AugAssign) -> typing.Any:
-        if self.is_comp_gen:
-            return None
-        self.locals.add(node.target.id)
-        self.visit(node.value)
+    def _bind(self, name: str) -> None:
+        self.current.locals.add(name)
+
+    def visit_Name(self, node: Name) -> typing.Any:
+        if not isinstance(node.ctx, ast.Load):
+            self._bind(node.id)
 
     def visit_NamedExpr(self, node: NamedExpr) -> typing.Any:
-        self.locals.add(node.target.id)
+        # walrus binds in the nearest scope that isn't a comprehension
         self.visit(node.value)
+        scope = self.current
+        while scope.is_comp_gen:
+            scope = scope.parent_scope
+        scope.locals.add(node.target.id)
 
-    def visit_ClassDef(self, node: ClassDef) -> typing.Any:
-        # class, so do nothing
-        return None
-
-    def visit_FunctionDef(self, node: FunctionDef) -> typing.Any:
-        # func, so do nothing
-        return None
-
-    def visit_AsyncFunctionDef(self, node: AsyncFunctionDef) -> typing.Any:
-        # func, so do nothing
-        return None
-
-    def visit_ListComp(self, node: ListComp) -> typing.Any:
-        # walrus
-        self.visit(node.elt)
-
-        if self.is_comp_gen:
-            self.is_comp_gen = False
-            for comp in node.generators:
-                queue = deque([comp.target])
-                while queue:
-                    elt = queue.popleft()
-                    if isinstance(elt, Name):
-                        self.locals.add(elt.id)
-                    elif isinstance(elt, Starred):
-                        queue.append(elt.value)
-                    elif isinstance(elt, (Tuple, List)):
-                        queue.extend(elt.elts)
-
-    def visit_SetComp(self, node: SetComp) -> typing.Any:
-        # walrus
-        self.visit(node.elt)
-
-        if self.is_comp_gen:
-            self.is_comp_gen = False
-            for comp in node.generators:
-                queue = deque([comp.target])
-                while queue:
-                    elt = queue.popleft()
-                    if isinstance(elt, Name):
-                        self.locals.add(elt.id)
-                    elif isinstance(elt, Starred):
-                        queue.append(elt.value)
-                    elif isinstance(elt, (Tuple, List)):
-                        queue.extend(elt.elts)
-
-    def visit_GeneratorExp(self, node: GeneratorExp) -> typing.Any:
-        # walrus
-        self.visit(node.elt)
-
-        if self.is_comp_gen:
-            self.is_comp_gen = False
-            for comp in node.generators:
-                queue = deque([comp.target])
-                while queue:
-                    elt = queue.popleft()
-                    if isinstance(elt, Name):
-                        self.locals.add(elt.id)
-                    elif isinstance(elt, Starred):
-                        queue.append(elt.value)
-                    elif isinstance(elt, (Tuple, List)):
-                        queue.extend(elt.elts)
-
-    def visit_DictComp(self, node: DictComp) -> typing.Any:
-        # walrus
-        # walrus
-        self.visit(node.key)
-        self.visit(node.value)
+    def visit_Global(self, node: Global) -> typing.Any:
+        self.current.globals.update(node.names)
 
-        if self.is_comp_gen:
-            self.is_comp_gen = False
-            for comp in node.generators:
-                queue = deque([comp.target])
-                while queue:
-                    elt = queue.popleft()
-                    if isinstance(elt, Name):
-                        self.locals.add(elt.id)
-                    elif isinstance(elt, Starred):
-                        queue.append(elt.value)
-                    elif isinstance(elt, (Tuple, List)):
-                        queue.extend(elt.elts)
-
-
-class GlobalAndNonlocalSniffer(NodeVisitor):
-    """
-    visit should receive the body of a function, class, generatorexp/comprehension, etc.
-    for modules? doesn't matter.
-    """
+    def visit_Nonlocal(self, node: Nonlocal) -> typing.Any:
+        self.current.nonlocals.update(node.names)
+
+    def visit_Import(self, node: ast.Import) -> typing.Any:
+        for alias in node.names:
+            self._bind(alias.asname or alias.name.split('.')[0])
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> typing.Any:
+        for alias in node.names:
+            if alias.name != '*':
+                self._bind(alias.asname or alias.name)
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler) -> typing.Any:
+        if node.name is not None:
+            self._bind(node.name)
+        self.generic_visit(node)
+
+    def _visit_all(self, nodes: typing.Iterable[Optional[AST]]) -> None:
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    def _arguments_outside(self, args: ast.arguments) -> None:
+        """defaults and annotations are evaluated where the function is defined"""
+        self._visit_all(args.defaults)
+        self._visit_all(args.kw_defaults)
+        self._visit_all(arg.annotation for arg in args.posonlyargs + args.args + args.kwonlyargs)
+        self._visit_all(arg.annotation for arg in (args.vararg, args.kwarg) if arg is not None)
+
+    def _function_body(self, node: FunctionDef | AsyncFunctionDef | ast.Lambda) -> None:
+        args = node.args
+        for arg in args.posonlyargs + args.args + args.kwonlyargs + [a for a in (args.vararg, args.kwarg) if a is not None]:
+            self._bind(arg.arg)
+        if isinstance(node, ast.Lambda):
+            self.visit(node.body)
+        else:
+            self._visit_all(node.body)
 
-    def __init__(self, globals: set, nonlocals: set):
-        super(GlobalAndNonlocalSniffer, self).__init__()
-        self.globals = globals
-        self.nonlocals = nonlocals
+    def visit_FunctionDef(self, node: FunctionDef | AsyncFunctionDef) -> typing.Any:
+        self._visit_all(node.decorator_list)
+        self._arguments_outside(node.args)
+        self._visit_all([node.returns])
+        self._bind(node.name)
 
-    def generic_visit(self, node: AST) -> typing.Any:
-        NodeVisitor.generic_visit(self, node)
+        outer, self.current = self.current, self._enter(node)
+        self._function_body(node)
+        self.current = outer
 
-    def visit_Global(self, node: Global) -> typing.Any:
-        self.globals.update(node.names)
+    visit_AsyncFunctionDef = visit_FunctionDef
 
-    def visit_Nonlocal(self, node: Nonlocal) -> typing.Any:
-        self.nonlocals.update(node.names)
+    def visit_Lambda(self, node: ast.Lambda) -> typing.Any:
+        self._arguments_outside(node.args)
+        outer, self.current = self.current, self._enter(node)
+        self._function_body(node)
+        self.current = outer
 
     def visit_ClassDef(self, node: ClassDef) -> typing.Any:
-        # class, so do nothing
-        return None
-
-    def visit_FunctionDef(self, node: FunctionDef) -> typing.Any:
-        # func, so do nothing
-        return None
+        self._visit_all(node.decorator_list)
+        self._visit_all(node.bases)
+        self._visit_all(node.keywords)
+        self._bind(node.name)
+
+        outer, self.current = self.current, self._enter(node, is_class=True)
+        self._visit_all(node.body)
+        self.current = outer
+
+    def _comprehension(self, node: ListComp | SetComp | GeneratorExp | DictComp) -> typing.Any:
+        # the first iterable is evaluated in the enclosing scope; everything else in the comprehension's own.
+        self.visit(node.generators[0].iter)
+        outer, self.current = self.current, self._enter(node, is_comp_gen=True)
+        self._comprehension_body(node)
+        self.current = outer
+
+    def _comprehension_body(self, node: ListComp | SetComp | GeneratorExp | DictComp) -> None:
+        for i, comp in enumerate(node.generators):
+            self.visit(comp.target)
+            if i > 0:
+                self.visit(comp.iter)
+            self._visit_all(comp.ifs)
+        if isinstance(node, DictComp):
+            self.visit(node.key)
+            self.visit(node.value)
+        else:
+            self.visit(node.elt)
 
-    def visit_AsyncFunctionDef(self, node: AsyncFunctionDef) -> typing.Any:
-        # func, so do nothing
-        return None
+    visit_ListComp = visit_SetComp = visit_GeneratorExp = visit_DictComp = _comprehension
 
 
 NotFound = typing.TypeVar("NotFound")
 
 
+# the parameters (by position) of the generics that are invariant in them. a `list[bool]` isn't a `list[int]`: an `int` can be appended to the
+# latter. every other parameter is taken as covariant, which is right for the read-only ones (`Sequence`, `tuple`, `frozenset`, `Iterable`, the
+# values of a `Mapping`, ...).
+INVARIANT: dict[str, tuple[int, ...]] = {
+    'list': (0, ), 'set': (0, ), 'dict': (0, 1), 'MutableSequence': (0, ), 'MutableSet': (0, ), 'MutableMapping': (0, 1), 'Mapping': (0, ),
+    'deque': (0, ), 'defaultdict': (0, 1), 'OrderedDict': (0, 1), 'Counter': (0, ), 'ChainMap': (0, 1),
+}
+
+
+def _same(a: 'TypeObject', b: 'TypeObject') -> bool:
+    """for an invariant parameter. types are interned, so equal is identical; `Any` is compatible with anything."""
+    return a is b or isinstance(a, _Any) or isinstance(b, _Any)
+
+
 class TypeObject:
+    """
+    interned: constructing a type that's structurally equal to a live one (same class, name, bases and args; same members for unions) returns that
+    one. so `==` is `is`, and types hash by identity. two stubs defining a class of the same name with other bases get two types.
+    """
+    __slots__ = ('name', 'data', 'bases', 'args', '_key', '_ancestors', '_ancestors_generation', '__weakref__')
+
+    def __new__(cls, *args, **kwargs) -> 'TypeObject':
+        return cls._interned(cls._intern_key(*args, **kwargs))
+
+    @classmethod
+    def _intern_key(cls, name: Optional[str], bases: set[str] = None, args: tuple['TypeObject'] = None) -> tuple:
+        return cls, name, frozenset(bases or ()), (ANY, ) if args is None else tuple(args)
+
+    @classmethod
+    def _interned(cls, key: tuple) -> 'TypeObject':
+        self = _interned_types.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            self._key = key
+            _interned_types[key] = self
+        return self
+
     def __init__(self, name: Optional[str], bases: set[str], args: tuple['TypeObject'] = None) -> None:
+        if hasattr(self, 'data'):
+            return  # an interned type that's already set up. re-running would drop its `data`.
         self.name = name
         self.data = {}
         self.bases: set[str] = bases  # not dict because the bases' definitions may be dependent on self.
-        self.args = (ANY, ) if args is None else args
-        types[self.name] = self
+        self.args = (ANY, ) if args is None else tuple(args)
+        if self.name is not None and self.name not in types:
+            types[self.name] = self
+
+    def __reduce__(self):
+        # unpickled from the stub cache through the intern table, so a type that's already live isn't duplicated.
+        state = {slot: getattr(self, slot) for slot in _slots_of(type(self)) if hasattr(self, slot)}
+        return _unpickle_type, (self._key, ), state
+
+    def __setstate__(self, state: dict) -> None:
+        if hasattr(self, 'data'):
+            return
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        if self.name is not None and self.name not in types:
+            types[self.name] = self
+
+    def __repr__(self) -> str:
+        if not self.args or self.args == (ANY, ):
+            return str(self.name)
+        return f"{self.name}[{', '.join(map(repr, self.args))}]"
 
     def __getitem__(self, item: str) -> typing.Union['TypeObject', 'BaseObject']:
         return self.data[item]
@@ -209,120 +271,187 @@ class TypeObject:
     def __setitem__(self, key: str, value: typing.Union['TypeObject', 'BaseObject']) -> None:
         self.data[key] = value
 
+    @property
+    def ancestors(self) -> frozenset[str]:
+        """names of every class this one inherits from, transitively. worked out once per stub generation (bases may be loaded later than self)."""
+        if getattr(self, '_ancestors_generation', None) != _subtype_cache.generation:
+            seen = set()
+            queue = deque(self.bases)
+            while queue:
+                base = queue.popleft()
+                if base in seen:
+                    continue
+                seen.add(base)
+                queue.extend(types.bases(base))
+            self._ancestors = frozenset(seen)
+            self._ancestors_generation = _subtype_cache.generation
+        return self._ancestors
+
     def __lt__(self, superclass: 'TypeObject') -> bool:
+        # asked for every candidate rewrite's constraints, so it's memoized. types are interned, so the pair is the key.
+        key = (self, superclass)
+        try:
+            result = _subtype_cache[key]
+        except KeyError:
+            _subtype_cache.misses += 1
+            result = _subtype_cache[key] = bool(self._lt(superclass))
+        else:
+            _subtype_cache.hits += 1
+        return result
+
+    def _lt(self, superclass: 'TypeObject') -> bool:
         if isinstance(superclass, _Any):
             return True
         if isinstance(superclass, _Union):
-            return any(self < arg for arg in superclass.args)
-        elif isinstance(superclass, TypeObject):
-            if all(a <= superclass for a in self.args):
-                return any(types[base] <= superclass for base in self.bases)
+            return any(self <= arg for arg in superclass.args)
+        if superclass is self:
             return False
-
-    def __eq__(self, other: 'TypeObject') -> bool:
-        if isinstance(other, (_Union, _Any)):
+        if superclass.name != self.name and superclass.name not in self.ancestors:
             return False
-        if self is other:
-            return True
+        return self._args_le(superclass)
 
-        return self.name == other.name  # would rather this not be relied on as types should be singletons.
+    def _args_le(self, superclass: 'TypeObject') -> bool:
+        """
+        `list[int] <= Sequence[int | str]`, but not `list[bool] <= list[int]`: see `INVARIANT`. unparameterized on either side counts as
+        compatible.
+        """
+        if self.args == (ANY, ) or superclass.args == (ANY, ):
+            return True
+        if len(self.args) != len(superclass.args):
+            return False
+        invariant = INVARIANT.get(superclass.name.rsplit('.', 1)[-1], ()) if superclass.name else ()
+        return all(_same(a, b) if i in invariant else a <= b for i, (a, b) in enumerate(zip(self.args, superclass.args)))
 
     def __le__(self, other: 'TypeObject') -> bool:
-        return self == other or self < other
+        return self is other or self < other
 
     def __or__(self, other: 'TypeObject') -> 'TypeObject':
-        if isinstance(other, _Any):
-            return ANY
+        return _Union(self, other)
+
+
+_interned_types: 'weakref.WeakValueDictionary[tuple, TypeObject]' = weakref.WeakValueDictionary()
+
+
+class _SubtypeCache(dict):
+    """(sub, super) -> is `sub < super`. emptied whenever stubs are (re)loaded, since that can add bases."""
+
+    MAX_SIZE = 1 << 16
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __setitem__(self, key: tuple, value: bool) -> None:
+        if len(self) >= self.MAX_SIZE:
+            self.clear()  # it holds its types alive, so don't let it grow with every temporary union.
+        super().__setitem__(key, value)
+
+    def invalidate(self) -> None:
+        self.clear()
+        self.generation += 1
+
+
+_subtype_cache = _SubtypeCache()
 
-        if isinstance(other, _Union):
-            shared_names = self.data.keys() & other.data.keys()
-            data = {name: self[name] | other[name] for name in shared_names}
-            return _Union(self, other, data=data)
-        elif isinstance(other, TypeObject):
-            if self == other:
-                return self
-            else:
-                shared_names = self.data.keys() & other.data.keys()
-                data = {name: self[name] | other[name] for name in shared_names}
-                return _Union(self, other, data=data)
+
+def _slots_of(cls: type) -> list[str]:
+    return [slot for c in cls.__mro__ for slot in getattr(c, '__slots__', ()) if slot not in ('__weakref__', '_key', '_ancestors', '_ancestors_generation')]
+
+
+def _unpickle_type(key: tuple) -> TypeObject:
+    return key[0]._interned(key)
 
 
 class _Any(TypeObject):
-    def __lt__(self, other):
+    __slots__ = ()
+
+    def _lt(self, other):
         return False
 
 ANY = _Any('Any', set(), ())  # third arg is to avoid circular
 
 
+def _order(typ: TypeObject) -> tuple:
+    """what the members of a union are sorted by. the same for the same type in every process, unlike a repr or an id."""
+    if not isinstance(typ, TypeObject):
+        return '', type(typ).__qualname__, (False, repr(typ)), (), ()
+    cls = type(typ)
+    return cls.__module__, cls.__qualname__, (typ.name is None, typ.name or ''), tuple(sorted(typ.bases or ())), tuple(map(_order, typ.args))
+
+
 def onion(args: tuple[TypeObject]) -> TypeObject:
-    if len(args) == 1:
-        return args[0]
-    else:
-        return _Union(*args)
+    return _Union(*args)
 
 
 class _Union(TypeObject):
-    def __init__(self, *args: TypeObject, data: Optional[dict] = None):
-        self.args = args
-        super().__init__(name=None, bases=set.intersection(*(arg.bases for arg in self.args)))
+    """
+    always normalized: nested unions are flattened, members deduplicated and sorted, `X | Any` is `Any` and a union of one is just that member.
+    so `int | str` and `str | int | str` are the same object.
+    """
+    __slots__ = ()
 
-        if data is None:
-            names = set.intersection(*(set(arg.data.keys()) for arg in self.args))
-            data = {name: [] for name in names}
-            for name, ah in self.data.items():
-                for arg in self.args:
-                    ah.append(arg[name])
+    def __new__(cls, *args: TypeObject, data: Optional[dict] = None) -> TypeObject:
+        members = set()
+        for arg in args:
+            if isinstance(arg, _Union):
+                members.update(arg.args)
+            else:
+                members.add(arg)
+        if any(isinstance(member, _Any) for member in members):
+            return ANY
+        if len(members) == 1:
+            return members.pop()
+        self = cls._interned((cls, tuple(sorted(members, key=_order))))
+        if not hasattr(self, 'args'):
+            self.args = self._key[1]
+        return self
 
-            self.data = {name: _Union(*args) for name, args in data.items()}
+    def __init__(self, *args: TypeObject, data: Optional[dict] = None):
+        if hasattr(self, 'data'):
+            return
+        # bases may be any set (a frozenset, say), so not `set.intersection`
+        bases = set(functools.reduce(operator.and_, (frozenset(arg.bases) for arg in self.args)))
+        super().__init__(name=None, bases=bases, args=self.args)
+        if data is not None:
+            self.data.update(data)
 
-        else:
-            self.data = data
+    def __repr__(self) -> str:
+        return ' | '.join(map(repr, self.args))
 
     def __getitem__(self, item: str) -> typing.Union['TypeObject', 'BaseObject']:
+        # worked out on first access; most attributes of a union are never looked at.
+        if item not in self.data:
+            values = [arg[item] for arg in self.args]
+            if all(value is values[0] for value in values):
+                self.data[item] = values[0]
+            elif all(isinstance(value, TypeObject) for value in values):
+                self.data[item] = _Union(*values)
+            else:
+                raise NotImplementedError(f"`{item}` of {self!r} differs between the members and isn't a type")
         return self.data[item]
 
     def __setitem__(self, key: str, value: typing.Union['TypeObject', 'BaseObject']) -> None:
         self.data[key] = value
 
-    def __lt__(self, superclass: TypeObject) -> bool:
+    def _lt(self, superclass: TypeObject) -> bool:
         if isinstance(superclass, _Any):
             return True
-        return all(arg < superclass for arg in self.args)
+        return all(arg <= superclass for arg in self.args)
         # if isinstance(superclass, _Union):
         #     return all(arg < superclass for arg in self.args)
         # elif isinstance(superclass, TypeObject):
         #     return all(arg < superclass for arg in self.args)
 
-    def __eq__(self, other: TypeObject) -> bool:
-        if isinstance(other, (_Union, _Any)):
-            return False
-        return self is other
 
-    def __le__(self, other: TypeObject) -> bool:
-        return self == other or self < other
-
-    def __or__(self, other: TypeObject) -> '_Union':
-        if isinstance(other, _Any):
-            return ANY
-
-        if self == other:
-            return self
-
-        if isinstance(other, _Union):
-            shared_names = self.data.keys() & other.data.keys()
-            data = {name: self[name] | other[name] for name in shared_names}
-            args = set(self.args) | set(other.args)  # make sure TypeObjects are unique as possible, by design
-            return _Union(*args, data=data)
-        elif isinstance(other, TypeObject):
-            if other in self.args:
-                return self
-            else:
-                shared_names = self.data.keys() & other.data.keys()
-                data = {name: self[name] | other[name] for name in shared_names}
-                return _Union(*self.args, other, data=data)
+class TypeV(TypeObject):
+    __slots__ = ()
 
+    @classmethod
+    def _intern_key(cls, name: str, *constraints, **kwargs) -> tuple:
+        return cls, name
 
-class TypeV(TypeObject):
     def __init__(self, name: str, *constraints, bound=None, covariant: bool = False, contravariant: bool = False) -> None:
         super().__init__(name, set())
         # todo: consider handling covariants and contravariants? rn, only treated as free-variables.
@@ -333,12 +462,7 @@ class TypeV(TypeObject):
     def __getitem__(self, item):
         raise TypeVarImmutabilityViolation(f"Attempted to access TypeVar({self.name})'s ({item=})")
 
-    def __eq__(self, other):
-        if isinstance(other, TypeV):
-            return self.name == other.name
-        return False
-
-    def __lt__(self, other):  # either == or !=. covariant, contravariant, etc. handling will change this, but not rn.
+    def _lt(self, other):  # either == or !=. covariant, contravariant, etc. handling will change this, but not rn.
         return False
 
 
@@ -366,13 +490,22 @@ class BaseObject:
 
 
 class Literal(TypeObject):
+    __slots__ = ('vals', '_val_types')
+
+    @classmethod
+    def _intern_key(cls, name: str, vals: tuple['BaseObject'] = ()) -> tuple:
+        # the vals aren't hashable. the name spells them out (`Literal['r', 'w']`), so it's enough to tell literals apart.
+        return cls, name
+
     def __init__(self, name: str, vals: tuple[BaseObject]) -> None:
+        if hasattr(self, 'data'):
+            return
         super().__init__(name, set())
         self.vals = vals
         self._val_types: set[TypeObject] = {val.typ for val in self.vals}
 
-    def __lt__(self, other: TypeObject) -> bool:
-        if self == other:
+    def _lt(self, other: TypeObject) -> bool:
+        if self is other:
             return False
 
         if isinstance(other, Literal):
@@ -381,16 +514,6 @@ class Literal(TypeObject):
         else:
             return all(t <= other for t in self._val_types)  # type check
 
-    def __eq__(self, other: TypeObject) -> bool:
-        if isinstance(other, Literal):
-            if len(self.vals) != other.vals:
-                return False
-            return all(a._typ == b._typ and a == b for a, b in zip(self.vals, other.vals))
-        return False
-
-    def __le__(self, other: TypeObject) -> bool:
-        return self == other or self < other
-
 
 @dataclasses.dataclass
 class argument:
@@ -428,6 +551,7 @@ class Function(BaseObject):
         self.decorator_list = decorator_list
         self.is_overloaded = 'overload' in self.decorator_list
         self.annotations: list[tuple[arguments, TypeObject]] = annotations  # is a list bc possibly overloaded
+        self._dispatcher: Optional[OverloadDispatcher] = None  # built on the first call
 
     def returns(self, argumes: tuple[TypeObject] = (), keygumes: dict[str, TypeObject] = None):
         """inspect.getfullargspec(func)
@@ -462,86 +586,189 @@ class Function(BaseObject):
         keygumes = {} if keygumes is None else keygumes
 
         if self.is_overloaded:
-            for overloaded_func_candidate in self.annotations:  # the more specific args_annotations should be first
-                (args, varargs, kwonlyargs, kwonlydefaults, varkw, defaults), ret = overloaded_func_candidate
-                # posonly may be supported later, but typeshed doesn't really use them.
-
-                a_list = [arg.name for arg in args[:len(args) - len(defaults)]]
-                for a, d in zip(args[len(args) - len(defaults):], defaults):
-                    a_list.append(f"{a}={d}")
-                if varargs is not None:
-                    a_list.append(f"*{varargs.name}")
-
-                k_list = [kwa.name for kwa in kwonlyargs[:len(kwonlyargs) - len(kwonlydefaults)]]
-                for ka, kd in zip(kwonlyargs[len(kwonlyargs) - len(kwonlydefaults):], kwonlydefaults):
-                    k_list.append(f"{ka}={kd}")
-                if varkw is not None:
-                    k_list.append(f"**{varkw.name}")
-
-                names = [arg.name for arg in args] + ([] if varargs is None else [varargs]) + [kwa.name for kwa in kwonlyargs] + ([] if varkw is None else
-                                                                                                                                  [varkw])
-                func_code = "lambda " + ','.join(a_list + k_list) + ':' + ' and '.join(f"name._type < {name._type}" for name in names)
-                print(func_code)
-
-                func = eval(func_code)
-                try:
-                    type_check = func(*argumes, **keygumes)
-                except TypeError:
-                    continue
-                else:
-                    if type_check:
-                       return ret
-                    else:
-                        continue
-
-            if len(self.annotations) == 0:
-                return Exception(f"Overloaded function has an empty `annotations` field ")
-            else:
-                return Exception(f"args/kwargs don't match any overloaded annotations")
+            if self._dispatcher is None:
+                self._dispatcher = OverloadDispatcher(self.annotations)
+            return self._dispatcher.resolve(argumes, keygumes)
         else:
             return self.annotations[0][1]
 
 
+class _Overload:
+    """one `@overload`ed signature, taken apart once so that checking a call against it is just lookups and subtype checks."""
+    __slots__ = ('params', 'n_required', 'varargs', 'kwonly', 'required_kwonly', 'varkw', 'ret')
+
+    def __init__(self, signature: arguments, ret: TypeObject) -> None:
+        # posonly may be supported later, but typeshed doesn't really use them.
+        args, varargs, kwonlyargs, kwonlydefaults, varkw, defaults = signature
+        self.params: tuple[argument, ...] = tuple(args)
+        self.n_required = len(args) - len(defaults)
+        self.varargs: Optional[argument] = varargs
+        self.kwonly: dict[str, argument] = {kwa.name: kwa for kwa in kwonlyargs}
+        self.required_kwonly = frozenset(kwa.name for kwa in kwonlyargs[:len(kwonlyargs) - len(kwonlydefaults)])
+        self.varkw: Optional[argument] = varkw
+        self.ret = ret
+
+    @property
+    def max_positional(self) -> Optional[int]:
+        return None if self.varargs is not None else len(self.params)
+
+    def accepts(self, argumes: tuple[TypeObject], keygumes: dict[str, TypeObject]) -> bool:
+        bound: list[tuple[TypeObject, Optional[TypeObject]]] = []
+        for i, typ in enumerate(argumes):
+            param = self.params[i] if i < len(self.params) else self.varargs
+            bound.append((typ, param._type))
+
+        filled = set(range(min(len(argumes), len(self.params))))
+        kw_filled = set()
+        names = {param.name: i for i, param in enumerate(self.params)}
+        for name, typ in keygumes.items():
+            if name in names:
+                if names[name] in filled:
+                    return False  # got multiple values for argument
+                filled.add(names[name])
+                bound.append((typ, self.params[names[name]]._type))
+            elif name in self.kwonly:
+                kw_filled.add(name)
+                bound.append((typ, self.kwonly[name]._type))
+            elif self.varkw is not None:
+                bound.append((typ, self.varkw._type))
+            else:
+                return False
+
+        if not all(i in filled for i in range(self.n_required)) or not self.required_kwonly <= kw_filled:
+            return False
+        return all(expected is None or typ <= expected for typ, expected in bound)
+
+
+class OverloadDispatcher:
+    """
+    the `@overload` candidates of a function, bucketed by how many positional arguments they take.
+    a call only checks the candidates in its bucket, in declaration order (the more specific ones should come first, as in the stubs).
+    """
+
+    def __init__(self, annotations: list[tuple[arguments, TypeObject]]) -> None:
+        if len(annotations) == 0:
+            raise NoMatchingOverload("Overloaded function has an empty `annotations` field")
+        self.candidates = [_Overload(signature, ret) for signature, ret in annotations]
+        self._by_arity: dict[int, list[_Overload]] = defaultdict(list)
+        self._variadic: list[_Overload] = []  # the ones with *args, which take any number past their own parameters
+        bound = max(len(candidate.params) for candidate in self.candidates)
+        for candidate in self.candidates:
+            if candidate.max_positional is None:
+                self._variadic.append(candidate)
+            for n in range(0, (bound if candidate.max_positional is None else candidate.max_positional) + 1):
+                self._by_arity[n].append(candidate)
+        self._beyond = bound
+
+    def resolve(self, argumes: tuple[TypeObject], keygumes: dict[str, TypeObject]) -> TypeObject:
+        n = len(argumes)
+        bucket = self._by_arity.get(n, ()) if n <= self._beyond else self._variadic
+        for candidate in bucket:
+            if candidate.accepts(argumes, keygumes):
+                return candidate.ret
+        raise NoMatchingOverload("args/kwargs don't match any overloaded annotations")
+
+
 class Module(BaseObject):
+    """loaded on the first attribute access, and only then. get one through `modules[name]` so there's one per dotted name."""
+
     def __init__(self, name: str) -> None:
         super().__init__('types.ModuleType')
         self.name = name
-        self.is_imported = False
+        self.is_loaded = False
+        self.is_loading = False
+        self.error: Optional[Exception] = None  # why the stub failed to load. it isn't tried again.
 
     def _import(self):
-        self.data = takein_module(self.name)
+        if self.error is not None:
+            raise ErrorDuringImport(f"The stub of `{self.name}` failed to load: {self.error!r}") from self.error
+        if self.is_loading:
+            raise CircularImport(f"Circular access to `{self.name}` while its stub is still being loaded")
+        self.is_loading = True
+        start = time.perf_counter()
+        try:
+            self.data = takein_module(self.name)
+        except CircularImport:
+            raise  # may well load once whatever's loading now is done
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.is_loading = False
         self.is_loaded = True
+        modules.load_times[self.name] = time.perf_counter() - start
+
+    def load(self) -> None:
+        """loads it now rather than on first access"""
+        if not self.is_loaded:
+            self._import()
 
     def __getitem__(self, item: str) -> TypeObject | BaseObject:
-        if not self.is_imported:
+        if self.is_loaded:
+            modules.hits += 1
+        else:
+            modules.misses += 1
             self._import()
 
         # consider `__init__.pyi` too.
         return super().__getitem__(item)
 
-modules: [str, Module] = {}
+    def __reduce__(self):
+        # pickled into the stub cache by name, so that unpickling hands back the registry's module instead of a second copy.
+        return _registered_module, (self.name,)
+
+
+def _registered_module(name: str) -> Module:
+    return modules[name]
+
+
+class ModuleRegistry(dict):
+    """dotted name -> the one `Module` for it. looking a name up registers the module but doesn't load it."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.hits = 0  # attribute accesses on an already-loaded module
+        self.misses = 0  # attribute accesses that had to load the stub
+        self.load_times: dict[str, float] = {}  # seconds spent in `takein_module`, per module
+
+    def __missing__(self, name: str) -> Module:
+        module = self[name] = Module(name)
+        return module
+
+    def stats(self) -> dict:
+        return {'modules': len(self), 'loaded': len(self.load_times), 'hits': self.hits, 'misses': self.misses, 'load_times': dict(self.load_times)}
+
+
+modules = ModuleRegistry()
 ts_base_path = Path(inspect.getfile(typeshed_client)).parent / 'typeshed'
 
 
 def is_mod(name: str) -> bool:
     """
     :param name:
-    :return: True if module. False if object inside module
+    :return: True if module (or package) with a stub. False if object inside module
     """
-    names = name.split('.')
-    path = ts_base_path
-    for name in names:
-        path /= name
-        # assumes all directories have `__init__.py`
-        if not (os.path.exists(path) or os.path.exists(path.with_suffix('.pyi'))):
-            return False
-    return True
+    return name in stub_cache.module_index()
 
 
+@profiling.timed('stubs')
 def takein_module(module_nm: str) -> dict:
-    print(2, module_nm, modules)
-    st = typeshed_client.parser.get_stub_names(module_nm)
+    db = type_db.attached()
+    tables = None if db is None else db.module_tables(module_nm)
+    if tables is None:
+        tables = stub_cache.cached('tables', module_nm, lambda: _build_module_tables(module_nm))
+    _subtype_cache.invalidate()  # new classes may be bases of ones that were already asked about
+    # replay what building the tables did to the registry; a cache hit skips it.
+    for mod_nm in tables['imports']:
+        modules[mod_nm]  # registers it, doesn't load it.
+    return tables['names']
+
+
+def _build_module_tables(module_nm: str) -> dict:
+    STUBS.debug("building the tables of %s", module_nm)
+    st = stub_cache.get_stub_names(module_nm)
     result = {}
+    imported = []
 
     # why deepcopy? a shallow copy could work, but might as well make it deep tbh.
     defaults = {'types.FunctionType': TypeObject('types.FunctionType', set()),
@@ -557,18 +784,15 @@ def takein_module(module_nm: str) -> dict:
         elif x in _aliases:
             a = _aliases[x]
             if is_mod(nm:='.'.join(a)):
-                modules[nm] = Module(nm)
                 return modules[nm]
             else:
-                modules[a[0]] = Module(a[0])
                 return modules[a[0]][a[1]]
 
     def helper(c: ast.AST) -> TypeObject:
         if isinstance(c, typed_ast._ast3.Name):
             return helper(c.id)
         elif isinstance(c, typed_ast._ast3.Subscript):
-            print(7, a:=helper(c.value.id))
-            return a[helper(c.slice.value)]
+            return helper(c.value.id)[helper(c.slice.value)]
         elif isinstance(c, typed_ast._ast3.Tuple):
             return tuple(helper(elt) for elt in c.elts)
         elif isinstance(c, typed_ast._ast3.BinOp):
@@ -579,21 +803,18 @@ def takein_module(module_nm: str) -> dict:
             return get(c)
         elif isinstance(c, tuple):
             return get(c)
-        print(c)
+        STUBS.debug("can't turn %s into a type", Dump(c))
 
     # no need to handle nested classes and functions. should only handle top-level classes, top-level functions, and functions inside classes. anything else
     # is just smelly.
 
     for identifier, data in st.items():
-        print(1, identifier, data)
+        STUBS.debug("%s.%s: %s", module_nm, identifier, Dump(data.ast))
         if isinstance(data.ast, ImportedName):
             # note that `a = email; from a import charset` is illegal. thus, the following way is totes valid.
             mod_nm = '.'.join(data.ast.module_name)
-            if mod_nm in modules:  # cache
-                pass
-                # module = modules[mod_nm]
-            else:
-                modules[mod_nm] = Module(mod_nm)
+            imported.append(mod_nm)
+            modules[mod_nm]  # registers it. loading waits until something in it is used.
             # not storing in `result` bc of circular imports. also, importing an imported variable is just a code smell. if this later causes an issue,
             # it'd be better to just write my own typeshed at that point. continue the `studs` project. ('studs' from 'stubs' but more pleasant to look at and
             # handle)
@@ -612,13 +833,11 @@ def takein_module(module_nm: str) -> dict:
                 val = helper(data.ast.value)
                 for target in data.ast.targets:
                     result[target] = val
-                print(data.ast.__dict__)
             elif isinstance(data.ast.value, typed_ast._ast3.Call):
                 if data.ast.value.func.id == 'TypeVar':
                     for target in data.ast.targets:
                         _aliases[target.id] = TypeV(data.ast.value.args[0].s)
                 else:
-                    print(3, data.ast.targets[0].id)
                     raise Exception(f"Expected `TypeVar`, but got another function ({data.ast.value.func.id}) call in an assignment.")
             elif isinstance(data.ast.value, typed_ast._ast3.Name):
                 pass
@@ -628,31 +847,43 @@ def takein_module(module_nm: str) -> dict:
         # exit(19)
 
     # print(f"{imported_aliases=}")
+    return {'names': result, 'aliases': _aliases, 'imports': imported}
+
+
+_builtins_loaded = False
 
 
-# takein_module('email.charset')
-takein_module('builtins')
+def load_builtins() -> None:
+    """
+    loads the builtins stub, once. not when a `type_db` is attached: a worker with the parent's types mapped loads them as they're used.
+    whatever is going to type anything calls this first; importing the module doesn't load anything.
+    """
+    global _builtins_loaded
+    if _builtins_loaded:
+        return
+    if type_db.attached() is None:
+        takein_module('builtins')
+    _builtins_loaded = True
 
 
 class Scope:
+    """
+    a namespace with its declared names. which scope a name lives in (`self` for locals, the module for `global`, the enclosing function for
+    `nonlocal` and free names, the builtins root otherwise) is worked out once per name and kept in `_owners`, so loads and stores don't walk up
+    `parent_scope` every time.
+    """
+    __slots__ = ('parent_scope', 'is_comp_gen', 'is_class', 'locals', 'globals', 'nonlocals', 'state', 'table', '_owners', '_module')
+
+    @profiling.timed('scopes')
     def __init__(self, meat: Optional[AST] = None, parent_scope: Optional['Scope'] = None, is_comp_gen: bool = False) -> None:
         if meat is None and parent_scope is None:
-            self.locals = set()
-            self.nonlocals = set()
+            self._setup(None, False)
             self.globals = self.nonlocals = set()  # same identically, but doesn't matter.
-            self.parent_scope = None
-            self.state = {}
 
             self._import(None)
         elif meat is not None and parent_scope is not None:
-            self.parent_scope = parent_scope
-            self.globals = set()  # global declaration doesn't affect child scopes.
-            self.nonlocals = set()  # ^ ditto
-            self.locals = set()
-            AssignSniffer(self.locals, is_comp_gen=is_comp_gen).visit(meat)
-            GlobalAndNonlocalSniffer(self.globals, self.nonlocals).visit(meat)
-
-            self.state = {}
+            self._setup(parent_scope, is_comp_gen)
+            ScopeBuilder(self, meat)  # also creates all the scopes nested in `meat`. see `child`.
 
         else:
             raise Exception(f"Noneness isn't all false or all true. {meat=} and {parent_scope=}")
@@ -670,83 +901,138 @@ class Scope:
         {'a': 1}
         """
 
-    def load(self, identifier: str) -> type | BaseObject:
-        if identifier in self.locals:
-            val = self.state[identifier]
-            if isinstance(val, type):
-                return val
-            elif isinstance(val, BaseObject):
-                return val['typ']  # consider changing to `return val`. maybe handle `a.b` elsewhere?
-        elif identifier in self.nonlocals:
-            return self.parent_scope.load(identifier)
-        elif identifier in self.globals:
+    def _setup(self, parent_scope: Optional['Scope'], is_comp_gen: bool, is_class: bool = False) -> None:
+        self.parent_scope = parent_scope
+        self.is_comp_gen = is_comp_gen
+        self.is_class = is_class
+        self.globals = set()  # global declaration doesn't affect child scopes.
+        self.nonlocals = set()  # ^ ditto
+        self.locals = set()
+        self.state = {}
+        self.table: dict[int, Scope] = {}
+        self._owners: dict[str, Scope] = {}
+        self._module: Optional[Scope] = None
+
+    @classmethod
+    def _nested(cls, parent_scope: 'Scope', is_comp_gen: bool = False, is_class: bool = False) -> 'Scope':
+        """an empty scope for `ScopeBuilder` to fill in"""
+        scope = cls.__new__(cls)
+        scope._setup(parent_scope, is_comp_gen, is_class)
+        return scope
+
+    def child(self, node: AST, is_comp_gen: bool = False) -> 'Scope':
+        """the scope `node` (a function, class, lambda or comprehension inside this scope) introduces. built up front; O(1)."""
+        scope = self.table.get(id(node))
+        if scope is None or scope.parent_scope is not self:
+            # a node that wasn't there when the table was built (e.g. made by a rewrite)
+            scope = Scope(node, self, is_comp_gen=is_comp_gen)
+        return scope
+
+    @property
+    def module_scope(self) -> 'Scope':
+        """the one right under the builtins root. `global` names live there."""
+        if self._module is None:
             a, b = self, self.parent_scope
-            while b.parent_scope is not None:
+            while b is not None and b.parent_scope is not None:
                 a, b = b, b.parent_scope
-            return a.load(identifier)
+            self._module = a
+        return self._module
+
+    def owner(self, identifier: str) -> Optional['Scope']:
+        """the scope whose `state` holds `identifier`, as seen from here. None for a `nonlocal` with nothing to bind to."""
+        try:
+            return self._owners[identifier]
+        except KeyError:
+            pass
+
+        if self.parent_scope is None:
+            owner = self  # the builtins root
         elif identifier in self.globals:
-            a, b = self, self.parent_scope
-            while b is not None:
-                a, b = b, b.parent_scope
-            return a.load(identifier)
+            owner = self.module_scope
+        elif identifier in self.nonlocals:
+            owner = None
+            scope = self.parent_scope
+            while scope is not None and scope is not scope.module_scope:
+                if not scope.is_class and (identifier in scope.locals or identifier in scope.nonlocals):
+                    owner = scope.owner(identifier)
+                    break
+                scope = scope.parent_scope
+        elif identifier in self.locals:
+            owner = self
         else:
-            a = self
-            raise Exception(f"identifier `{identifier}` was not binded. \n" + '\n\t'.join(
-                map(str,
-                    ((a, a := a.parent_scope)[0] for _ in iter(lambda: a is None, True))
-                    )
-            )
-                            )
+            # free. class bodies aren't visible from the functions nested in them.
+            scope = self.parent_scope
+            while scope.is_class:
+                scope = scope.parent_scope
+            owner = scope.owner(identifier)
+
+        self._owners[identifier] = owner
+        return owner
+
+    def _declare(self, identifier: str) -> None:
+        """add a local after the fact. any scope of the table may have resolved it to somewhere further out, so they all forget."""
+        self.locals.add(identifier)
+        for scope in (*self.table.values(), self):
+            scope._owners.clear()
+
+    def _unbound(self, identifier: str) -> Exception:
+        a = self
+        return Exception(f"identifier `{identifier}` was not binded. \n" + '\n\t'.join(
+            map(str,
+                ((a, a := a.parent_scope)[0] for _ in iter(lambda: a is None, True))
+                )
+        )
+                         )
+
+    def load(self, identifier: str) -> type | BaseObject:
+        owner = self.owner(identifier)
+        if owner is None:
+            raise self._unbound(identifier)
+        val = owner.state[identifier]
+        if isinstance(val, type):
+            return val
+        elif isinstance(val, BaseObject):
+            return val['typ']  # consider changing to `return val`. maybe handle `a.b` elsewhere?
 
     def store(self, identifier: str, value: type | BaseObject) -> None:
         # can store to __builtins__.__dict__, but that's better handled outside
-        if identifier in self.globals:
-            a, b = self, self.parent_scope
-            while b.parent_scope is not None:
-                a, b = b, b.parent_scope
-            return a.store(identifier, value)
-        elif identifier in self.nonlocals:
-            self.parent_scope.store(identifier, value)
-        elif identifier in self.locals:
-            self.state[identifier] = value
+        owner = self.owner(identifier)
+        if owner is not None and owner.parent_scope is not None:
+            owner.state[identifier] = value
 
     def delete(self, identifier: str) -> None:
         # can delete identifier in  __builtins__.__dict__, but that's better handled outside
-        if identifier in self.globals:
-            a, b = self, self.parent_scope
-            while b.parent_scope is not None:
-                a, b = b, b.parent_scope
-            return a.delete(identifier)
-        elif identifier in self.nonlocals:
-            self.parent_scope.delete(identifier)
-        elif identifier in self.locals:
-            if identifier in self.state:
-                del self.state[identifier]
-            else:
-                raise Exception(f"identifier {identifier} ain't in state {self.state}. Trying to delete an unbound variable??")
+        owner = self.owner(identifier)
+        if owner is None or owner.parent_scope is None:
+            return
+        if identifier in owner.state:
+            del owner.state[identifier]
+        else:
+            raise Exception(f"identifier {identifier} ain't in state {owner.state}. Trying to delete an unbound variable??")
 
     def _import(self, module_name: Optional[str]) -> None:
         if module_name is not None:
-            self.locals.add(module_name)
-            mod = typeshed_client.parser.get_stub_names(module_name)
+            self._declare(module_name)
+            mod = stub_cache.get_stub_names(module_name)
             if mod is None:
                 raise ErrorDuringImport(f"Can't find {module_name}")
             self.store(module_name, mod)
-        else:
-            st = typeshed_client.parser.get_stub_names('builtins')
+        elif STUBS.isEnabledFor(logging.DEBUG):
+            # the builtins root binds nothing itself; this only logs what the stub has. reading the stub just for that cost every worker the
+            # whole builtins stub, even with the parent's types mapped from a `type_db`.
+            st = stub_cache.get_stub_names('builtins')
             for identifier, data in st.items():
                 if isinstance(data.ast, ImportedName):
-                    mod_nm, nm = data.ast.module_name, data.ast.name
-                    print(mod_nm, nm)
+                    STUBS.debug("builtins imports %s from %s", data.ast.name, '.'.join(data.ast.module_name))
                 elif isinstance(data.ast, typed_ast._ast3.Assign):
-                    print(data.ast.__dict__)
+                    STUBS.debug("builtins assigns %s", Dump(data.ast))
 
 
     def _from_import(self, _from: str, module_name: str) -> None:
-        self.locals.add(module_name)
+        self._declare(module_name)
 
         name = '.'.join((_from, module_name))
-        mod = typeshed_client.parser.get_stub_names(name)
+        mod = stub_cache.get_stub_names(name)
         if mod is None:
             raise ErrorDuringImport(f"Can't find {name}")
         self.store(module_name, mod)
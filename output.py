@@ -0,0 +1,126 @@
+"""
+turns the result of each target into output as soon as it comes back from the pool, so nothing is kept around once it's written.
+
+edits are spliced into the original source by byte offset (ast col offsets are utf-8 byte offsets), so everything outside a rewritten expression,
+comments and formatting included, stays as it was. only the rewritten expressions themselves go through `ast.unparse` (all of an f-string, for
+one inside it; see `rewriter.Rewriter._visit`). a new source that doesn't parse is never written out.
+"""
+import ast
+import dataclasses
+import difflib
+import os
+import sys
+import tempfile
+import typing
+from pathlib import Path
+from typing import TextIO
+
+if typing.TYPE_CHECKING:
+    import runner  # runner imports this module; only the annotation of `emit` needs it
+
+
+MODES = ('summary', 'diff', 'edits', 'in-place')
+
+
+@dataclasses.dataclass(frozen=True)
+class Edit:
+    lineno: int
+    col_offset: int
+    end_lineno: int
+    end_col_offset: int
+    replacement: str
+
+    def __str__(self) -> str:
+        return f"{self.lineno}:{self.col_offset}-{self.end_lineno}:{self.end_col_offset}: {self.replacement}"
+
+
+    @property
+    def is_insertion(self) -> bool:
+        return (self.lineno, self.col_offset) == (self.end_lineno, self.end_col_offset)
+
+
+def outermost(edits: typing.Iterable[Edit]) -> list[Edit]:
+    """
+    drops edits that fall inside another one (a rewritten argument of a call that was then rewritten as a whole). sorted by position.
+    insertions (an added import) go before whatever starts at the same spot.
+    """
+    result = []
+    end = (0, 0)
+    for edit in sorted(edits, key=lambda e: (e.lineno, e.col_offset, not e.is_insertion, -e.end_lineno, -e.end_col_offset)):
+        if not edit.is_insertion:
+            if (edit.end_lineno, edit.end_col_offset) <= end:
+                continue
+            end = (edit.end_lineno, edit.end_col_offset)
+        result.append(edit)
+    return result
+
+
+def apply_edits(source: str, edits: typing.Iterable[Edit]) -> str:
+    data = source.encode('utf-8')
+    line_starts = [0]
+    for line in data.splitlines(keepends=True):
+        line_starts.append(line_starts[-1] + len(line))
+
+    pieces = []
+    position = 0
+    for edit in outermost(edits):
+        start = line_starts[edit.lineno - 1] + edit.col_offset
+        end = line_starts[edit.end_lineno - 1] + edit.end_col_offset
+        pieces.append(data[position:start])
+        pieces.append(edit.replacement.encode('utf-8'))
+        position = end
+    pieces.append(data[position:])
+    return b''.join(pieces).decode('utf-8')
+
+
+def unified_diff(path: Path, source: str, new_source: str) -> typing.Iterator[str]:
+    return difflib.unified_diff(source.splitlines(keepends=True), new_source.splitlines(keepends=True), f'a/{path}', f'b/{path}')
+
+
+def write_in_place(path: Path, new_source: str) -> None:
+    """write to a temp file next to `path` and rename it over, so a crash never leaves a half-written target behind"""
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode='w', encoding='utf-8', newline='') as f:
+            f.write(new_source)
+        os.chmod(tmp, os.stat(path).st_mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def emit(result: 'runner.TargetResult', mode: str = 'summary', out: TextIO = sys.stdout, err: TextIO = sys.stderr) -> None:
+    """
+    :param mode: `summary` (one line per rewrite), `diff` (unified diff), `edits` (`lineno:col-end_lineno:end_col: replacement` per edit) or
+    `in-place` (rewrite the target)
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown output mode {mode!r}. Expected one of {MODES}")
+
+    new_source = result.new_source
+    if new_source is not None:
+        try:
+            ast.parse(new_source)
+        except SyntaxError as e:
+            # a bad edit. better to say so than to write it out.
+            err.write(f"{result.path}:{e.lineno}: the rewritten source doesn't parse ({e.msg}); left as it was\n")
+            new_source = None
+
+    if new_source is not None:
+        if mode == 'summary':
+            for rule, before, after, lineno, *_ in result.rewrites:
+                out.write(f"{result.path}:{lineno}: {before} -> {after}\n")
+        elif mode == 'diff':
+            with open(result.path, mode='r', encoding='utf-8', newline='') as f:  # as `rewriter.rewrite_file` read it
+                source = f.read()
+            out.writelines(unified_diff(result.path, source, new_source))
+        elif mode == 'edits':
+            for edit in result.edits:
+                out.write(f"{result.path}:{edit}\n")
+        elif mode == 'in-place':
+            write_in_place(result.path, new_source)
+
+    for diagnostic in result.diagnostics:
+        err.write(f"{diagnostic}\n")
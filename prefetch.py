@@ -0,0 +1,149 @@
+"""
+loads the typeshed stubs a batch of targets is going to need before any of them is analyzed.
+
+left alone, `models` loads a stub the first time something in it is used, and the stubs it imports the first time something in them is used, so a
+cold start is a long serial chain of stub parses. here the imports of the targets are followed through the stubs' own imports up front. the stubs
+that aren't cached yet are parsed in a process pool (a stub's imports are submitted as soon as it's parsed), then their tables are built and loaded
+into `models.modules` in this process. when the targets are spread over a pool as well, the workers then find the tables in the stub cache.
+"""
+import ast
+import typing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Optional
+
+from typeshed_client import ImportedName
+
+import profiling
+import stub_cache
+from matcher import RuleIndex
+from tracing import STUBS
+
+
+def target_imports(tree: ast.Module) -> set[str]:
+    """
+    every absolute import in `tree`, wherever it is, with the packages it's in (`import os.path` is `os` and `os.path`). `from a import b` gives
+    `a.b` too, in case `b` is a submodule; `load_closure` drops whatever isn't a stub.
+    """
+    found = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module] + [f'{node.module}.{alias.name}' for alias in node.names if alias.name != '*']
+        else:
+            continue
+        for name in names:
+            parts = name.split('.')
+            found.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    return found
+
+
+def stub_imports(stub_names: dict) -> set[str]:
+    """what a stub imports, from its `get_stub_names`. like `target_imports`, `from a import b` gives `a` and `a.b`."""
+    found = set()
+    for info in stub_names.values():
+        if isinstance(info.ast, ImportedName):
+            module = '.'.join(info.ast.module_name)
+            found.add(module)
+            if info.ast.name is not None:
+                found.add(f'{module}.{info.ast.name}')
+    return found
+
+
+def _parse(module_name: str) -> Optional[dict]:
+    # runs in the pool. also leaves the result in the on-disk cache.
+    return stub_cache.get_stub_names(module_name)
+
+
+@profiling.timed('stubs')
+def load_closure(roots: typing.Iterable[str], workers: int = 1) -> list[str]:
+    """
+    parses the stubs of `roots` and of everything they import, transitively, and keeps them in the stub cache.
+    :param workers: processes to parse in. 1 parses in this one.
+    :return: the modules that have a stub, in the order they were found
+    """
+    from models import is_mod  # not at the top: the pool's processes import this module too, and don't need the builtins tables
+
+    seen = set()
+    found = []
+    todo = []
+
+    def add(names: typing.Iterable[str]) -> None:
+        fresh = sorted(name for name in names if name not in seen and is_mod(name))
+        seen.update(fresh)
+        todo.extend(fresh)
+
+    def parsed(name: str, stub_names: Optional[dict]) -> None:
+        found.append(name)
+        if stub_names is not None:
+            add(stub_imports(stub_names))
+
+    add(roots)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = {}
+    try:
+        while todo or pending:
+            while todo:
+                name = todo.pop()
+                if pool is None:
+                    parsed(name, _parse(name))
+                elif (stub_names := stub_cache.load('stub_names', name)) is not stub_cache.MISSING:
+                    parsed(name, stub_names)
+                else:
+                    pending[pool.submit(_parse, name)] = name
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                try:
+                    stub_names = future.result()
+                except Exception as e:
+                    STUBS.debug("can't parse the stub of %s: %r", name, e)
+                    stub_names = None
+                else:
+                    stub_cache.store('stub_names', name, stub_names, persist=False)  # the worker has written it to disk
+                parsed(name, stub_names)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return found
+
+
+@profiling.timed('stubs')
+def publish(module_names: list[str]) -> None:
+    """builds the tables of `module_names` and loads them into `models.modules`. the ones found last, which tend to be dependencies, go first."""
+    import models
+
+    for name in reversed(module_names):
+        try:
+            models.modules[name].load()
+        except Exception as e:
+            # `Module.load` keeps the error and doesn't try again; using something in it raises `ErrorDuringImport`, and is reported there
+            STUBS.debug("prefetching %s failed: %r", name, e)
+
+
+def prefetch(targets: typing.Iterable[Path], index: Optional[RuleIndex] = None, workers: int = 1) -> list[str]:
+    """
+    :param index: if given, targets it can't match anything in are skipped. they're never typed, so their imports aren't needed.
+    :return: the modules loaded
+    """
+    roots = {'builtins'}
+    for path in targets:
+        try:
+            with open(path, mode='r', encoding='utf-8') as f:
+                source = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        if index is not None and not index.may_match(source, index.enabled(path)):
+            continue
+        try:
+            roots |= target_imports(ast.parse(source))
+        except SyntaxError:
+            continue
+
+    module_names = load_closure(roots, workers)
+    publish(module_names)
+    STUBS.info("prefetched %d stubs for the imports of the targets", len(module_names))
+    return module_names
@@ -0,0 +1,204 @@
+"""
+opt-in per-phase timing. off by default, and then a timed function only costs a global lookup.
+
+phases:
+    - `stubs`: `models.takein_module` and `stub_cache.get_stub_names`.
+    - `scopes`: building the symbol table of a module (`Scope.__init__`).
+    - `inference`: `get_type`, `resolve_generic_func` and `resolve_generic_init`.
+    - `constraints`: `Rewriter.check`.
+    - `rewrite`: walking the tree, matching, and instantiating replacements.
+
+times are exclusive: a `get_type` that loads a stub counts towards `stubs`, not `inference`. constraint checks and instantiations are also
+attributed to their rule.
+
+in the workers there's one `Profile` per target, shipped back with its result; `RunReport` adds them up in the parent, along with the hit/miss
+counters of every memo layer. what the parent does before the targets (compiling the rules, prefetching stubs, loading builtins, writing the
+`type_db`) is profiled by `stage`, and counted in the totals as well as on its own.
+"""
+import cProfile
+import collections
+import contextlib
+import fnmatch
+import functools
+import hashlib
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+
+PHASES = ('stubs', 'scopes', 'inference', 'constraints', 'rewrite')
+
+_options: Optional[tuple[Optional[str], str]] = None  # the arguments of `enable`. `None` while profiling is off.
+_active: Optional['Profile'] = None
+_stages: dict[str, list[dict]] = collections.defaultdict(list)  # name -> the reports of every `stage` of that name, in this process
+
+
+class Profile:
+    def __init__(self) -> None:
+        self.phases: collections.Counter[str] = collections.Counter()
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.rules: collections.Counter[int] = collections.Counter()
+        self._stack: list[list] = []  # [phase, start, time spent in nested phases]
+
+    def enter(self, phase: str) -> None:
+        self._stack.append([phase, time.perf_counter(), 0.0])
+
+    def exit(self, rule: Optional[int] = None) -> None:
+        phase, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.phases[phase] += elapsed - nested
+        self.calls[phase] += 1
+        if rule is not None:
+            self.rules[rule] += elapsed
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def report(self) -> dict:
+        return {'phases': dict(self.phases), 'calls': dict(self.calls), 'rules': dict(self.rules)}
+
+
+def timed(phase: str, rule: Optional[Callable[..., int]] = None) -> Callable:
+    """
+    :param rule: given the arguments of the decorated function, the index of the rule the time belongs to
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _active
+            if profile is None:
+                return func(*args, **kwargs)
+            profile.enter(phase)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.exit(None if rule is None else rule(*args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def counters() -> dict[str, int]:
+    """hits and misses of every memo layer that has been imported, flattened into `layer.counter`"""
+    result = {}
+    if 'stub_cache' in sys.modules:
+        result |= {f'stub_cache.{k}': v for k, v in sys.modules['stub_cache'].counts.items()}
+    if 'models' in sys.modules:
+        models = sys.modules['models']
+        result |= {'subtypes.hits': models._subtype_cache.hits, 'subtypes.misses': models._subtype_cache.misses}
+        result |= {f'modules.{k}': v for k, v in models.modules.stats().items() if k in ('hits', 'misses')}
+    if 'analyzer' in sys.modules:
+        result |= {f'call_results.{k}': v for k, v in sys.modules['analyzer'].call_results.stats().items() if k in ('hits', 'misses')}
+    return result
+
+
+def enable(cprofile: Optional[str] = None, cprofile_dir: str = '.') -> None:
+    """
+    :param cprofile: glob of the targets to also run under cProfile. each one's stats go to `cprofile_dir/<name>-<hash of its path>.prof`.
+    """
+    global _options
+    _options = (cprofile, cprofile_dir)
+
+
+def config() -> Optional[tuple[Optional[str], str]]:
+    """the arguments of `enable`, to hand to worker processes. `None` if profiling is off."""
+    return _options
+
+
+@contextlib.contextmanager
+def _profiled(report: dict, cprofile_to: Optional[Path] = None) -> Iterator[None]:
+    """fills `report` once the block exits. :param cprofile_to: also run the block under cProfile, with its stats going there"""
+    global _active
+    before = counters()
+    _active = profile = Profile()
+    profiler = None
+    if cprofile_to is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _active = None
+        if profiler is not None:
+            profiler.disable()
+            cprofile_to.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(cprofile_to)
+        after = counters()
+        report |= profile.report()
+        report['seconds'] = elapsed
+        report['counters'] = {k: v - before.get(k, 0) for k, v in after.items()}
+
+
+@contextlib.contextmanager
+def target(path: Path) -> Iterator[Optional[dict]]:
+    """
+    profiles everything that happens to `path` inside the block. yields a dict that's filled in once the block exits, or `None` if profiling is off.
+    """
+    if _options is None:
+        yield None
+        return
+
+    report = {}
+    cprofile, cprofile_dir = _options
+    cprofile_to = None
+    if cprofile is not None and fnmatch.fnmatch(str(path), cprofile):
+        # the hash of the whole path keeps targets of the same name (every `__init__.py`) apart
+        cprofile_to = Path(cprofile_dir) / f'{Path(path).name}-{hashlib.sha1(str(path).encode()).hexdigest()[:10]}.prof'
+    with _profiled(report, cprofile_to):
+        yield report
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """profiles a step of the parent that isn't any one target's. `RunReport` picks it up from here. does nothing if profiling is off."""
+    if _options is None:
+        yield
+        return
+
+    report = {}
+    try:
+        with _profiled(report):
+            yield
+    finally:
+        _stages[name].append(report)
+
+
+class RunReport:
+    """the per-target reports of a run, and the `stage`s of the parent, added up"""
+
+    def __init__(self) -> None:
+        self.phases: collections.Counter[str] = collections.Counter()
+        self.calls: collections.Counter[str] = collections.Counter()
+        self.rules: collections.Counter[int] = collections.Counter()
+        self.counters: collections.Counter[str] = collections.Counter()
+        self.files: dict[str, float] = {}
+        self.start = time.perf_counter()
+
+    def add(self, path: Path, report: Optional[dict]) -> None:
+        if report is None:
+            return  # reused from the incremental state, or profiling is off in the worker
+        self.phases.update(report['phases'])
+        self.calls.update(report['calls'])
+        self.rules.update({int(k): v for k, v in report['rules'].items()})
+        self.counters.update(report['counters'])
+        self.files[str(path)] = report['seconds']
+
+    def report(self, top: int = 10) -> dict:
+        phases, calls, counter_totals = self.phases.copy(), self.calls.copy(), self.counters.copy()
+        stages = {}
+        for name, reports in _stages.items():
+            stage_phases = collections.Counter()
+            for report in reports:
+                stage_phases.update(report['phases'])
+                calls.update(report['calls'])
+                counter_totals.update(report['counters'])
+            phases.update(stage_phases)
+            stages[name] = {'seconds': sum(report['seconds'] for report in reports), 'phases': dict(stage_phases)}
+        return {'seconds': time.perf_counter() - self.start,
+                'files': len(self.files),
+                'phases': {phase: {'seconds': phases[phase], 'calls': calls[phase]} for phase in PHASES},
+                'stages': stages,
+                'counters': dict(counter_totals),
+                'slowest_files': sorted(self.files.items(), key=lambda item: item[1], reverse=True)[:top],
+                'slowest_rules': self.rules.most_common(top)}
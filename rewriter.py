@@ -0,0 +1,454 @@
+"""
+applies the rules in a `RuleIndex` to a module in one bottom-up walk.
+
+children are rewritten before their parents, so by the time a node is matched its subtrees are already at a fixed point. when a rule fires, only the
+new structure from the replacement template is walked again (the subtrees bound to metavariables aren't), and the node is re-matched until no rule
+applies. e.g. `random.randint(0, random.randrange(3) + 1)` -> ... -> `random.randrange(random.randrange(3) + 1 + 1)`.
+"""
+import ast
+import builtins
+import collections
+import collections.abc
+import copy
+import dataclasses
+import importlib
+import re
+import types
+import typing
+from pathlib import Path
+from typing import Any, Callable, Optional, Union, get_args, get_origin
+
+from matcher import Rule, RuleIndex, as_text
+import profiling
+from output import Edit, apply_edits
+from tracing import REWRITE
+
+
+MAX_REWRITES_PER_NODE = 32  # rules that undo each other would otherwise never stop.
+
+
+class Typer(typing.Protocol):
+    """what the engine needs from type inference. `analyzer.DemandTyper` is the real one."""
+
+    def __call__(self, node: ast.expr) -> Optional[type]:
+        """the type of `node`, or None if it can't be inferred"""
+
+    def bind(self, stmt: ast.stmt) -> None:
+        """called with each top-level statement once it has been rewritten, so that later statements see its assignments"""
+
+    def replaced(self, old: ast.expr, new: ast.expr, copies: dict[int, ast.AST]) -> None:
+        """
+        called when a rule puts `new` where `old` was, before it's spliced into the tree
+        :param copies: id(node in `new`) -> the bound node it's a copy of. the rest of `new` came from the template.
+        """
+
+
+class _NoTyper:
+    def __call__(self, node: ast.expr) -> Optional[type]:
+        return None
+
+    def bind(self, stmt: ast.stmt) -> None:
+        pass
+
+    def replaced(self, old: ast.expr, new: ast.expr, copies: dict[int, ast.AST]) -> None:
+        pass
+
+
+@dataclasses.dataclass
+class Rewrite:
+    rule: Rule
+    before: str
+    after: str
+    lineno: int
+    col_offset: int
+    end_lineno: int
+    end_col_offset: int
+
+
+@dataclasses.dataclass
+class Diagnostic:
+    path: Optional[Path]
+    lineno: int
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.path}:{self.lineno}: {self.message}"
+
+
+@dataclasses.dataclass
+class FileResult:
+    path: Optional[Path]
+    source: str
+    tree: Optional[ast.Module]  # None if the file was skipped without parsing it (see `RuleIndex.may_match`)
+    rewrites: list[Rewrite]
+    diagnostics: list[Diagnostic]
+    edits: list[Edit] = dataclasses.field(default_factory=list)
+
+    @property
+    def new_source(self) -> str:
+        return apply_edits(self.source, self.edits) if self.edits else self.source
+
+
+# constraints that are about the shape of the bound node rather than its type
+_NODE_KINDS: dict[str, type[ast.AST]] = {'Identifier': ast.Name}
+# int is acceptable where float is expected, etc. (PEP 484 numeric tower)
+_PROMOTIONS: dict[type, tuple[type, ...]] = {float: (int,), complex: (int, float)}
+# the parameters (by position) that are invariant, as in `models.INVARIANT`: a `list[int]` doesn't satisfy `list[float]`. the rest are covariant.
+_INVARIANT: dict[type, tuple[int, ...]] = {
+    list: (0,), set: (0,), dict: (0, 1), collections.abc.MutableSequence: (0,), collections.abc.MutableSet: (0,),
+    collections.abc.MutableMapping: (0, 1), collections.abc.Mapping: (0,), collections.deque: (0,), collections.defaultdict: (0, 1),
+    collections.OrderedDict: (0, 1), collections.Counter: (0,), collections.ChainMap: (0, 1),
+}
+
+
+def satisfies(actual: Any, expected: Any) -> bool:
+    """is `actual` (an inferred type) acceptable where `expected` (a resolved constraint) is required?"""
+    if expected is Any:
+        return True
+    if actual is None:
+        return False
+    if actual is Any:
+        return True
+    if get_origin(expected) in (Union, types.UnionType):
+        return any(satisfies(actual, e) for e in get_args(expected))
+    if get_origin(actual) in (Union, types.UnionType):
+        return all(satisfies(a, expected) for a in get_args(actual))
+
+    origin_e = get_origin(expected) or expected
+    origin_a = get_origin(actual) or actual
+    if not (isinstance(origin_a, type) and isinstance(origin_e, type)):
+        return actual == expected
+    if not (issubclass(origin_a, origin_e) or origin_a in _PROMOTIONS.get(origin_e, ())):
+        return False
+
+    args_e, args_a = get_args(expected), get_args(actual)
+    if not args_e or not args_a or len(args_e) != len(args_a):
+        return True  # unparameterized on either side. nothing more to check.
+    invariant = _INVARIANT.get(origin_e, ())
+    return all(satisfies(a, e) and (i not in invariant or satisfies(e, a)) for i, (a, e) in enumerate(zip(args_a, args_e)))
+
+
+class ConstraintResolver:
+    """turns the `Sequence`, `Iterable[a]`, ... on the right of `=>` into types, going through `type_shorts`"""
+
+    def __init__(self, type_shorts: dict[str, str], resolved: Optional[dict[str, Any]] = None) -> None:
+        """:param resolved: constraints resolved already (`RuleIndex.constraint_types`)"""
+        self.type_shorts = type_shorts
+        self._cache: dict[str, Any] = dict(resolved or {})
+
+    def resolve(self, text: str, bound_types: Optional[dict[str, Any]] = None) -> Any:
+        """:param bound_types: the inferred types of the metavariables, for constraints like `Iterable[a]`"""
+        if text in self._cache:
+            return self._cache[text]
+        refers_to_metavar = []
+        result = self._resolve(ast.parse(text, mode='eval').body, bound_types or {}, refers_to_metavar)
+        if not refers_to_metavar:
+            self._cache[text] = result
+        return result
+
+    def _resolve(self, node: ast.expr, bound_types: dict[str, Any], refers_to_metavar: list) -> Any:
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name in bound_types:
+                refers_to_metavar.append(name)
+                return bound_types[name] or Any
+            if name in self.type_shorts:
+                return self._dotted(self.type_shorts[name])
+            if name in _NODE_KINDS:
+                return _NODE_KINDS[name]
+            if hasattr(builtins, name):
+                return getattr(builtins, name)
+            if hasattr(typing, name):
+                return getattr(typing, name)
+            if isinstance(kind := getattr(ast, name, None), type) and issubclass(kind, ast.AST):
+                return kind
+            raise NameError(f"Can't resolve `{name}` in a rule constraint. Add it to the type_shorts header?")
+        elif isinstance(node, ast.Attribute):
+            return self._dotted(ast.unparse(node))
+        elif isinstance(node, ast.Subscript):
+            origin = self._resolve(node.value, bound_types, refers_to_metavar)
+            if isinstance(node.slice, ast.Tuple):
+                args = tuple(self._resolve(elt, bound_types, refers_to_metavar) for elt in node.slice.elts)
+            else:
+                args = self._resolve(node.slice, bound_types, refers_to_metavar)
+            return origin[args]
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+            return Union[self._resolve(node.left, bound_types, refers_to_metavar), self._resolve(node.right, bound_types, refers_to_metavar)]
+        raise SyntaxError(f"Unsupported rule constraint `{ast.unparse(node)}`")
+
+    @staticmethod
+    def _dotted(path: str) -> Any:
+        module, _, name = path.rpartition('.')
+        if not module:
+            return getattr(builtins, name)
+        return getattr(importlib.import_module(module), name)
+
+
+def _names_in(bound: ast.AST | str) -> set[str]:
+    if isinstance(bound, str):
+        return {bound}
+    return {n.id for n in ast.walk(bound) if isinstance(n, ast.Name)}
+
+
+def _fresh_names(template: ast.expr, metavars: typing.Container[str]) -> set[str]:
+    """names the template binds itself (comprehension targets, walrus), e.g. `d` in `(d.b() for d in c)`"""
+    result = set()
+    for node in ast.walk(template):
+        targets = []
+        if isinstance(node, ast.comprehension):
+            targets.append(node.target)
+        elif isinstance(node, ast.NamedExpr):
+            targets.append(node.target)
+        for target in targets:
+            result |= {n.id for n in ast.walk(target) if isinstance(n, ast.Name) and n.id not in metavars}
+    return result
+
+
+class _Instantiator(ast.NodeTransformer):
+    def __init__(self, rule: Rule, bindings: dict[str, ast.AST | str]) -> None:
+        self.rule = rule
+        self.bindings = bindings
+        self.inserted: dict[int, ast.AST] = {}  # id(copy of a bound subtree) -> what it copies. they're already rewritten.
+
+        taken = set().union(*map(_names_in, bindings.values())) if bindings else set()
+        self.renames = {}
+        for name in _fresh_names(rule.template, rule.constraints):
+            new = name
+            while new in taken:
+                new += '_'
+            self.renames[name] = new
+        if bindings:
+            alternation = '|'.join(map(re.escape, sorted(bindings, key=len, reverse=True)))
+            self._metavar_re = re.compile(rf'\b({alternation})\b')
+        else:
+            self._metavar_re = None
+
+    def _copy(self, bound: ast.AST) -> ast.AST:
+        new = copy.deepcopy(bound)
+        self.inserted[id(new)] = bound
+        return new
+
+    def visit_Name(self, node: ast.Name) -> ast.AST:
+        if node.id in self.bindings:
+            bound = self.bindings[node.id]
+            if isinstance(bound, ast.Attribute) and self._bound_as_attr(node.id):
+                return ast.copy_location(ast.Name(bound.attr, node.ctx), node)
+            if isinstance(bound, ast.AST):
+                new = self._copy(bound)
+                if hasattr(new, 'ctx'):
+                    new.ctx = node.ctx
+                return new
+            return ast.copy_location(ast.Name(bound, node.ctx), node)
+        if node.id in self.renames:
+            node.id = self.renames[node.id]
+        return node
+
+    def visit_Attribute(self, node: ast.Attribute) -> ast.AST:
+        self.generic_visit(node)
+        if node.attr in self.bindings:
+            node.attr = as_text(self.bindings[node.attr])
+        return node
+
+    def visit_Constant(self, node: ast.Constant) -> ast.AST:
+        if isinstance(node.value, str) and self._metavar_re is not None:
+            node.value = self._metavar_re.sub(lambda m: as_text(self.bindings[m[1]]), node.value)
+        return node
+
+    def _comprehension_display(self, node: ast.List | ast.Set, comp: type[ast.ListComp] | type[ast.SetComp]) -> ast.AST:
+        # `list(a) -> [a] => a:GeneratorExp` means a list comprehension, not a list holding a generator.
+        if len(node.elts) == 1 and isinstance(node.elts[0], ast.Name) and isinstance(self.bindings.get(node.elts[0].id), ast.GeneratorExp):
+            gen = self._copy(self.bindings[node.elts[0].id])
+            return ast.copy_location(comp(gen.elt, gen.generators), node)
+        self.generic_visit(node)
+        return node
+
+    def visit_List(self, node: ast.List) -> ast.AST:
+        return self._comprehension_display(node, ast.ListComp)
+
+    def visit_Set(self, node: ast.Set) -> ast.AST:
+        return self._comprehension_display(node, ast.SetComp)
+
+    def _bound_as_attr(self, name: str) -> bool:
+        """was `name` an attribute name in the pattern (`a.b`)? then a bare `b` in the template means the attribute name, not the expression."""
+        return any(isinstance(n, ast.Attribute) and n.attr == name for n in ast.walk(self.rule.pattern.root))
+
+
+@profiling.timed('rewrite', rule=lambda rule, bindings, location: rule.index)
+def instantiate(rule: Rule, bindings: dict[str, ast.AST | str], location: ast.AST) -> tuple[ast.expr, dict[int, ast.AST]]:
+    """
+    :return: the filled-in replacement, and id -> bound node of the copies of `bindings` in it (those don't need to be walked again)
+    """
+    filler = _Instantiator(rule, bindings)
+    new = filler.visit(copy.deepcopy(rule.template))
+    ast.copy_location(new, location)
+    ast.fix_missing_locations(new)
+    return new, filler.inserted
+
+
+# expressions that bind looser than whatever they could be replacing, so they're parenthesized when spliced in
+_LOOSE = (ast.BinOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Lambda, ast.NamedExpr, ast.UnaryOp, ast.Await, ast.Yield, ast.YieldFrom)
+
+
+def _in_place_of(new: ast.expr, old: ast.expr) -> str:
+    text = ast.unparse(new)
+    if isinstance(new, _LOOSE) and not isinstance(old, type(new)):
+        return f'({text})'
+    return text
+
+
+class Rewriter:
+    def __init__(self, index: RuleIndex, typer: Optional[Typer] = None, path: Optional[Path] = None) -> None:
+        self.index = index
+        self.packs = index.enabled(path)
+        self.resolvers = [ConstraintResolver(pack.type_shorts, resolved) for pack, resolved in zip(index.packs, index.constraint_types)]
+        self.typer = _NoTyper() if typer is None else typer
+        self.path = path
+        self.rewrites: list[Rewrite] = []
+        self.diagnostics: list[Diagnostic] = []
+        self.edits: list[Edit] = []  # original span -> final text, for every original expression that got replaced
+
+    @profiling.timed('rewrite')
+    def rewrite(self, tree: ast.Module) -> ast.Module:
+        for i, stmt in enumerate(tree.body):
+            tree.body[i] = self._visit(stmt, frozenset())
+            try:
+                self.typer.bind(tree.body[i])
+            except Exception as e:
+                self.diagnostics.append(Diagnostic(self.path, stmt.lineno, f"type inference gave up: {e!r}"))
+        return tree
+
+    @profiling.timed('constraints', rule=lambda self, rule, bindings: rule.index)
+    def check(self, rule: Rule, bindings: dict[str, ast.AST | str]) -> bool:
+        """are the `=> a:int,b:Sequence` constraints of `rule` met by what its metavariables bound to?"""
+        bound_types: dict[str, Any] = {}
+
+        def type_of(name: str) -> Any:
+            if name not in bound_types:
+                bound = bindings[name]
+                bound_types[name] = str if isinstance(bound, str) else self.typer(bound)
+            return bound_types[name]
+
+        for name, text in rule.constraints.items():
+            if name not in bindings:
+                continue
+            expected = self.resolvers[rule.pack].resolve(text, {n: type_of(n) for n in bindings if re.search(rf'\b{n}\b', text)})
+            bound = bindings[name]
+            if isinstance(expected, type) and issubclass(expected, ast.AST):
+                if isinstance(bound, str):
+                    if not (expected is ast.Name and bound.isidentifier()):
+                        return False
+                elif not isinstance(bound, expected):
+                    return False
+            elif not satisfies(type_of(name), expected):
+                REWRITE.debug("%s: rule %d: %s is %s, not %s", self.path, rule.index, name, type_of(name), text)
+                return False
+        return True
+
+    def _visit(self, node: ast.AST, skip: typing.Container[int], original: bool = True) -> ast.AST:
+        """
+        post-order: the children first, then `node` itself. nodes whose id is in `skip` are left alone.
+        :param original: is `node` from the parsed source (rather than from a replacement template)? only those have a span to edit.
+        """
+        if id(node) in skip:
+            return node
+        edits = len(self.edits)
+        self._visit_children(node, skip, original)
+        if original and isinstance(node, ast.JoinedStr) and len(self.edits) > edits:
+            # spliced into a replacement field, an edit's quotes may end the f-string (`f'{f'{n}b'}'`), so the whole of it is unparsed instead
+            del self.edits[edits:]
+            self.edits.append(Edit(node.lineno, node.col_offset, node.end_lineno, node.end_col_offset, ast.unparse(node)))
+        if isinstance(node, ast.expr):
+            new = self._rewrite_at(node)
+            if original and new is not node:
+                self.edits.append(Edit(node.lineno, node.col_offset, node.end_lineno, node.end_col_offset, _in_place_of(new, node)))
+            return new
+        return node
+
+    def _visit_children(self, node: ast.AST, skip: typing.Container[int], original: bool = True) -> None:
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                setattr(node, field, self._visit(value, skip, original))
+            elif isinstance(value, list):
+                for i, item in enumerate(value):
+                    if isinstance(item, ast.AST):
+                        value[i] = self._visit(item, skip, original)
+
+    def _rewrite_at(self, node: ast.expr) -> ast.expr:
+        original = node
+        for _ in range(MAX_REWRITES_PER_NODE):
+            for rule, bindings in self.index.match(node, self.packs):
+                if self.check(rule, bindings):
+                    new, inserted = instantiate(rule, bindings, node)
+                    self.typer.replaced(node, new, inserted)
+                    rewrite = Rewrite(rule, ast.unparse(node), ast.unparse(new), original.lineno, original.col_offset, original.end_lineno,
+                                      original.end_col_offset)
+                    self.rewrites.append(rewrite)
+                    REWRITE.debug("%s:%d: rule %d: %s -> %s", self.path, rewrite.lineno, rule.index, rewrite.before, rewrite.after,
+                                  extra={'fields': {'path': self.path, 'lineno': rewrite.lineno, 'rule': rule.index, 'before': rewrite.before,
+                                                    'after': rewrite.after}})
+                    # the template's own structure may match too, e.g. the `a + 1` in `random.randrange(a + 1)`
+                    if id(new) not in inserted:
+                        self._visit_children(new, inserted, original=False)
+                    node = new
+                    break
+            else:
+                return node
+        self.diagnostics.append(Diagnostic(self.path, original.lineno, f"rules kept rewriting `{ast.unparse(original)}`; stopped after "
+                                                                          f"{MAX_REWRITES_PER_NODE} rewrites"))
+        return node
+
+
+def rewrite_source(source: str, index: RuleIndex, typer_factory: Optional[Callable[[ast.Module], Typer]] = None,
+                   path: Optional[Path] = None) -> FileResult:
+    """:param path: only the rule packs that apply to it are used. all of them if None."""
+    if not index.may_match(source, index.enabled(path)):
+        return FileResult(path, source, None, [], [])
+    tree = ast.parse(source)
+    typer = None if typer_factory is None else typer_factory(tree)
+    rewriter = Rewriter(index, typer, path)
+    rewriter.rewrite(tree)
+    # rules only replace expressions, so the top-level statements are still the ones of the source
+    missing = {module for rewrite in rewriter.rewrites for module in rewrite.rule.imports} - _imported(tree)
+    if missing:
+        rewriter.edits.append(_import_edit(tree, sorted(missing), _newline(source)))
+    return FileResult(path, source, tree, rewriter.rewrites, rewriter.diagnostics, rewriter.edits)
+
+
+def _imported(tree: ast.Module) -> set[str]:
+    """modules bound under their own name at the top level (`import operator`, `import os.path` for `os`)"""
+    return {alias.name.split('.')[0] for stmt in tree.body if isinstance(stmt, ast.Import) for alias in stmt.names if alias.asname is None}
+
+
+def _newline(source: str) -> str:
+    """the line ending of the first line, for lines that are added. sources are read with `newline=''`, so it's still there."""
+    end = source.find('\n')
+    return '\r\n' if end > 0 and source[end - 1] == '\r' else '\n'
+
+
+def _import_edit(tree: ast.Module, modules: list[str], newline: str = '\n') -> Edit:
+    """`import ...` lines before the first import of the module, or after its docstring and `__future__` imports if it has no other imports"""
+    line = 1
+    for i, stmt in enumerate(tree.body):
+        if i == 0 and isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) and isinstance(stmt.value.value, str):
+            line = stmt.end_lineno + 1
+        elif isinstance(stmt, ast.ImportFrom) and stmt.module == '__future__':
+            line = stmt.end_lineno + 1
+        else:
+            if isinstance(stmt, (ast.Import, ast.ImportFrom)):
+                line = stmt.lineno
+            break
+    return Edit(line, 0, line, 0, ''.join(f'import {module}{newline}' for module in modules))
+
+
+def rewrite_file(path: Path, index: RuleIndex, typer_factory: Optional[Callable[[ast.Module], Typer]] = None) -> FileResult:
+    """
+    :param typer_factory: builds the type inferencer for the module. defaults to `analyzer.DemandTyper`.
+    """
+    if typer_factory is None:
+        from analyzer import DemandTyper  # pulls in typeshed. only needed once there's a file to rewrite.
+        typer_factory = DemandTyper
+    # newline='': edits are spliced in by byte offset into what's on disk, and `output.write_in_place` writes it back as is. translating
+    # `\r\n` here would turn every line of a CRLF file into `\n` on the way out.
+    with open(path, mode='r', encoding='utf-8', newline='') as f:
+        source = f.read()
+    return rewrite_source(source, index, typer_factory, path)
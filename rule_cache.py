@@ -0,0 +1,63 @@
+"""
+checks the rules once and keeps them compiled (the discrimination tree, the replacement templates and the resolved constraint types) in the stub
+cache directory, keyed by the raw bytes of the rule files and the pack settings. a hit doesn't read a single rule: the parent and every worker
+load the same pickle instead of parsing and compiling again.
+"""
+import hashlib
+import json
+import re
+import typing
+from typing import Any
+
+import stub_cache
+from errors import RuleError
+from matcher import RuleIndex, compile_packs
+from rewriter import ConstraintResolver
+from settings_shid import RulePack, get_rule_packs, pack_entries
+
+
+def rules_hash(setting: str | list[str | dict]) -> str:
+    """
+    :param setting: `rules` of settings.json
+    :raise OSError: if a rules file can't be read
+    """
+    digest = hashlib.sha256()
+    for entry in pack_entries(setting):
+        digest.update(json.dumps(entry, sort_keys=True).encode())
+        with open(entry['path'], mode='rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())  # the type_shorts header is in there too
+    return digest.hexdigest()
+
+
+def validate(index: RuleIndex) -> list[dict[str, Any]]:
+    """
+    every metavariable has to show up in its pattern, and every constraint has to resolve through its pack's type_shorts (or builtins/typing/ast).
+    :return: per pack, the constraints that don't mention a metavariable, resolved
+    :raise RuleError:
+    """
+    resolvers = [ConstraintResolver(pack.type_shorts) for pack in index.packs]
+    for rule in index.rules:
+        resolver = resolvers[rule.pack]
+        where = f"{index.packs[rule.pack].path or 'rule'} {rule.index} (`{rule.pattern.source} -> {rule.replacement}`)"
+        for name, text in rule.constraints.items():
+            if not re.search(rf'\b{re.escape(name)}\b', rule.pattern.source):
+                raise RuleError(f"{where}: metavariable `{name}` isn't in the pattern, so it's never bound")
+            try:
+                resolver.resolve(text, {metavar: Any for metavar in rule.constraints})
+            except (NameError, SyntaxError, AttributeError, ImportError, TypeError) as e:
+                raise RuleError(f"{where}: can't resolve the constraint `{name}:{text}`: {e}")
+    return [dict(resolver._cache) for resolver in resolvers]
+
+
+def _build(packs: typing.Sequence[RulePack]) -> RuleIndex:
+    index = compile_packs(packs)
+    index.constraint_types = validate(index)
+    return index
+
+
+def load(setting: str | list[str | dict]) -> RuleIndex:
+    """
+    :param setting: `rules` of settings.json. the files are only parsed if they aren't cached yet.
+    :raise RuleError: (only when it isn't cached yet; a cached rule set has passed already)
+    """
+    return stub_cache.cached('rules', rules_hash(setting), lambda: _build(get_rule_packs(setting)))
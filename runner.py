@@ -0,0 +1,139 @@
+"""
+runs the rewrite engine over every target of a hitlist. the targets don't depend on each other, so they're spread over a process pool.
+
+each worker calls `models.load_builtins` and loads the compiled rules once, in its initializer. it doesn't read the builtins stubs
+there: the parent snapshots the types and module tables it has into a `type_db` that every worker maps. after that a target only costs its own
+parse, inference and rewrite.
+"""
+import dataclasses
+import itertools
+import os
+import pickle
+import traceback
+import typing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Iterator, Optional
+
+import prefetch
+import profiling
+import tracing
+import rule_cache
+import stub_cache
+import type_db
+from matcher import RuleIndex
+from output import Edit
+from rewriter import Diagnostic, rewrite_file
+from tracing import STUBS
+
+
+@dataclasses.dataclass
+class TargetResult:
+    """what comes back from a worker. no ast and no `Rule` objects; they're expensive to pickle and the parent has its own copy of the rules."""
+    path: Path
+    new_source: Optional[str]  # None if no rule fired
+    rewrites: list[tuple[int, str, str, int, int, int, int]]  # (rule index, before, after, lineno, col_offset, end_lineno, end_col_offset)
+    diagnostics: list[Diagnostic]
+    edits: list[Edit] = dataclasses.field(default_factory=list)
+    profile: Optional[dict] = None  # see `profiling.target`. None unless profiling is on.
+
+
+_index: Optional[RuleIndex] = None
+
+
+def _init_worker(rules: str | list[str | dict], log_config: Optional[tuple[str, Optional[str]]] = None,
+                 profile_config: Optional[tuple[Optional[str], str]] = None, types_path: Optional[Path] = None) -> None:
+    global _index
+    if log_config is not None:
+        tracing.configure(*log_config)  # a spawned worker starts with logging unconfigured
+    if profile_config is not None:
+        profiling.enable(*profile_config)
+    if types_path is not None:
+        try:
+            type_db.attach(types_path)
+        except (OSError, ValueError) as e:
+            STUBS.warning("can't map the parent's types from %s, loading the stubs instead: %r", types_path, e)
+    import models
+
+    models.load_builtins()  # the typeshed state of this worker, built once
+
+    _index = rule_cache.load(rules)  # compiled by the parent already; this is a cache hit
+
+
+def _process(path: Path) -> TargetResult:
+    with profiling.target(path) as profile:
+        result = _rewrite(path)
+    result.profile = profile
+    return result
+
+
+def _rewrite(path: Path) -> TargetResult:
+    try:
+        result = rewrite_file(path, _index)
+    except SyntaxError as e:
+        return TargetResult(path, None, [], [Diagnostic(path, e.lineno or 0, f"can't parse: {e.msg}")])
+    except Exception as e:
+        return TargetResult(path, None, [], [Diagnostic(path, 0, f"{e!r}\n{traceback.format_exc()}")])
+
+    rewrites = [(r.rule.index, r.before, r.after, r.lineno, r.col_offset, r.end_lineno, r.end_col_offset) for r in result.rewrites]
+    return TargetResult(path, result.new_source if result.edits else None, rewrites, result.diagnostics, result.edits)
+
+
+def _snapshot_types() -> Optional[Path]:
+    """:return: where the parent's types went, for the workers. None if they couldn't be written; the workers load the stubs themselves then."""
+    with profiling.stage('builtins'):
+        import models
+
+        models.load_builtins()  # if prefetching didn't already
+
+    path = stub_cache.CACHE_DIR / stub_cache.cache_key() / f'types-{os.getpid()}.db'
+    try:
+        with profiling.stage('type_db'):
+            type_db.snapshot(path)
+    except (OSError, pickle.PicklingError, RecursionError, TypeError, AttributeError) as e:
+        STUBS.warning("can't snapshot the types for the workers: %r", e)
+        return None
+    return path
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+def run(targets: typing.Iterable[Path], rules: str | list[str | dict], workers: Optional[int] = None, prefetch_stubs: bool = False) \
+        -> Iterator[TargetResult]:
+    """
+    :param rules: `rules` of settings.json (see `settings_shid.pack_entries`)
+    :param workers: size of the process pool. `None` means one per cpu; 1 runs everything in this process (easier to debug).
+    :param prefetch_stubs: load the stubs of everything the targets import first, in parallel (see `prefetch`). off by default: it loads all
+        the stubs the imports reach, whether a match needs them or not, and a cold run ends up slower for it.
+    :return: results in the order they finish, not the order of `targets`
+    """
+    workers = default_workers() if workers is None else workers
+    if prefetch_stubs:
+        targets = list(targets)
+        with profiling.stage('prefetch'):
+            prefetch.prefetch(targets, rule_cache.load(rules), workers)
+    if workers <= 1:
+        with profiling.stage('builtins'):
+            _init_worker(rules)
+        for path in targets:
+            yield _process(path)
+        return
+
+    # only a few targets in flight per worker, so finished results don't pile up in their futures while the caller is still writing earlier ones
+    in_flight = workers * 4
+    types_path = _snapshot_types()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(rules, tracing.config(), profiling.config(), types_path)) as pool:
+            targets = iter(targets)
+            pending = {pool.submit(_process, path) for path in itertools.islice(targets, in_flight)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                pending |= {pool.submit(_process, path) for path in itertools.islice(targets, len(done))}
+    finally:
+        if types_path is not None:
+            types_path.unlink(missing_ok=True)
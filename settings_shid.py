@@ -1,90 +1,146 @@
+import ast
+import dataclasses
+import fnmatch
+import io
 import re
+import tokenize
 from pathlib import Path
 import json
 
+from errors import RuleError
+from tracing import RULES
+
+_FSTRING_START = getattr(tokenize, 'FSTRING_START', None)  # f-strings are tokenized piecewise from 3.12 on
+_FSTRING_END = getattr(tokenize, 'FSTRING_END', None)
+
 # import pyparsing
 
-def parse_rule(line: str) -> tuple[str]:
+def parse_rule(line: str) -> tuple[str, ...]:
+    """
+    splits `pattern -> replacement => constraints` at its arrows. the tokenizer takes care of strings, so an arrow inside one doesn't count, and of
+    a trailing comment.
+    :return: the stripped parts. `('',)` for a blank line.
+    """
+    if not line.strip():
+        return ('',)
+
+    cuts = []  # (start, end) column of each arrow
+    end = len(line)
+    previous = None
+    fstring_depth = 0
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(line).readline):
+            if token.type == _FSTRING_START:
+                fstring_depth += 1
+            elif token.type == _FSTRING_END:
+                fstring_depth -= 1
+            elif token.type == tokenize.COMMENT:
+                end = token.start[1]
+                break
+            elif token.type == tokenize.OP and fstring_depth == 0:
+                if token.string == '->':
+                    cuts.append((token.start[1], token.end[1]))
+                elif token.string == '>' and previous is not None and previous.string == '=' and previous.end == token.start:
+                    cuts.append((previous.start[1], token.end[1]))
+            previous = token
+    except (tokenize.TokenError, SyntaxError) as e:
+        raise RuleError(f"Can't tokenize rule `{line}`: {e}")
+
+    starts = [0] + [stop for _, stop in cuts]
+    stops = [start for start, _ in cuts] + [end]
+    return tuple(line[start:stop].strip() for start, stop in zip(starts, stops))
+
+
+def check_rule(parsed: tuple[str, ...], where: str) -> None:
+    """:raise RuleError: unless it's `pattern -> replacement [=> constraints]` with both sides valid python expressions"""
+    if len(parsed) not in (2, 3):
+        raise RuleError(f"{where}: expected `pattern -> replacement => constraints`, got {len(parsed)} part(s)")
+    for side, text in zip(('pattern', 'replacement'), parsed):
+        try:
+            ast.parse(text, mode='eval')
+        except SyntaxError as e:
+            raise RuleError(f"{where}: the {side} `{text}` isn't a python expression: {e.msg}")
+
+
+def get_rules(config_path: str) -> tuple[dict, tuple[tuple[str, ...], ...]]:
     """
-    just a parser for strings & escaped. (1) but with two flags: is_str and is_escaped; arrow notation handled too
-    :param line:
-    :return:
+    :return: the type_shorts of the header, and every rule line after the separator parsed by `parse_rule` (blank lines included, so that a rule's
+    index is its position)
+    :raise RuleError: if a rule isn't two python expressions and maybe constraints
     """
-    parts = [""]
-
-    is_str = 0  # 0: no, 1: single, 2: double
-    is_escaped = 0  # 0: not_escaped, 1: escaped
-
-    arrow = 0  # 0: none, 1: -, 2: =
-
-    for c in line:
-        if c == '\\':
-            if is_escaped == 1:
-                is_escaped = 0
-            else:
-                is_escaped = 1
-            continue
-        elif c == "'":
-            if is_str == 0:
-                if is_escaped == 1:  # \'
-                    raise Exception(f"How did \' get consumed when it's outside a string???\n\n\t{line=}")
-                else:
-                    is_str = 1  # '
-            elif is_str == 1 and is_escaped == 0:  # '...'
-                is_str = 0
-            else:
-                if is_str == 2 and is_escaped == 1:
-                    pass
-        elif c == '"':
-            if is_str == 0:
-                if is_escaped == 1:  # \'
-                    raise Exception(f"How did \' get consumed when it's outside a string???\n\n\t{line=}")
-                else:
-                    is_str = 2  # '
-            elif is_str == 2 and is_escaped == 0:  # '...'
-                is_str = 0
-            else:
-                if is_str == 1 and is_escaped == 1:
-                    pass
-
-        if is_str == 0:
-            if c == "=":
-                arrow = 2
-            elif c == "-":
-                arrow = 1
-            else:
-                if c == '>' and arrow in (1, 2):
-                    parts[-1] = parts[-1][:-1]
-                    parts.append('')
-                    continue
-                arrow = 0
-
-        if is_escaped == 1:
-            is_escaped = 0
-
-        parts[-1] += c
-
-    return tuple(map(str.strip, parts))
-
-
-def get_rules(config_path: str) -> tuple[dict, tuple[tuple[str], ...]]:
     with open(config_path, mode='r') as config_f:
-        # gets rid of comments and empty lines bc ("" in "#" and "#" in "#")
-        # lines = (line.rstrip('\n') for line in config_f if not line.startswith("#") and line != "")
-        lines = (line.rstrip('\n') for line in config_f if line[:1] not in "#")
-        separator = re.search(r'([\"\'])((\\{2})*|(.*?[^\\](\\{2})*))\1', next(lines).split('=')[1]).groups()[1]
+        # gets rid of comments bc ("#" in "#"). blank lines stay.
+        lines = ((lineno, line.rstrip('\n')) for lineno, line in enumerate(config_f, 1) if line[:1] not in "#")
+        separator = re.search(r'([\"\'])((\\{2})*|(.*?[^\\](\\{2})*))\1', next(lines)[1].split('=')[1]).groups()[1]
 
         type_shorts = {}
-        for line in iter(lines.__next__, separator):
+        for lineno, line in lines:
+            if line == separator:
+                break
             k, v = map(str.strip, line.split('='))
             type_shorts[k] = v
+        RULES.debug("type_shorts=%s", type_shorts)
 
-        print(f"{type_shorts=}")
-        rules = tuple(map(parse_rule, lines))
+        rules = []
+        for lineno, line in lines:
+            parsed = parse_rule(line)
+            if parsed[0]:
+                check_rule(parsed, f"{config_path}:{lineno}")
+            rules.append(parsed)
+        rules = tuple(rules)
+        RULES.debug("read %d rules from %s", len(rules), config_path)
 
     return type_shorts, rules
 
 
+@dataclasses.dataclass
+class RulePack:
+    """one rules file, with how it's used. several packs are compiled into one `RuleIndex` (see `matcher.compile_packs`)."""
+    path: str
+    type_shorts: dict[str, str]  # from the file's own header; they only apply to the pack's own constraints
+    rules: tuple[tuple[str, ...], ...]
+    priority: int = 0  # when rules of several packs match the same node, the higher priority is tried first
+    enable: tuple[str, ...] = ()  # globs of the targets the pack applies to. empty means all of them.
+    disable: tuple[str, ...] = ()  # globs of targets it doesn't apply to, even if `enable` says it does
+
+    def applies_to(self, target: Path) -> bool:
+        """the globs are matched against the whole path as written in the hitlist, with `/` separators. `*` matches across directories."""
+        path = Path(target).as_posix()
+        if self.enable and not any(fnmatch.fnmatchcase(path, glob) for glob in self.enable):
+            return False
+        return not any(fnmatch.fnmatchcase(path, glob) for glob in self.disable)
+
+
+def pack_entries(setting: str | list[str | dict]) -> list[dict]:
+    """
+    :param setting: `rules` of settings.json. a path, or a list of paths and of `{"path": ..., "priority": 1, "enable": [...], "disable": [...]}`.
+    :return: one `{"path", "priority", "enable", "disable"}` per pack, with the defaults filled in. doesn't read the files.
+    :raise RuleError: for an unknown key in a pack
+    """
+    entries = []
+    for entry in [setting] if isinstance(setting, str) else setting:
+        entry = {'path': entry} if isinstance(entry, str) else dict(entry)
+        unknown = entry.keys() - {'path', 'priority', 'enable', 'disable'}
+        if unknown or 'path' not in entry:
+            raise RuleError(f"rule pack {entry}: expected `path` and optionally `priority`, `enable`, `disable`; got {sorted(entry)}")
+        entries.append({'path': entry['path'], 'priority': entry.get('priority', 0), 'enable': list(entry.get('enable', ())),
+                        'disable': list(entry.get('disable', ()))})
+    return entries
+
+
+def get_rule_packs(setting: str | list[str | dict]) -> tuple[RulePack, ...]:
+    """
+    :param setting: see `pack_entries`
+    :raise RuleError: for an unknown key in a pack, or a bad rule in any of the files
+    """
+    packs = []
+    for entry in pack_entries(setting):
+        type_shorts, rules = get_rules(entry['path'])
+        packs.append(RulePack(entry['path'], type_shorts, rules, entry['priority'], tuple(entry['enable']), tuple(entry['disable'])))
+    RULES.debug("rule packs: %s", [(pack.path, pack.priority) for pack in packs])
+    return tuple(packs)
+
+
 def get_targets(hit_list_path: str) -> tuple[Path]:
     with open(hit_list_path, mode='r') as hit_list_f:
         comment = '#'
@@ -102,5 +158,5 @@ def get_targets(hit_list_path: str) -> tuple[Path]:
 
 
 def get_settings(settings_file_path: str) -> dict[str, str | bool]:
-    with open(settings_file_path, 'f') as f:
+    with open(settings_file_path, 'r') as f:
         return json.load(f)
@@ -0,0 +1,141 @@
+"""
+on-disk cache of typeshed stubs, so that every process start (and every worker, and every ci run) doesn't re-parse `builtins.pyi` and friends.
+
+three layers, all pickled under one versioned directory:
+    - `stub_names`: the raw `typeshed_client.parser.get_stub_names` output per module.
+    - `tables`: what `models.takein_module` made out of it (the `TypeObject`s, `Function` annotations and aliases).
+    - `rules`: compiled and checked rule sets, per hash of the rules (see `rule_cache`).
+    - `module_index`: every module and package there's a stub for, so `models.is_mod` doesn't have to touch the filesystem. the typeshed bundled
+      with typeshed_client is covered by the key; stubs installed next to packages aren't, so it's also per mtime of the search path directories.
+
+`get_stub_names` evaluates the `if sys.version_info >= ...`/`if sys.platform == ...` branches of the stubs, so the key has the python version and
+platform in it, as well as the typeshed_client version (new stubs) and `FORMAT_VERSION` (bump it whenever the pickled classes change shape).
+"""
+import collections
+import hashlib
+import importlib.metadata
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import typeshed_client
+
+import profiling
+
+
+FORMAT_VERSION = 2
+CACHE_DIR = Path(os.environ.get('OPTY_CACHE_DIR', Path(__file__).parent / '.opty_cache'))
+
+MISSING = object()
+_memory: dict[tuple[str, str], Any] = {}
+counts: collections.Counter[str] = collections.Counter()  # memory_hits, disk_hits and misses
+_module_index: Optional[frozenset[str]] = None
+
+
+def cache_key() -> str:
+    ts_version = importlib.metadata.version('typeshed_client')
+    return f"ts{ts_version}-py{sys.version_info[0]}.{sys.version_info[1]}-{sys.platform}-v{FORMAT_VERSION}"
+
+
+def cache_path(layer: str, module_name: str) -> Path:
+    return CACHE_DIR / cache_key() / layer / f'{module_name}.pickle'
+
+
+def load(layer: str, module_name: str) -> Any:
+    """:return: the cached value, or `MISSING`"""
+    if (layer, module_name) in _memory:
+        counts['memory_hits'] += 1
+        return _memory[layer, module_name]
+    try:
+        with open(cache_path(layer, module_name), mode='rb') as f:
+            value = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # missing, half-written by a crashed process, or pickled from classes that have since changed. rebuild it.
+        counts['misses'] += 1
+        return MISSING
+    counts['disk_hits'] += 1
+    _memory[layer, module_name] = value
+    return value
+
+
+def store(layer: str, module_name: str, value: Any, persist: bool = True) -> None:
+    """:param persist: write it to disk too. False for what another process has written already."""
+    _memory[layer, module_name] = value
+    if not persist:
+        return
+    path = cache_path(layer, module_name)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write then rename, so that another worker never reads a half-written file
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, mode='wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        # a read-only or full disk only costs us the speed-up.
+        pass
+
+
+def cached(layer: str, module_name: str, build: Callable[[], Any]) -> Any:
+    value = load(layer, module_name)
+    if value is MISSING:
+        value = build()
+        store(layer, module_name, value)
+    return value
+
+
+@profiling.timed('stubs')
+def get_stub_names(module_name: str) -> Optional[dict]:
+    """drop-in for `typeshed_client.parser.get_stub_names`"""
+    return cached('stub_names', module_name, lambda: typeshed_client.parser.get_stub_names(module_name))
+
+
+def _search_path() -> list[Path]:
+    # what typeshed_client searches by default, the interpreter's sys.path, minus the directory of the script being run
+    return [Path(entry) for entry in sys.path[1:] if entry]
+
+
+def _search_fingerprint(search_path: list[Path]) -> str:
+    # installing a package changes the mtime of the directory it's installed into
+    stamps = []
+    for entry in search_path:
+        try:
+            stamps.append((str(entry), os.stat(entry).st_mtime_ns))
+        except OSError:
+            stamps.append((str(entry), None))
+    return hashlib.sha256(repr(stamps).encode()).hexdigest()
+
+
+@profiling.timed('stubs')
+def _build_module_index(search_path: list[Path]) -> frozenset[str]:
+    context = typeshed_client.finder.get_search_context(search_path=search_path)
+    names = set()
+    for module_name, _ in typeshed_client.finder.get_all_stub_files(context):
+        parts = module_name.split('.')
+        names.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    return frozenset(names)
+
+
+def module_index() -> frozenset[str]:
+    """the dotted names of every module and package with a stub, typeshed's and installed ones. read (or built) once per process."""
+    global _module_index
+    if _module_index is None:
+        search_path = _search_path()
+        _module_index = cached('module_index', _search_fingerprint(search_path), lambda: _build_module_index(search_path))
+    return _module_index
+
+
+def clear() -> None:
+    """forget everything, on disk too. for when the stubs are swapped out under the same typeshed_client version."""
+    global _module_index
+    _memory.clear()
+    _module_index = None
+    root = CACHE_DIR / cache_key()
+    for path in sorted(root.rglob('*'), reverse=True):
+        if path.is_file():
+            path.unlink()
+        else:
+            path.rmdir()
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# the stub cache lives next to the code by default. tests get their own, shared by the subprocesses they start.
+os.environ.setdefault('OPTY_CACHE_DIR', tempfile.mkdtemp(prefix='opty-tests-'))
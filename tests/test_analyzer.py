@@ -0,0 +1,122 @@
+import ast
+import copy
+from typing import Union
+
+import analyzer
+from analyzer import DemandTyper
+
+
+def _replace(typer, old, template):
+    """what `rewriter.instantiate` does to a template: every node made up gets the location of the one it replaces"""
+    new = ast.parse(template, mode='eval').body
+    ast.copy_location(new, old)
+    ast.fix_missing_locations(new)
+    typer.replaced(old, new, {})
+    return new
+
+
+def test_template_nodes_are_inferred_not_taken_from_the_original():
+    tree = ast.parse("xs = [1, 2]\n")
+    typer = DemandTyper(tree)
+    old = tree.body[0].value
+    new = _replace(typer, old, "[['a']]")
+    # the inner list has the span and the node type of `[1, 2]`
+    assert typer(new.elts[0]) == list[str]
+    assert typer(old) == list[int]
+
+
+def test_a_rewrite_may_change_the_type():
+    tree = ast.parse("ys = [1, 2]\n")
+    typer = DemandTyper(tree)
+    old = tree.body[0].value
+    new = _replace(typer, old, "('a', 'b')")
+    assert typer(new) == tuple[str]
+
+
+def test_copies_of_bound_nodes_are_typed_as_the_original():
+    tree = ast.parse("xs = [1, 2]\nys = xs\n")
+    typer = DemandTyper(tree)
+    old = tree.body[1].value
+    bound = copy.deepcopy(old)
+    new = ast.copy_location(ast.Tuple([bound, ast.Constant('s')], ast.Load()), old)
+    ast.fix_missing_locations(new)
+    typer.replaced(old, new, {id(bound): old})
+    assert typer(bound) == list[int]
+    assert typer(new.elts[1]) is str
+
+
+class _State:
+    """hashable by identity, like a `Scope`"""
+
+    def __init__(self, answer):
+        self.answer = answer
+
+
+def test_call_results_are_per_scope(monkeypatch):
+    analyzer.call_results.clear()
+    monkeypatch.setattr(analyzer, '_resolve_generic_func', lambda cls, func_name, args, state: state.answer)
+    first, second = _State(int), _State(str)
+    assert analyzer.resolve_generic_func(list, '__iter__', (list,), first) is int
+    assert analyzer.resolve_generic_func(list, '__iter__', (list,), second) is str
+    assert analyzer.resolve_generic_func(list, '__iter__', (list,), first) is int
+    assert analyzer.call_results.stats()['hits'] == 1
+    analyzer.call_results.clear()
+
+
+def _load(tree, line, name):
+    """the load of `name` on `line`"""
+    return next(node for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)
+                and node.id == name and node.lineno == line)
+
+
+def _type_at(source, line, name='x'):
+    tree = ast.parse(source)
+    return DemandTyper(tree)(_load(tree, line, name))
+
+
+def test_a_reassignment_hides_the_one_before():
+    assert _type_at("x = 'a'\nx = 1\nx\n", 3) is int
+
+
+def test_branches_are_merged():
+    source = "import sys\nif sys.argv:\n    x = 'a'\nelse:\n    x = 1\nx\n"
+    assert _type_at(source, 6) == Union[str, int]
+    # assigned on one branch only, so maybe unbound
+    assert _type_at("import sys\nif sys.argv:\n    x = 1\nx\n", 4) is None
+
+
+def test_what_a_loop_assigns_reaches_its_top():
+    source = "x = 1\nfor i in range(3):\n    x\n    x = 'a'\nx\n"
+    assert _type_at(source, 3) == Union[int, str]
+    assert _type_at(source, 5) == Union[int, str]
+
+
+def test_global_and_nonlocal_writes_belong_to_the_owner():
+    source = "x = 1\ndef f():\n    global x\n    x = 'a'\nf()\nx\n"
+    assert _type_at(source, 6) == Union[int, str]
+    # nothing was called in between
+    assert _type_at("x = 1\ndef f():\n    global x\n    x = 'a'\nx\n", 5) is int
+    source = "def f():\n    x = 1\n    def g():\n        nonlocal x\n        x = 'a'\n    g()\n    x\n"
+    assert _type_at(source, 7) == Union[int, str]
+    # a read from a nested function takes every binding of the owner, its own included
+    source = "x = 1\ndef f():\n    global x\n    x = 'a'\ndef g():\n    x\n"
+    assert _type_at(source, 6) == Union[int, str]
+
+
+def test_a_replaced_value_is_what_the_name_gets():
+    tree = ast.parse("xs = [1, 2]\nxs\n")
+    typer = DemandTyper(tree)
+    load = _load(tree, 2, 'xs')
+    assert typer(load) == list[int]
+    _replace(typer, tree.body[0].value, "('a', 'b')")
+    assert typer(load) == tuple[str]
+
+
+def test_a_rewrite_inside_a_value_invalidates_the_name():
+    tree = ast.parse("xs = [[1, 2]]\nxs\n")
+    typer = DemandTyper(tree)
+    load = _load(tree, 2, 'xs')
+    assert typer(load) == list[list[int]]
+    outer = tree.body[0].value
+    outer.elts[0] = _replace(typer, outer.elts[0], "['a']")
+    assert typer(load) == list[list[str]]
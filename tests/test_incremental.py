@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def _run_main(cwd):
+    return subprocess.run([sys.executable, str(ROOT / 'main.py')], cwd=cwd, capture_output=True, text=True, timeout=600)
+
+
+def test_main_saves_and_reloads_the_state(tmp_path):
+    (tmp_path / 'target.py').write_text('import random\nn = random.randint(0, 5)\n', encoding='utf-8')
+    (tmp_path / 'hitlist.txt').write_text('target.py\n', encoding='utf-8')
+    settings = json.loads((ROOT / 'settings.json').read_text(encoding='utf-8'))
+    settings |= {'rules': str(ROOT / 'rules.txt'), 'targets': 'hitlist.txt', 'workers': 1, 'incremental': '.opty_state.json', 'output': 'diff'}
+    (tmp_path / 'settings.json').write_text(json.dumps(settings), encoding='utf-8')
+
+    first = _run_main(tmp_path)
+    assert first.returncode == 0, first.stderr
+    assert '+n = random.randrange(5 + 1)' in first.stdout
+    state = json.loads((tmp_path / '.opty_state.json').read_text(encoding='utf-8'))
+    assert list(state['entries']) == ['target.py']
+    assert 'new_source' not in state['entries']['target.py']  # made again from the edits
+
+    second = _run_main(tmp_path)
+    assert second.returncode == 0, second.stderr
+    assert second.stdout == first.stdout
+    assert json.loads((tmp_path / '.opty_state.json').read_text(encoding='utf-8')) == state
+
+
+def test_other_code_drops_the_state(tmp_path, monkeypatch):
+    import incremental
+
+    state = incremental.IncrementalState(tmp_path / 'state.json')
+    state.entries['target.py'] = incremental.Entry('hash', 0, 0, 'rules', 'stubs', [], [], [])
+    state.save()
+    assert list(incremental.IncrementalState(tmp_path / 'state.json').entries) == ['target.py']
+
+    monkeypatch.setattr(incremental, 'code_version', lambda: 'changed')
+    assert incremental.IncrementalState(tmp_path / 'state.json').entries == {}
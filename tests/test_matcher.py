@@ -0,0 +1,119 @@
+import ast
+import dataclasses
+from pathlib import Path
+
+from conftest import ROOT
+
+import rule_cache
+from matcher import compile_packs, compile_rules
+from settings_shid import RulePack
+
+
+def _expr(source):
+    return ast.parse(source, mode='eval').body
+
+
+def _matched(index, source):
+    return [(rule.replacement, {name: ast.unparse(bound) if isinstance(bound, ast.AST) else bound for name, bound in bindings.items()})
+            for rule, bindings in index.match(_expr(source))]
+
+
+def test_a_metavariable_binds_any_subtree():
+    index = compile_rules([('random.randint(0, a)', 'random.randrange(a + 1)', 'a:int')])
+    assert _matched(index, 'random.randint(0, f(x)[1])') == [('random.randrange(a + 1)', {'a': 'f(x)[1]'})]
+    assert _matched(index, 'random.randint(1, n)') == []
+    assert _matched(index, 'rand.randint(0, n)') == []
+    assert _matched(index, 'random.randint(0, n, m)') == []
+
+
+def test_a_repeated_metavariable_binds_the_same_thing():
+    index = compile_rules([('a + a', '2 * a', 'a:int')])
+    assert _matched(index, 'n.x + n.x') == [('2 * a', {'a': 'n.x'})]
+    assert _matched(index, 'n.x + n.y') == []
+    # the trie doesn't check it; `match` does
+    assert len(index.candidates(_expr('n.x + n.y'))) == 1
+
+
+def test_rules_with_the_same_left_hand_side_share_a_group():
+    index = compile_rules([('abs(a)', 'first', 'a:int'), ('len(a)', 'other', 'a:Sequence'), ('abs(b)', 'renamed', 'b:int'),
+                           ('abs(a)', 'second', 'a:str')])
+    # the one with `b` is the same pattern, but not the same left-hand side: it binds another name
+    assert len(index._groups) == 3
+    assert _matched(index, 'abs(n)') == [('first', {'a': 'n'}), ('renamed', {'b': 'n'}), ('second', {'a': 'n'})]
+
+
+def test_patterns_overlap_in_the_trie():
+    index = compile_rules([('random.randrange(a, b) * c', 'x', 'a:float,b:float,c:int'), ('a * b', 'y', 'a:Any,b:Any'),
+                           ('random.randrange(a, b)', 'z', 'a:float,b:float')])
+    assert [replacement for replacement, _ in _matched(index, 'random.randrange(1, 5) * 2')] == ['x', 'y']
+    assert [replacement for replacement, _ in _matched(index, 'random.randrange(1, 5)')] == ['z']
+    assert [replacement for replacement, _ in _matched(index, 'k * 2')] == ['y']
+
+
+# sources that some rule of the shipped packs matches somewhere in, written the ways a scan could trip over
+_MATCHED = [
+    "import random\nn = random.randint(0, 5)\n",
+    "x = random . randint(0, (\n    5))\n",
+    "s = str(n) + 'b'\n",
+    "s = F'n={n}'\n",
+    "s = rF'n={n}'\n",
+    "xs = list(map(str, ys))\n",
+    "mean = sum(xs) / len(xs)\n",
+]
+
+
+def test_may_match_has_no_false_negatives():
+    index = rule_cache.load([str(ROOT / 'rules.txt'), str(ROOT / 'rules_numeric.txt')])
+    sources = _MATCHED + [rule.pattern.source for rule in index.rules]
+    for source in sources:
+        matched = any(True for node in ast.walk(ast.parse(source)) for _ in index.match(node))
+        assert matched, source
+        assert index.may_match(source), source
+
+
+def test_may_match_skips_what_no_rule_can_match():
+    index = compile_rules([('random.randint(0, a)', 'random.randrange(a + 1)', 'a:int'), ("f'a={a}'", "f'{a=}'", 'a:Identifier')])
+    assert not index.may_match("import os\nos.getcwd()\n")
+    assert not index.may_match("x = 'a={n}'\n")  # not an f-string
+    # both anchors are needed, not either
+    assert not index.may_match("import random\nrandom.random()\n")
+    assert index.may_match("import random\nrandom.randint(0, 3)\n")
+    # the rules of the packs that don't apply don't count
+    assert not index.may_match("import random\nrandom.randint(0, 3)\n", frozenset())
+
+
+def test_higher_priority_packs_are_tried_first():
+    low = RulePack('low.txt', {}, (('abs(a)', 'low', 'a:int'),))
+    high = RulePack('high.txt', {}, (('abs(a)', 'high', 'a:int'),), priority=1)
+    index = compile_packs([low, high])
+    assert [(rule.replacement, rule.index, rule.pack) for rule, _ in index.match(_expr('abs(n)'))] == [('high', 1, 1), ('low', 0, 0)]
+    # equal priorities keep the settings order
+    index = compile_packs([low, dataclasses.replace(high, priority=0)])
+    assert [rule.replacement for rule, _ in index.match(_expr('abs(n)'))] == ['low', 'high']
+
+
+def test_a_rule_in_two_packs_is_kept_once_unless_their_globs_differ():
+    rule = ('abs(a)', 'x', 'a:int')
+    index = compile_packs([RulePack('a.txt', {}, (rule,)), RulePack('b.txt', {}, (rule,), priority=1)])
+    assert [(r.index, r.pack) for r in index.rules] == [(1, 1)]
+    index = compile_packs([RulePack('a.txt', {}, (rule,)), RulePack('b.txt', {}, (rule,), enable=('tests/*',))])
+    assert len(index.rules) == 2
+
+
+def test_pack_globs():
+    pack = RulePack('p.txt', {}, (), enable=('src/*',), disable=('*/vendored/*',))
+    assert pack.applies_to(Path('src/a.py'))
+    assert pack.applies_to(Path('src/deep/er/a.py'))  # `*` crosses directories
+    assert not pack.applies_to(Path('tests/a.py'))
+    assert not pack.applies_to(Path('src/vendored/a.py'))  # disable wins
+    assert RulePack('p.txt', {}, ()).applies_to(Path('anything.py'))
+
+
+def test_only_the_packs_that_apply_are_matched():
+    everywhere = RulePack('a.txt', {}, (('abs(a)', 'everywhere', 'a:int'),))
+    tests_only = RulePack('b.txt', {}, (('abs(a)', 'tests', 'a:int'),), enable=('tests/*',))
+    index = compile_packs([everywhere, tests_only])
+    assert index.enabled(Path('src/a.py')) == {0}
+    assert [rule.replacement for rule, _ in index.match(_expr('abs(n)'), index.enabled(Path('src/a.py')))] == ['everywhere']
+    assert [rule.replacement for rule, _ in index.match(_expr('abs(n)'), index.enabled(Path('tests/a.py')))] == ['everywhere', 'tests']
+    assert not index.may_match("abs(n)\n", frozenset())
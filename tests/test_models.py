@@ -0,0 +1,230 @@
+import ast
+import collections
+import os
+import symtable
+
+import pytest
+from conftest import ROOT
+
+import models
+import stub_cache
+from errors import ErrorDuringImport, NoMatchingOverload
+from models import OverloadDispatcher, Scope, TypeObject, _Union, argument, arguments
+from shared_state import builtin
+
+
+def test_interning_tells_bases_apart():
+    first = TypeObject('test_models.Thing', {'object'})
+    assert TypeObject('test_models.Thing', {'object'}) is first
+    other = TypeObject('test_models.Thing', {'int'})
+    assert other is not first
+    assert other.bases == {'int'}
+
+
+def test_union_order_doesnt_depend_on_the_order_given():
+    # same name, so the same repr; only the bases tell them apart
+    a = TypeObject('test_models.Same', {'object'})
+    b = TypeObject('test_models.Same', {'str'})
+    c = TypeObject('test_models.Other', {'object'})
+    union = _Union(a, b, c)
+    assert _Union(c, b, a) is union
+    assert _Union(b, _Union(c, a)) is union
+    assert union.args == (c, a, b)
+
+
+def test_a_failed_stub_load_isnt_retried(monkeypatch):
+    calls = []
+
+    def takein_module(name):
+        calls.append(name)
+        raise SyntaxError("bad stub")
+
+    monkeypatch.setattr(models, 'takein_module', takein_module)
+    module = models.Module('test_models_broken')
+    with pytest.raises(SyntaxError):
+        module['x']
+    with pytest.raises(ErrorDuringImport):
+        module['x']
+    with pytest.raises(ErrorDuringImport):
+        module.load()
+    assert calls == ['test_models_broken']
+    assert not module.is_loaded
+
+
+def test_a_union_of_types_with_frozen_bases():
+    a = TypeObject('test_models.FrozenA', frozenset({'object', 'test_models.Base'}))
+    b = TypeObject('test_models.FrozenB', frozenset({'test_models.Base'}))
+    assert _Union(a, b).bases == {'test_models.Base'}
+
+
+def test_mutable_generics_are_invariant():
+    # `INVARIANT` goes by the last part of the name
+    int_ = TypeObject('test_models.int', {'object'})
+    bool_ = TypeObject('test_models.bool', {'test_models.int'})
+    TypeObject('test_models.Sequence', {'object'})
+
+    def list_of(typ):
+        return TypeObject('test_models.list', {'test_models.Sequence'}, (typ, ))
+
+    assert bool_ <= int_
+    assert list_of(bool_) <= TypeObject('test_models.Sequence', {'object'}, (int_, ))
+    assert not list_of(bool_) <= list_of(int_)
+    assert list_of(int_) <= list_of(int_)
+
+
+def test_the_first_overload_that_fits_wins():
+    int_ = TypeObject('test_models.int', {'object'})
+    bool_ = TypeObject('test_models.bool', {'test_models.int'})
+    str_ = TypeObject('test_models.str', {'object'})
+    a, b, c, d = (TypeObject(f'test_models.{name}', {'object'}) for name in 'ABCD')
+
+    def signature(*params, varargs=None, defaults=()):
+        return arguments(tuple(argument(name, typ) for name, typ in params), varargs, (), (), None, defaults)
+
+    dispatcher = OverloadDispatcher([
+        (signature(('x', bool_)), a),
+        (signature(('x', int_)), b),  # `bool` fits too, but comes after
+        (signature(('x', int_), ('y', int_), defaults=(int_, )), c),
+        (signature(varargs=argument('args', str_)), d),
+    ])
+    assert dispatcher.resolve((bool_, ), {}) is a
+    assert dispatcher.resolve((int_, ), {}) is b
+    assert dispatcher.resolve((), {'x': int_}) is b
+    assert dispatcher.resolve((int_, int_), {}) is c
+    assert dispatcher.resolve((str_, ), {}) is d
+    assert dispatcher.resolve((str_, ) * 5, {}) is d  # more than any of them takes, so only `*args` is left
+    with pytest.raises(NoMatchingOverload):
+        dispatcher.resolve((int_, ) * 5, {})
+    # the ones that can't take two positional arguments aren't looked at for two
+    assert [candidate.ret for candidate in dispatcher._by_arity[2]] == [c, d]
+
+
+_SCOPE_NAMES = {ast.ListComp: 'listcomp', ast.SetComp: 'setcomp', ast.DictComp: 'dictcomp', ast.GeneratorExp: 'genexpr', ast.Lambda: 'lambda'}
+
+
+def _scope_nodes(tree):
+    """(name, lineno) as `symtable` has them -> the nodes, in the order it lists them"""
+    nodes = collections.defaultdict(list)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            nodes[node.name, node.lineno].append(node)
+        elif type(node) in _SCOPE_NAMES:
+            nodes[_SCOPE_NAMES[type(node)], node.lineno].append(node)
+    return {key: sorted(found, key=lambda node: node.col_offset) for key, found in nodes.items()}
+
+
+def _is_bound(table, name):
+    if name not in table.get_identifiers():
+        return False
+    symbol = table.lookup(name)
+    return symbol.is_assigned() or symbol.is_imported() or symbol.is_namespace() or symbol.is_parameter()
+
+
+def _python_owner(table, name, parents):
+    """the table python looks `name` up in, from `table`. None for builtins."""
+    symbol = table.lookup(name)
+    if table.get_type() == 'module' or symbol.is_declared_global() or symbol.is_global():
+        module = parents[0] if parents else table
+        return module if _is_bound(module, name) else None
+    if symbol.is_local():
+        return table
+    for parent in reversed(parents[1:]):
+        if parent.get_type() != 'class' and name in parent.get_identifiers() and parent.lookup(name).is_local():
+            return parent
+    return None
+
+
+def _owner_mismatches(source):
+    tree = ast.parse(source)
+    module = Scope(meat=tree, parent_scope=builtin)
+    nodes = _scope_nodes(tree)
+    top = symtable.symtable(source, '<test>', 'exec')
+    node_of = {id(top): tree}
+    mismatches = []
+
+    def walk(table, parents):
+        scope = module.table[id(node_of[id(table)])]
+        for name in table.get_identifiers():
+            if name.startswith('.'):
+                continue  # a comprehension's iterator
+            owner = _python_owner(table, name, parents)
+            expected = builtin if owner is None else module.table[id(node_of[id(owner)])]
+            if scope.owner(name) is not expected:
+                mismatches.append(f"{table.get_name()}:{table.get_lineno()}: {name}")
+        for child in table.get_children():
+            node_of[id(child)] = nodes[child.get_name(), child.get_lineno()].pop(0)
+            walk(child, parents + [table])
+    walk(top, [])
+    return mismatches
+
+
+def test_scopes_agree_with_python_on_this_repo():
+    # the sniffers `ScopeBuilder` replaced are gone; `symtable` is what they were after
+    for path in sorted(ROOT.glob('*.py')):
+        assert _owner_mismatches(path.read_text(encoding='utf-8')) == [], path.name
+
+
+def test_owners_of_global_and_nonlocal_names():
+    source = ("x = 1\n"
+              "def f():\n"
+              "    global x\n"
+              "    y = 2\n"
+              "    def g():\n"
+              "        nonlocal y\n"
+              "        def h():\n"
+              "            nonlocal y\n"
+              "            nonlocal z\n"
+              "            return [w := x for _ in y]\n"
+              "    class C:\n"
+              "        y = 3\n"
+              "        def m(self):\n"
+              "            return y\n")
+    tree = ast.parse(source)
+    module = Scope(meat=tree, parent_scope=builtin)
+    f = tree.body[1]
+    g, c = f.body[2], f.body[3]
+    h = g.body[1]
+    comp = h.body[2].value
+    scope = {node: module.table[id(node)] for node in (tree, f, g, c, c.body[1], h, comp)}
+    assert scope[f].owner('x') is scope[tree]
+    assert scope[g].owner('y') is scope[f]
+    assert scope[h].owner('y') is scope[f]  # through g's own `nonlocal`
+    assert scope[h].owner('z') is None  # nothing to bind to
+    assert scope[comp].owner('w') is scope[h]  # a walrus binds outside the comprehension
+    assert scope[comp].owner('x') is scope[tree]
+    assert scope[c].owner('y') is scope[c]
+    assert scope[c.body[1]].owner('y') is scope[f]  # class bodies aren't visible from their methods
+    assert scope[h].owner('len') is builtin
+
+
+def test_is_mod_goes_by_the_module_index():
+    assert models.is_mod('os')
+    assert models.is_mod('os.path')
+    assert models.is_mod('collections.abc')
+    assert not models.is_mod('os.getcwd')
+    assert not models.is_mod('test_models_nowhere')
+
+
+def test_installing_stubs_rebuilds_the_module_index(tmp_path, monkeypatch):
+    builds = []
+    build = stub_cache._build_module_index
+
+    def counted(search_path):
+        builds.append(search_path)
+        return build(search_path)
+
+    monkeypatch.setattr(stub_cache, '_search_path', lambda: [tmp_path])
+    monkeypatch.setattr(stub_cache, '_build_module_index', counted)
+    monkeypatch.setattr(stub_cache, '_module_index', None)
+    assert not models.is_mod('test_models_stubbed')
+    # a later process with nothing installed in between gets the cached one
+    monkeypatch.setattr(stub_cache, '_module_index', None)
+    assert not models.is_mod('test_models_stubbed')
+    assert len(builds) == 1
+
+    (tmp_path / 'test_models_stubbed-stubs').mkdir()
+    (tmp_path / 'test_models_stubbed-stubs' / '__init__.pyi').write_text('', encoding='utf-8')
+    os.utime(tmp_path, ns=(0, os.stat(tmp_path).st_mtime_ns + 1))  # in case the clock is too coarse to tell
+    monkeypatch.setattr(stub_cache, '_module_index', None)
+    assert models.is_mod('test_models_stubbed')
+    assert len(builds) == 2
@@ -0,0 +1,42 @@
+import io
+
+from conftest import ROOT
+
+import runner
+from output import emit
+
+
+def _rewrite_in_place(path, rules):
+    for result in runner.run([path], rules, workers=1, prefetch_stubs=False):
+        emit(result, 'in-place')
+
+
+def test_in_place_keeps_crlf(tmp_path):
+    path = tmp_path / 'target.py'
+    path.write_bytes(b'import random\r\n# untouched\r\nn = random.randint(0, 5)  # comment\r\nm = 1\r\n')
+    _rewrite_in_place(path, str(ROOT / 'rules.txt'))
+    assert path.read_bytes() == b'import random\r\n# untouched\r\nn = random.randrange(5 + 1)  # comment\r\nm = 1\r\n'
+
+
+def test_added_imports_use_the_file_line_ending(tmp_path):
+    path = tmp_path / 'target.py'
+    path.write_bytes(b'"""doc"""\r\nimport random\r\nxs = [1.0, 2.5]\r\nmean = sum(xs) / len(xs)\r\n')
+    _rewrite_in_place(path, str(ROOT / 'rules_numeric.txt'))
+    assert path.read_bytes() == b'"""doc"""\r\nimport statistics\r\nimport random\r\nxs = [1.0, 2.5]\r\nmean = statistics.fmean(xs)\r\n'
+
+
+def test_a_rewrite_inside_an_f_string(tmp_path):
+    path = tmp_path / 'target.py'
+    path.write_text("n = 1\ns = f'{str(n) + \"b\"}!'\n", encoding='utf-8')
+    _rewrite_in_place(path, str(ROOT / 'rules.txt'))
+    # the whole f-string is unparsed again, with quotes that don't clash
+    assert path.read_text(encoding='utf-8') == "n = 1\ns = f\"{f'{n}b'}!\"\n"
+
+
+def test_a_source_that_doesnt_parse_isnt_written(tmp_path):
+    path = tmp_path / 'target.py'
+    path.write_text("x = 1\n", encoding='utf-8')
+    err = io.StringIO()
+    emit(runner.TargetResult(path, "x = (\n", [], []), 'in-place', err=err)
+    assert path.read_text(encoding='utf-8') == "x = 1\n"
+    assert "doesn't parse" in err.getvalue()
@@ -0,0 +1,55 @@
+import json
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+RUN = """
+import json
+import sys
+sys.path.insert(0, {root!r})
+import profiling
+import runner
+
+profiling.enable()
+report = profiling.RunReport()
+for result in runner.run([{target!r}], {rules!r}, workers={workers}, prefetch_stubs=True):
+    report.add(result.path, result.profile)
+print(json.dumps(report.report()))
+"""
+
+
+def _report(tmp_path, workers):
+    target = tmp_path / 'target.py'
+    target.write_text("import random\n\nn = random.randint(0, 5)\n", encoding='utf-8')
+    code = RUN.format(root=str(ROOT), target=str(target), rules=str(ROOT / 'rules.txt'), workers=workers)
+    done = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=600)
+    assert done.returncode == 0, done.stderr
+    return json.loads(done.stdout)
+
+
+def test_the_parent_stub_time_is_reported(tmp_path):
+    report = _report(tmp_path, workers=1)
+    stages = report['stages']
+    assert {'prefetch', 'builtins'} <= stages.keys()
+    # a fresh process loads builtins while prefetching
+    assert stages['prefetch']['phases']['stubs'] > 0
+    parent = sum(stage['phases'].get('stubs', 0) for stage in stages.values())
+    assert report['phases']['stubs']['seconds'] >= parent
+
+
+def test_the_type_db_is_a_stage_with_workers(tmp_path):
+    report = _report(tmp_path, workers=2)
+    assert {'prefetch', 'builtins', 'type_db'} <= report['stages'].keys()
+    assert report['files'] == 1
+
+
+def test_targets_of_the_same_name_get_their_own_cprofile(tmp_path, monkeypatch):
+    import profiling
+
+    monkeypatch.setattr(profiling, '_options', ('*', str(tmp_path / 'prof')))
+    for package in ('a', 'b'):
+        with profiling.target(tmp_path / package / '__init__.py'):
+            pass
+    assert len(list((tmp_path / 'prof').glob('__init__.py-*.prof'))) == 2
@@ -0,0 +1,39 @@
+import ast
+import collections.abc
+import numbers
+
+from matcher import compile_rules
+from rewriter import MAX_REWRITES_PER_NODE, rewrite_source, satisfies
+
+
+def test_constraints_on_mutable_generics_are_invariant():
+    assert satisfies(list[int], collections.abc.Sequence[numbers.Real])
+    assert satisfies(list[int], list[int])
+    assert not satisfies(list[bool], list[int])
+    assert not satisfies(list[int], list[float])  # no numeric promotion inside a list either
+    assert satisfies(dict[str, bool], collections.abc.Mapping[str, int])
+    assert not satisfies(dict[bool, int], collections.abc.Mapping[int, int])
+
+
+def _rewrite(rules, source):
+    return rewrite_source(source, compile_rules(rules))
+
+
+def test_a_parent_sees_its_rewritten_children():
+    result = _rewrite([('g(a)', 'h(a)', 'a:Any'), ('f(h(a))', 'k(a)', 'a:Any')], "y = f(g(x))\n")
+    assert result.new_source == "y = k(x)\n"
+    assert len(result.rewrites) == 2
+
+
+def test_a_replacement_is_rewritten_until_nothing_matches():
+    result = _rewrite([('double(a)', 'a + a', 'a:Any'), ('a + a', '2 * a', 'a:Any')], "y = double(n)\n")
+    assert ast.unparse(ast.parse(result.new_source)) == "y = 2 * n"
+    assert [rewrite.after for rewrite in result.rewrites] == ['n + n', '2 * n']
+
+
+def test_rules_that_undo_each_other_stop():
+    result = _rewrite([('a + 0', '0 + a', 'a:Any'), ('0 + a', 'a + 0', 'a:Any')], "y = n + 0\n")
+    assert len(result.rewrites) == MAX_REWRITES_PER_NODE
+    assert result.new_source == "y = n + 0\n"
+    assert [diagnostic.lineno for diagnostic in result.diagnostics] == [1]
+    assert f"stopped after {MAX_REWRITES_PER_NODE} rewrites" in result.diagnostics[0].message
@@ -0,0 +1,42 @@
+import pytest
+
+import rule_cache
+from errors import RuleError
+import stub_cache
+
+
+RULES = "separator = '----'\nSequence = collections.abc.Sequence\n----\nrandom.randint(0, a) -> random.randrange(a + 1) => a:int\n"
+
+
+def _not_again(setting):
+    raise AssertionError("a cached rule set was parsed again")
+
+
+def test_a_hit_reads_no_rule(tmp_path, monkeypatch):
+    path = tmp_path / 'rules.txt'
+    path.write_text(RULES, encoding='utf-8')
+    setting = [{'path': str(path), 'priority': 1}]
+    built = rule_cache.load(setting)
+
+    stub_cache._memory.clear()
+    monkeypatch.setattr(rule_cache, 'get_rule_packs', _not_again)
+    loaded = rule_cache.load(setting)
+    assert [rule.replacement for rule in loaded.rules] == [rule.replacement for rule in built.rules]
+
+
+def test_the_key_follows_the_file_and_the_pack_settings(tmp_path):
+    path = tmp_path / 'rules.txt'
+    path.write_text(RULES, encoding='utf-8')
+    key = rule_cache.rules_hash(str(path))
+    assert rule_cache.rules_hash([{'path': str(path)}]) == key
+    assert rule_cache.rules_hash([{'path': str(path), 'priority': 2}]) != key
+
+    path.write_text(RULES.replace('Sequence = collections.abc.Sequence', 'Sequence = typing.Sequence'), encoding='utf-8')
+    assert rule_cache.rules_hash(str(path)) != key
+
+
+def test_a_miss_still_checks_the_rules(tmp_path):
+    path = tmp_path / 'rules.txt'
+    path.write_text(RULES + "random.random() -> random.uniform(0, b) => b:int\n", encoding='utf-8')
+    with pytest.raises(RuleError):
+        rule_cache.load(str(path))
@@ -0,0 +1,36 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from conftest import ROOT
+
+
+WORKER = """
+import sys
+from pathlib import Path
+sys.path.insert(0, {root!r})
+import stub_cache
+
+calls = []
+get_stub_names = stub_cache.get_stub_names
+stub_cache.get_stub_names = lambda name: calls.append(name) or get_stub_names(name)
+
+import runner
+runner._init_worker({rules!r}, types_path={types_path!r})
+print(calls)
+"""
+
+
+def _python(code):
+    done = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=600)
+    assert done.returncode == 0, done.stderr
+    return done.stdout.strip()
+
+
+def test_a_worker_with_the_db_reads_no_stub():
+    rules = str(ROOT / 'rules.txt')
+    types_path = _python(f"import sys; sys.path.insert(0, {str(ROOT)!r}); import runner; print(runner._snapshot_types())")
+    try:
+        assert _python(WORKER.format(root=str(ROOT), rules=rules, types_path=types_path)) == '[]'
+    finally:
+        Path(types_path).unlink(missing_ok=True)
@@ -0,0 +1,84 @@
+"""
+one logger per subsystem, all under `opty`:
+    - `rules`: reading and compiling the rule file.
+    - `stubs`: reading typeshed stubs into `TypeObject`s and the stub cache.
+    - `inference`: `analyzer.get_type` and friends.
+    - `rewrite`: rules that matched (or didn't pass their constraints) and what they were rewritten to.
+
+nothing is formatted unless its logger is enabled: messages use `%s` args instead of f-strings, and ast dumps go through `Dump`, which only calls
+`ast.dump` once a handler actually wants the text. by default only warnings get through, to stderr.
+
+`configure(trace=...)` additionally writes every record, debug included, to a json-lines file, one object per line with the subsystem, level,
+message, pid and whatever was passed as `extra={'fields': {...}}`.
+"""
+import ast
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import Optional
+
+
+RULES = logging.getLogger('opty.rules')
+STUBS = logging.getLogger('opty.stubs')
+INFERENCE = logging.getLogger('opty.inference')
+REWRITE = logging.getLogger('opty.rewrite')
+
+_root = logging.getLogger('opty')
+_root.addHandler(logging.NullHandler())  # no `lastResort` stderr spam before `configure`
+_root.propagate = False
+_root.setLevel(logging.WARNING)
+
+_config: tuple[str, Optional[str]] = ('WARNING', None)
+
+
+class Dump:
+    """`ast.dump(node)`, but only when it's turned into a string"""
+    __slots__ = ('node',)
+
+    def __init__(self, node: ast.AST) -> None:
+        self.node = node
+
+    def __str__(self) -> str:
+        return ast.dump(self.node, indent=4) if isinstance(self.node, ast.AST) else repr(self.node)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': record.created, 'subsystem': record.name.removeprefix('opty.'), 'level': record.levelname, 'pid': record.process,
+                 'message': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure(level: str = 'WARNING', trace: Optional[str | Path] = None) -> None:
+    """
+    :param level: what gets printed to stderr
+    :param trace: path of a json-lines file that gets every record, whatever `level` is. appended to, so workers can share it.
+    """
+    global _config
+    _config = (level, None if trace is None else str(trace))
+
+    for handler in _root.handlers[:]:
+        _root.removeHandler(handler)
+        handler.close()
+
+    stderr = logging.StreamHandler(sys.stderr)
+    stderr.setLevel(level)
+    stderr.setFormatter(logging.Formatter('%(name)s: %(levelname)s: %(message)s'))
+    _root.addHandler(stderr)
+
+    if trace is None:
+        _root.setLevel(level)
+    else:
+        file = logging.FileHandler(trace, mode='a', encoding='utf-8')
+        file.setFormatter(JsonLinesFormatter())
+        _root.addHandler(file)
+        _root.setLevel(logging.DEBUG)
+
+
+def config() -> tuple[str, Optional[str]]:
+    """the arguments of the last `configure`, to hand to worker processes"""
+    return _config
@@ -0,0 +1,170 @@
+"""
+the types and module tables `models` has loaded, snapshotted by the parent into one read-only file. every worker maps it instead of loading the
+stubs again.
+
+    header    `MAGIC`, the number of types and of modules, then (start, length) of each section
+    names     u32 offsets[n + 1] into a utf-8 blob. sorted, so a name's id (its position) is found by bisection.
+    bases     u32 offsets[n + 1] into u32 ids: the direct bases of each type
+    records   u64 offsets[n + 1] into pickles of the `TypeObject`s. empty for names that only ever show up as bases.
+    modules   u32 offsets[m + 1] into a utf-8 blob of the module names (sorted), and u64 offsets[m + 1] into pickles of their tables
+
+the arrays are `memoryview`s straight over the mapping, so nothing is copied until a type or a module is asked for, and the OS shares the pages
+between every process that maps the file. subtype checks only need names and bases, so they don't unpickle anything.
+"""
+import array
+import bisect
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+import profiling
+import stub_cache
+
+
+MAGIC = b'OPTYTDB1'
+_SECTIONS = 10
+_HEADER = struct.Struct(f'<8sQQ{2 * _SECTIONS}Q')
+_ALIGN = 8
+
+
+class _Strings:
+    """the i-th string of a blob, decoded when asked for. a sequence, so `bisect` works on it."""
+
+    def __init__(self, offsets: memoryview, blob: memoryview) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def index(self, name: str) -> Optional[int]:
+        i = bisect.bisect_left(self, name)
+        return i if i < len(self) and self[i] == name else None
+
+
+def _strings(names: list[str]) -> tuple[array.array, bytes]:
+    offsets = array.array('I', [0])
+    blob = bytearray()
+    for name in names:
+        blob += name.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+def _pickles(values: list[Optional[Any]]) -> tuple[array.array, bytes]:
+    offsets = array.array('Q', [0])
+    blob = bytearray()
+    for value in values:
+        if value is not None:
+            blob += pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        offsets.append(len(blob))
+    return offsets, bytes(blob)
+
+
+@profiling.timed('stubs')
+def write(path: Path, types: dict[str, Any], tables: dict[str, dict]) -> None:
+    """
+    :param types: `models.types`
+    :param tables: module name -> what `models._build_module_tables` made of it
+    :raise pickle.PicklingError: (and whatever else pickling raises) if something in them can't be pickled. nothing is written then.
+    """
+    names = sorted(set(types) | {base for typ in types.values() for base in typ.bases})
+    ids = {name: i for i, name in enumerate(names)}
+    base_offsets = array.array('I', [0])
+    base_ids = array.array('I')
+    for name in names:
+        if name in types:
+            base_ids.extend(sorted(ids[base] for base in types[name].bases))
+        base_offsets.append(len(base_ids))
+    module_names = sorted(tables)
+
+    sections = [*_strings(names), base_offsets, base_ids, *_pickles([types.get(name) for name in names]), *_strings(module_names),
+                *_pickles([tables[name] for name in module_names])]
+    body = bytearray()
+    places = []
+    for section in sections:
+        data = section.tobytes() if isinstance(section, array.array) else section
+        body += bytes(-(_HEADER.size + len(body)) % _ALIGN)  # keeps the u32/u64 arrays aligned
+        places += [_HEADER.size + len(body), len(data)]
+        body += data
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(fd, mode='wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(names), len(module_names), *places))
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def snapshot(path: Path) -> None:
+    """writes what `models` has loaded in this process to `path`"""
+    import models
+
+    tables = {}
+    for name, module in models.modules.items():
+        if module.is_loaded and (value := stub_cache.load('tables', name)) is not stub_cache.MISSING:
+            tables[name] = value
+    write(path, dict(models.types), tables)
+
+
+class TypeDB:
+    """a file `write` made, mapped read-only"""
+
+    def __init__(self, path: Path) -> None:
+        """:raise ValueError: if it isn't one"""
+        with open(path, mode='rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        magic, self.n_types, self.n_modules, *places = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} isn't a type database")
+        s = [view[start:start + length] for start, length in zip(places[::2], places[1::2])]
+        self._names = _Strings(s[0].cast('I'), s[1])
+        self._base_offsets, self._base_ids = s[2].cast('I'), s[3].cast('I')
+        self._record_offsets, self._records = s[4].cast('Q'), s[5]
+        self._modules = _Strings(s[6].cast('I'), s[7])
+        self._table_offsets, self._tables = s[8].cast('Q'), s[9]
+
+    def bases(self, name: str) -> tuple[str, ...]:
+        """the direct bases of the type called `name`. empty if there's no such type."""
+        i = self._names.index(name)
+        if i is None:
+            return ()
+        return tuple(self._names[j] for j in self._base_ids[self._base_offsets[i]:self._base_offsets[i + 1]])
+
+    def has_type(self, name: str) -> bool:
+        i = self._names.index(name)
+        return i is not None and self._record_offsets[i] != self._record_offsets[i + 1]
+
+    def load_type(self, name: str) -> Optional[Any]:
+        """the `TypeObject` called `name`, unpickled. None if there isn't one."""
+        i = self._names.index(name)
+        if i is None or self._record_offsets[i] == self._record_offsets[i + 1]:
+            return None
+        return pickle.loads(self._records[self._record_offsets[i]:self._record_offsets[i + 1]])
+
+    def module_tables(self, name: str) -> Optional[dict]:
+        i = self._modules.index(name)
+        if i is None:
+            return None
+        return pickle.loads(self._tables[self._table_offsets[i]:self._table_offsets[i + 1]])
+
+
+_attached: Optional[TypeDB] = None
+
+
+def attach(path: Path) -> None:
+    """makes `models` read from the database at `path`. has to happen before `models.load_builtins`, so that it skips them."""
+    global _attached
+    _attached = TypeDB(path)
+
+
+def attached() -> Optional[TypeDB]:
+    return _attached